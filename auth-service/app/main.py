@@ -1,58 +1,139 @@
-import os, uuid, httpx
-from fastapi import FastAPI, HTTPException, Depends, Header, Body
-from sqlmodel import select, Session
+import os, uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Header, Body, Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlmodel import select, delete, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime, timezone
 from typing import Dict, Optional
 
-from .db import init_db, get_session
-from .models import User
-from .schemas import SignupIn, LoginIn, TokenOut, UserOut, HealthResponse, DependencyHealth, Status
-from .security import hash_password, verify_password, mint_token, verify_token
+from . import security, health, metrics, tracing, debug, admission
+from .db import init_db, get_session, get_read_session, get_async_session, async_engine
+from .models import User, RevokedToken
+from .schemas import SignupIn, LoginIn, TokenOut, UserOut, HealthResponse
+from .security import ahash_password, averify_password, needs_rehash, mint_token, verify_token, HashPoolBusy
 
 APP_NAME = "auth-service"
-app = FastAPI(title=APP_NAME)
+# per client IP, "per-minute:burst" ("0" = off)
+signup_limit = admission.RateLimit("signup", os.getenv("RATE_LIMIT_SIGNUP", "5:5"))
+login_limit = admission.RateLimit("login", os.getenv("RATE_LIMIT_LOGIN", "10:10"))
 
-@app.on_event("startup")
-def startup():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     init_db()
+    security.start_hash_pool()
+    health.start(APP_NAME, {"database": health.check_database})
+    admission.start()
+    tracing.start()
+    yield
+    await tracing.stop()
+    await admission.stop()
+    await health.stop()
+    security.stop_hash_pool()
+    await async_engine.dispose()
 
+app = FastAPI(title=APP_NAME, lifespan=lifespan, default_response_class=ORJSONResponse)
+# bcrypt routes get their own concurrency limit so they can't starve /auth/verify
+app.add_middleware(admission.AdmissionMiddleware, router=app.router,
+                   classes={"POST /auth/signup": "bcrypt", "POST /auth/login": "bcrypt"})
+app.add_middleware(metrics.MetricsMiddleware, router=app.router)
+app.add_middleware(tracing.TracingMiddleware, service=APP_NAME)  # added last = outermost
+if debug.DEBUG_ENDPOINTS:
+    app.include_router(debug.router)  # /debug/profile, /debug/slow
+
+@app.exception_handler(HashPoolBusy)
+async def hash_pool_busy(request: Request, exc: HashPoolBusy):
+    return JSONResponse(status_code=503, content={"detail": "Too many password checks in progress, retry shortly"},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+# Served from the background prober's snapshot: O(1), never calls other services inline
 @app.get("/health", response_model=HealthResponse)
-def health():
-    deps: Dict[str, DependencyHealth] = {}
-    # DB touch
-    try:
-        for _ in get_session():
-            pass
-        db_status: Status = "healthy"
-    except Exception as e:
-        db_status = "unhealthy"
-        deps["database"] = DependencyHealth(status="unhealthy", error=str(e))
-    overall: Status = "healthy" if db_status == "healthy" else "unhealthy"
-    return HealthResponse(service=APP_NAME, status=overall, dependencies=deps)
+async def health_check():
+    return health.snapshot()
+
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready(response: Response):
+    if not health.ready():
+        response.status_code = 503
+        return {"status": "not ready"}
+    return {"status": "ready"}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(APP_NAME), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/internal/hash-pool")
+def hash_pool_stats():
+    return security.hash_pool_stats()
 
+@app.get("/internal/admission")
+def admission_stats():
+    return admission.stats()
+
+# bcrypt runs in security's process pool; when its queue is full these return 503 + Retry-After
 @app.post("/auth/signup", response_model=UserOut, status_code=201)
-def signup(body: SignupIn, session: Session = Depends(get_session)):
-    existing = session.exec(select(User).where(User.email == body.email)).first()
+async def signup(body: SignupIn, request: Request, session: AsyncSession = Depends(get_async_session)):
+    signup_limit.check(admission.client_ip(request))
+    existing = (await session.exec(select(User).where(User.email == body.email))).first()
     if existing:
         raise HTTPException(status_code=409, detail="Email already registered")
-    u = User(id=str(uuid.uuid4()), email=body.email, password_hash=hash_password(body.password))
-    session.add(u); session.commit(); session.refresh(u)
+    u = User(id=str(uuid.uuid4()), email=body.email, password_hash=await ahash_password(body.password))
+    session.add(u); await session.commit()
     return UserOut(id=u.id, email=u.email)
 
 @app.post("/auth/login", response_model=TokenOut)
-def login(body: LoginIn, session: Session = Depends(get_session)):
-    u = session.exec(select(User).where(User.email == body.email)).first()
-    if not u or not verify_password(body.password, u.password_hash):
+async def login(body: LoginIn, request: Request, session: AsyncSession = Depends(get_async_session)):
+    login_limit.check(admission.client_ip(request))
+    u = (await session.exec(select(User).where(User.email == body.email))).first()
+    if not u or not await averify_password(body.password, u.password_hash):
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if needs_rehash(u.password_hash):
+        # BCRYPT_ROUNDS changed since this hash was made; upgrade it while we have the password.
+        # Best effort: a busy pool just means it happens on a later login
+        try:
+            u.password_hash = await ahash_password(body.password)
+            session.add(u); await session.commit()
+        except HashPoolBusy:
+            pass
     return TokenOut(access_token=mint_token(u.id, u.email))
 
 @app.post("/auth/verify")
-def verify(payload: Dict = Body(...)):
+def verify(payload: Dict = Body(...), session: Session = Depends(get_read_session)):
     token = payload.get("token")
     if not token:
         raise HTTPException(status_code=400, detail="token required")
     try:
         claims = verify_token(token)
-        return {"user_id": claims["sub"], "email": claims["email"]}
     except Exception:
         raise HTTPException(status_code=401, detail="invalid token")
+    if claims.get("jti") and session.get(RevokedToken, claims["jti"]):
+        raise HTTPException(status_code=401, detail="token revoked")
+    return {"user_id": claims["sub"], "email": claims["email"]}
+
+@app.post("/auth/logout", status_code=204)
+def logout(authorization: Optional[str] = Header(None), session: Session = Depends(get_session)):
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
+    try:
+        claims = verify_token(authorization.split(" ", 1)[1])
+    except Exception:
+        raise HTTPException(status_code=401, detail="invalid token")
+    if not claims.get("jti"):
+        raise HTTPException(status_code=400, detail="token cannot be revoked (no jti)")
+    now = int(datetime.now(timezone.utc).timestamp())
+    # drop entries whose tokens have expired on their own; keeps the revocation list small
+    session.exec(delete(RevokedToken).where(RevokedToken.exp <= now))
+    session.merge(RevokedToken(jti=claims["jti"], exp=int(claims["exp"])))
+    session.commit()
+    return None
+
+# Pulled periodically by the other services' local token verifiers
+@app.get("/auth/revocations")
+def revocations(session: Session = Depends(get_read_session)):
+    now = int(datetime.now(timezone.utc).timestamp())
+    jtis = session.exec(select(RevokedToken.jti).where(RevokedToken.exp > now)).all()
+    return {"revoked": jtis, "generated_at": now}
@@ -7,3 +7,8 @@ class User(SQLModel, table=True):
     email: str = Field(unique=True, index=True)
     password_hash: str
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+class RevokedToken(SQLModel, table=True):
+    jti: str = Field(primary_key=True)
+    exp: int = Field(index=True)  # epoch seconds; rows are useless once the token has expired anyway
+    revoked_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
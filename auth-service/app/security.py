@@ -1,37 +1,132 @@
-import os, jwt
+import os, jwt, uuid, time, asyncio, multiprocessing
 import bcrypt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from . import tracing
 
 # Use AUTH_SECRET_KEY to match docker-compose.yml, fallback to JWT_SECRET for backwards compatibility
 JWT_SECRET = os.getenv("AUTH_SECRET_KEY") or os.getenv("JWT_SECRET", "dev-secret")
 JWT_ALG = os.getenv("AUTH_ALGORITHM", "HS256")
 JWT_TTL_MIN = int(os.getenv("JWT_TTL_MIN", "60"))
+# Optional asymmetric signing (e.g. AUTH_ALGORITHM=RS256): other services then only need the
+# public key (AUTH_PUBLIC_KEY_FILE) or a JWKS file (AUTH_JWKS_FILE), never the signing secret
+JWT_PRIVATE_KEY_FILE = os.getenv("AUTH_PRIVATE_KEY_FILE")
+JWT_PUBLIC_KEY_FILE = os.getenv("AUTH_PUBLIC_KEY_FILE")
+JWT_KEY_ID = os.getenv("AUTH_KEY_ID")
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read()
+
+_SIGNING_KEY = _read(JWT_PRIVATE_KEY_FILE) if JWT_PRIVATE_KEY_FILE else JWT_SECRET
+_VERIFY_KEY = _read(JWT_PUBLIC_KEY_FILE) if JWT_PUBLIC_KEY_FILE else _SIGNING_KEY
 
-def hash_password(raw: str) -> str:
+# bcrypt cost factor; hashes with a different cost are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt is pure CPU: run it in worker processes so a login storm can't starve the event loop
+# (and /auth/verify, /health) in this process
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0")) or len(os.sched_getaffinity(0))
+# requests waiting for a worker beyond this get 503 + Retry-After instead of piling up
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", str(PASSWORD_HASH_WORKERS * 8)))
+
+def _pw_bytes(raw: str) -> bytes:
     # bcrypt limit: 72 bytes - encode to bytes and truncate if needed
-    password_bytes = raw.encode('utf-8')
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-    # Generate salt and hash
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password_bytes, salt)
+    return raw.encode('utf-8')[:72]
+
+def hash_password(raw: str, rounds: int = BCRYPT_ROUNDS) -> str:
     # Return as string (bcrypt hash is ASCII-safe)
-    return hashed.decode('utf-8')
+    return bcrypt.hashpw(_pw_bytes(raw), bcrypt.gensalt(rounds)).decode('utf-8')
 
 def verify_password(raw: str, hashed: str) -> bool:
-    # bcrypt limit: 72 bytes - encode to bytes and truncate if needed
-    password_bytes = raw.encode('utf-8')
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-    # Verify password
-    hashed_bytes = hashed.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, hashed_bytes)
+    return bcrypt.checkpw(_pw_bytes(raw), hashed.encode('utf-8'))
+
+def needs_rehash(hashed: str) -> bool:
+    # "$2b$12$..." -> 12
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+class HashPoolBusy(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+class _HashStats:
+    def __init__(self):
+        self.completed = 0
+        self.rejected = 0
+        self.latency_ms = deque(maxlen=1024)  # recent hash/verify durations, queueing excluded
+
+    def snapshot(self) -> dict:
+        lat = sorted(self.latency_ms)
+        pct = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))], 2) if lat else None
+        return {"completed": self.completed, "rejected": self.rejected,
+                "latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)}}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pending = 0
+_stats = _HashStats()
+
+def _timed(fn, *args):
+    # runs in the worker; returns the CPU time spent there so queueing doesn't skew the numbers
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - t0) * 1000
+
+def start_hash_pool() -> None:
+    global _pool
+    # spawn, not fork: the parent already has an event loop and threads running
+    _pool = ProcessPoolExecutor(PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def stop_hash_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+def _retry_after() -> int:
+    lat = _stats.latency_ms
+    avg_s = (sum(lat) / len(lat) / 1000) if lat else 0.25
+    return max(1, round(_pending * avg_s / PASSWORD_HASH_WORKERS))
+
+async def _run(fn, *args):
+    global _pending
+    if _pool is None:
+        start_hash_pool()
+    if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE:
+        _stats.rejected += 1
+        raise HashPoolBusy(_retry_after())
+    _pending += 1
+    try:
+        with tracing.span("bcrypt", op=fn.__name__, queued=_pending):
+            out, ms = await asyncio.get_running_loop().run_in_executor(_pool, _timed, fn, *args)
+    finally:
+        _pending -= 1
+    _stats.completed += 1
+    _stats.latency_ms.append(ms)
+    return out
+
+async def ahash_password(raw: str) -> str:
+    return await _run(hash_password, raw, BCRYPT_ROUNDS)
+
+async def averify_password(raw: str, hashed: str) -> bool:
+    return await _run(verify_password, raw, hashed)
+
+def hash_pool_stats() -> dict:
+    return {"workers": PASSWORD_HASH_WORKERS, "queue_max": PASSWORD_HASH_QUEUE, "rounds": BCRYPT_ROUNDS,
+            "in_flight": min(_pending, PASSWORD_HASH_WORKERS),
+            "queued": max(0, _pending - PASSWORD_HASH_WORKERS), **_stats.snapshot()}
 
 def mint_token(user_id: str, email: str) -> str:
     now = datetime.now(timezone.utc)
-    payload = {"sub": user_id, "email": email, "iat": int(now.timestamp()),
+    # jti lets a single token be revoked (see /auth/logout and /auth/revocations)
+    payload = {"sub": user_id, "email": email, "jti": uuid.uuid4().hex, "iat": int(now.timestamp()),
                "exp": int((now + timedelta(minutes=JWT_TTL_MIN)).timestamp())}
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALG)
+    headers = {"kid": JWT_KEY_ID} if JWT_KEY_ID else None
+    return jwt.encode(payload, _SIGNING_KEY, algorithm=JWT_ALG, headers=headers)
 
 def verify_token(token: str):
-    return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+    return jwt.decode(token, _VERIFY_KEY, algorithms=[JWT_ALG])
@@ -0,0 +1,91 @@
+"""python -m bench [--mode inprocess|stack] [--scenarios a,b] ... -- see README "Benchmarks"."""
+import argparse, asyncio, json, os, sys
+
+import httpx
+
+from . import harness
+from .scenarios import SCENARIOS
+
+DEFAULT_THRESHOLDS = {"rps": 0.20, "p50_ms": 0.25, "p95_ms": 0.25, "p99_ms": 0.35}
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench", description="MicroBlogg load/benchmark suite")
+    ap.add_argument("--mode", choices=("inprocess", "stack"), default="inprocess",
+                    help="inprocess: all services' ASGI apps in this process; stack: the composed stack via nginx")
+    ap.add_argument("--base-url", default="http://localhost:8080", help="gateway URL for --mode stack")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma separated, from: {', '.join(SCENARIOS)}")
+    ap.add_argument("--duration", type=float, default=10, help="measured seconds per scenario")
+    ap.add_argument("--warmup", type=float, default=2, help="unmeasured seconds before each scenario")
+    ap.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    ap.add_argument("--scale", type=float, default=1.0, help="multiplies the amount of seeded data")
+    ap.add_argument("--baseline", help="baseline JSON (default bench/baselines/<mode>.json)")
+    ap.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    ap.add_argument("--threshold", action="append", default=[], metavar="METRIC=FRACTION",
+                    help="allowed regression, e.g. p99_ms=0.5 or rps=0.1 (repeatable; overrides the baseline's)")
+    ap.add_argument("--json-out", help="also write the raw results here")
+    return ap.parse_args(argv)
+
+
+async def run(args) -> dict:
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"unknown scenario(s): {', '.join(unknown)}")
+    results = {}
+    if args.mode == "inprocess":
+        from .inprocess import InProcessStack
+        async with InProcessStack() as stack:
+            for name in names:
+                results[name] = await _run_one(SCENARIOS[name], stack.client, args)
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=30) as client:
+            for name in names:
+                results[name] = await _run_one(SCENARIOS[name], client, args)
+    return results
+
+
+async def _run_one(scenario, client, args) -> dict:
+    print(f"[{scenario.name}] setting up...", file=sys.stderr)
+    state = await scenario.setup(client, args.scale)
+    print(f"[{scenario.name}] running {args.concurrency} clients for {args.duration}s", file=sys.stderr)
+    return await harness.run_load(scenario, client, state, args.concurrency, args.duration, args.warmup)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    baseline_path = args.baseline or os.path.join(os.path.dirname(__file__), "baselines", f"{args.mode}.json")
+    baseline = None if args.save_baseline else harness.load_baseline(baseline_path)
+
+    results = asyncio.run(run(args))
+    harness.print_results(results, baseline)
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    thresholds = dict(DEFAULT_THRESHOLDS)
+    thresholds.update((baseline or {}).get("thresholds", {}))
+    for spec in args.threshold:
+        metric, _, value = spec.partition("=")
+        if metric not in harness.METRICS:
+            raise SystemExit(f"unknown metric {metric!r}; use one of {', '.join(harness.METRICS)}")
+        thresholds[metric] = float(value)
+
+    if args.save_baseline:
+        config = {k: getattr(args, k) for k in ("mode", "duration", "warmup", "concurrency", "scale")}
+        harness.save_baseline(baseline_path, args.mode, config, results, thresholds)
+        print(f"baseline written to {baseline_path}")
+        return 0
+    if baseline is None:
+        print(f"no baseline at {baseline_path}; run with --save-baseline to create one")
+        return 0
+    problems = harness.compare(results, baseline, thresholds)
+    for p in problems:
+        print(f"REGRESSION {p}")
+    print("FAIL" if problems else "OK: no regressions past thresholds")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
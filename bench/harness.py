@@ -0,0 +1,149 @@
+"""Closed-loop load generation, latency stats and baseline comparison."""
+import asyncio, json, os, platform, random, time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+METRICS = ("rps", "p50_ms", "p95_ms", "p99_ms", "cpu_ms")
+# rps regresses when it drops, latencies when they grow
+HIGHER_IS_BETTER = {"rps"}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, label: str, seconds: float, status: Optional[int]) -> None:
+        self.latencies[label].append(seconds)
+        self.statuses[label][status or 0] += 1
+        if status is None or status >= 400:
+            self.errors[label] += 1
+
+
+def _pct(sorted_ms: List[float], q: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    return sorted_ms[min(len(sorted_ms) - 1, int(q * len(sorted_ms)))]
+
+
+def summarize(rec: Recorder, elapsed: float, cpu_s: float = 0.0) -> Dict[str, Dict]:
+    # cpu_ms: this process's CPU time per request over the whole scenario (all labels); with
+    # --mode inprocess that is client plus services, so it tracks server-side CPU cost
+    total = sum(len(lat) for lat in rec.latencies.values())
+    out = {}
+    for label, lat in sorted(rec.latencies.items()):
+        ms = sorted(x * 1000 for x in lat)
+        out[label] = {
+            "count": len(ms),
+            "errors": rec.errors[label],
+            "statuses": {str(k): v for k, v in sorted(rec.statuses[label].items())},
+            "rps": round(len(ms) / elapsed, 2),
+            "mean_ms": round(sum(ms) / len(ms), 3),
+            "p50_ms": round(_pct(ms, 0.50), 3),
+            "p95_ms": round(_pct(ms, 0.95), 3),
+            "p99_ms": round(_pct(ms, 0.99), 3),
+            "cpu_ms": round(cpu_s * 1000 / total, 3),
+        }
+    return out
+
+
+async def run_load(scenario, client: httpx.AsyncClient, state, concurrency: int,
+                   duration: float, warmup: float, seed: int = 1) -> Dict[str, Dict]:
+    """Runs scenario.step with `concurrency` workers; only requests after the warmup count.
+
+    step(client, state, local, rng) returns (label, awaitable response); `local` is per worker."""
+    rec = Recorder()
+    t_start = time.perf_counter()
+    t_measure = t_start + warmup
+    t_end = t_measure + duration
+
+    async def worker(i: int):
+        rng = random.Random(seed * 1000 + i)
+        local: Dict = {}
+        while True:
+            t0 = time.perf_counter()
+            if t0 >= t_end:
+                return
+            label, pending = scenario.step(client, state, local, rng)
+            try:
+                status = (await pending).status_code
+            except httpx.HTTPError:
+                status = None
+            t1 = time.perf_counter()
+            if t0 >= t_measure:
+                rec.record(label, t1 - t0, status)
+
+    async def cpu_window() -> float:
+        await asyncio.sleep(warmup)
+        c0 = time.process_time()
+        await asyncio.sleep(duration)
+        return time.process_time() - c0
+
+    cpu_s, *_ = await asyncio.gather(cpu_window(), *(worker(i) for i in range(concurrency)))
+    return summarize(rec, duration, cpu_s)
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def machine() -> Dict:
+    """Where a baseline was recorded: numbers from another host aren't comparable."""
+    cpu = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu = next((line.split(":", 1)[1].strip() for line in f if line.startswith("model name")), cpu)
+    except OSError:
+        pass
+    return {"platform": platform.platform(), "python": platform.python_version(), "cpu": cpu,
+            "cpus": os.cpu_count()}
+
+
+def save_baseline(path: str, mode: str, config: Dict, results: Dict, thresholds: Dict) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    doc = {"created": datetime.now(timezone.utc).isoformat(), "mode": mode, "machine": machine(),
+           "config": config, "thresholds": thresholds, "results": results}
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results: Dict, baseline: Dict, thresholds: Dict[str, float]) -> List[str]:
+    """Regression messages for every scenario/label/metric past its threshold (a fraction)."""
+    problems = []
+    for scenario, labels in results.items():
+        for label, cur in labels.items():
+            base = baseline.get("results", {}).get(scenario, {}).get(label)
+            if not base:
+                continue
+            if cur["errors"] > base.get("errors", 0) and cur["errors"] > 0.01 * cur["count"]:
+                problems.append(f"{scenario}/{label}: errors {base.get('errors', 0)} -> {cur['errors']}")
+            for metric, limit in thresholds.items():
+                b, c = base.get(metric), cur.get(metric)
+                if not b or c is None:
+                    continue
+                change = (c - b) / b
+                worse = -change if metric in HIGHER_IS_BETTER else change
+                if worse > limit:
+                    problems.append(f"{scenario}/{label}: {metric} {b} -> {c} ({change:+.0%}, limit {limit:.0%})")
+    return problems
+
+
+def print_results(results: Dict, baseline: Optional[Dict]) -> None:
+    print(f'{"scenario/label":<38}{"count":>8}{"err":>6}{"rps":>10}{"p50":>9}{"p95":>9}{"p99":>9}{"cpu/req":>9}')
+    for scenario, labels in results.items():
+        for label, s in labels.items():
+            base = (baseline or {}).get("results", {}).get(scenario, {}).get(label)
+            line = (f'{scenario + "/" + label:<38}{s["count"]:>8}{s["errors"]:>6}{s["rps"]:>10.1f}'
+                    f'{s["p50_ms"]:>9.2f}{s["p95_ms"]:>9.2f}{s["p99_ms"]:>9.2f}{s.get("cpu_ms", 0):>9.2f}')
+            if base:
+                line += f'   (baseline p95 {base["p95_ms"]:.2f}, rps {base["rps"]:.1f})'
+            print(line)
@@ -0,0 +1,122 @@
+"""Runs all four services' ASGI apps in this process, wired together without sockets.
+
+Each service directory has its own top-level `app` package, so they are imported under
+distinct names (bench_auth, bench_user, ...) through symlinks in a temp dir that is put on
+sys.path - that way auth-service's bcrypt worker processes can import them too. Inter-service
+calls go through each service's UpstreamLimitedTransport over an httpx transport that
+dispatches on the URL host, client calls on the path prefix (like nginx), and Redis is the
+in-memory stand-in from redis_standin.
+"""
+import os, sys, tempfile, importlib
+from contextlib import AsyncExitStack
+from typing import Dict, List, Tuple
+
+import httpx
+
+from . import redis_standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVICES = {
+    # name: (directory, docker-compose host, gateway path prefixes)
+    "auth": ("auth-service", "auth-service", ("/auth",)),
+    "user": ("user-service", "user-service", ("/users",)),
+    "post": ("post-service", "post-service", ("/posts", "/feed")),
+    "comment": ("comment-service", "comment-service", ("/comments",)),
+}
+
+# Same values as docker-compose; anything already set in the environment wins
+DEFAULT_ENV = {
+    "AUTH_SECRET_KEY": "bench-secret",
+    "AUTH_ALGORITHM": "HS256",
+    "AUTH_VERIFY_MODE": "local",
+    "REDIS_HOST": "redis",
+    "REDIS_PORT": "6379",
+    "AUTH_SERVICE_BASE": "http://auth-service:8000",
+    "USER_SERVICE_BASE": "http://user-service:8000",
+    "POST_SERVICE_BASE": "http://post-service:8000",
+    "COMMENT_SERVICE_BASE": "http://comment-service:8000",
+    "TRACE_EXPORTER": "none",
+    # cheaper than production (12) so auth scenarios finish in reasonable time on a laptop
+    "BCRYPT_ROUNDS": "10",
+    # room for every client's login behind the hash workers, so auth_storm measures bcrypt
+    # throughput rather than how fast a small machine sheds
+    "PASSWORD_HASH_QUEUE": "256",
+    # scenarios hammer a handful of users from one address; the benchmark measures throughput
+    "RATE_LIMIT_SIGNUP": "0",
+    "RATE_LIMIT_LOGIN": "0",
+    "RATE_LIMIT_POSTS": "0",
+    "RATE_LIMIT_COMMENTS": "0",
+    # the load generator shares the services' event loop, so latency-based limits would shed on
+    # the generator's own load (and instant 503s let closed-loop clients starve the admitted ones)
+    "ADMISSION_CONTROL": "0",
+}
+
+
+class RoutingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, by_host: Dict[str, object], by_prefix: List[Tuple[str, object]]):
+        # unhandled app errors come back as 500s, like behind uvicorn
+        self._transports = {id(a): httpx.ASGITransport(app=a, raise_app_exceptions=False) for a in by_host.values()}
+        self.by_host = by_host
+        self.by_prefix = by_prefix
+
+    def _target(self, request: httpx.Request):
+        app = self.by_host.get(request.url.host)
+        if app is None:
+            path = request.url.path
+            app = next((a for prefix, a in self.by_prefix if path.startswith(prefix)), None)
+        if app is None:
+            raise httpx.ConnectError(f"no in-process service for {request.url}", request=request)
+        return self._transports[id(app)]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._target(request).handle_async_request(request)
+
+
+class InProcessStack:
+    """async with InProcessStack() as stack: stack.client -> gateway-like client"""
+
+    def __init__(self):
+        self.modules: Dict[str, object] = {}
+        self._tmp = tempfile.TemporaryDirectory(prefix="microblogg-bench-")
+        self._stack = AsyncExitStack()
+        self.client: httpx.AsyncClient = None
+
+    def _import(self) -> None:
+        redis_standin.install()
+        for k, v in DEFAULT_ENV.items():
+            os.environ.setdefault(k, v)
+        pkgs = os.path.join(self._tmp.name, "pkgs")
+        os.makedirs(pkgs)
+        sys.path.insert(0, pkgs)
+        for name, (directory, _, _) in SERVICES.items():
+            os.symlink(os.path.join(ROOT, directory, "app"), os.path.join(pkgs, f"bench_{name}"))
+            # module-level settings are read at import time, so set this service's DB first
+            os.environ["DATABASE_URL"] = f"sqlite:///{self._tmp.name}/{name}.db"
+            os.environ["TRACE_FILE"] = f"{self._tmp.name}/{name}-traces.jsonl"
+            self.modules[name] = importlib.import_module(f"bench_{name}.main")
+        os.environ.pop("DATABASE_URL")
+
+    async def __aenter__(self) -> "InProcessStack":
+        self._import()
+        apps = {name: m.app for name, m in self.modules.items()}
+        by_host = {SERVICES[n][1]: a for n, a in apps.items()}
+        by_prefix = [(p, apps[n]) for n, (_, _, prefixes) in SERVICES.items() for p in prefixes]
+        for name, mod in self.modules.items():
+            http_client = getattr(mod, "http_client", None)
+            if http_client is not None:
+                # the lifespan's http_client.start() keeps an already-set client. Routed through the
+                # service's own UpstreamLimitedTransport, so per-upstream caps, metrics and spans
+                # cost what they cost in the containers
+                http_client._transport = http_client.UpstreamLimitedTransport(
+                    RoutingTransport(by_host, by_prefix), http_client.HTTP_MAX_PER_UPSTREAM)
+                http_client._client = httpx.AsyncClient(transport=http_client._transport, timeout=30)
+            await self._stack.enter_async_context(mod.app.router.lifespan_context(mod.app))
+        self.client = httpx.AsyncClient(transport=RoutingTransport(by_host, by_prefix),
+                                        base_url="http://gateway", timeout=30)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.client.aclose()
+        await self._stack.aclose()
+        self._tmp.cleanup()
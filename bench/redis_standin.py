@@ -0,0 +1,308 @@
+"""In-memory stand-in for the parts of redis-py the services use, for in-process benchmarks.
+
+install() swaps redis.Redis / redis.asyncio.Redis before the services are imported, so every
+client they create (caches, invalidation listeners, the post-events stream) shares one
+in-process store.
+"""
+import asyncio, time
+from typing import Dict, List, Optional, Set, Tuple
+
+import redis
+import redis.asyncio
+from redis.exceptions import ResponseError
+
+
+class _Store:
+    def __init__(self):
+        self.data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self.channels: Dict[str, Set[asyncio.Queue]] = {}
+        # stream -> [(id, fields)]; (stream, group) -> {"last": id, "pending": {id: [consumer, delivered_at]}}
+        self.streams: Dict[str, List[Tuple[str, Dict[str, str]]]] = {}
+        self.groups: Dict[Tuple[str, str], Dict] = {}
+        self._stream_added: Optional[asyncio.Event] = None
+        self._last_id = (0, 0)
+
+    def get(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, ttl=None, nx=False):
+        if nx and self.get(key) is not None:
+            return None
+        self.data[key] = (str(value), time.monotonic() + ttl if ttl else None)
+        return True
+
+    def incrby(self, key, n):
+        value = int(self.get(key) or 0) + n
+        item = self.data.get(key)
+        self.data[key] = (str(value), item[1] if item else None)
+        return value
+
+    def expire(self, key, ttl):
+        value = self.get(key)
+        if value is None:
+            return False
+        self.data[key] = (value, time.monotonic() + ttl)
+        return True
+
+    def delete(self, *keys):
+        return sum(self.data.pop(k, None) is not None for k in keys)
+
+    def publish(self, channel, message):
+        subs = self.channels.get(channel, ())
+        for q in subs:
+            q.put_nowait({"type": "message", "channel": channel, "data": str(message)})
+        return len(subs)
+
+    # streams: just enough of XADD / XGROUP / XREADGROUP / XACK / XAUTOCLAIM for the
+    # post-events outbox relay and its consumer group
+    def _next_id(self) -> str:
+        ms = int(time.time() * 1000)
+        self._last_id = (ms, 0) if ms > self._last_id[0] else (self._last_id[0], self._last_id[1] + 1)
+        return "%d-%d" % self._last_id
+
+    def xadd(self, stream, fields, maxlen=None):
+        entries = self.streams.setdefault(stream, [])
+        msg_id = self._next_id()
+        entries.append((msg_id, {k: str(v) for k, v in fields.items()}))
+        if maxlen is not None and len(entries) > maxlen:
+            del entries[:len(entries) - maxlen]
+        if self._stream_added is not None:
+            self._stream_added.set()
+            self._stream_added = None
+        return msg_id
+
+    def xgroup_create(self, stream, group, id="$", mkstream=False):
+        if stream not in self.streams:
+            if not mkstream:
+                raise ResponseError("ERR The XGROUP subcommand requires the key to exist")
+            self.streams[stream] = []
+        if (stream, group) in self.groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        entries = self.streams[stream]
+        last = entries[-1][0] if id == "$" and entries else ("0-0" if id == "$" else id)
+        self.groups[(stream, group)] = {"last": last, "pending": {}}
+        return True
+
+    def xreadgroup_now(self, group, consumer, stream, count):
+        g = self.groups.get((stream, group))
+        if g is None:
+            raise ResponseError("NOGROUP No such key or consumer group")
+        new = [e for e in self.streams.get(stream, ()) if _id_key(e[0]) > _id_key(g["last"])][:count]
+        for msg_id, _ in new:
+            g["pending"][msg_id] = [consumer, time.monotonic()]
+        if new:
+            g["last"] = new[-1][0]
+        return new
+
+    def stream_added(self) -> asyncio.Event:
+        if self._stream_added is None:
+            self._stream_added = asyncio.Event()
+        return self._stream_added
+
+    def xack(self, stream, group, *ids):
+        pending = self.groups.get((stream, group), {}).get("pending", {})
+        return sum(pending.pop(i, None) is not None for i in ids)
+
+    def xautoclaim(self, stream, group, consumer, min_idle_ms, start_id="0-0", count=100):
+        pending = self.groups[(stream, group)]["pending"]
+        entries = dict(self.streams.get(stream, ()))
+        now = time.monotonic()
+        claimable = sorted((i for i, (_, at) in pending.items()
+                            if _id_key(i) >= _id_key(start_id) and (now - at) * 1000 >= min_idle_ms), key=_id_key)
+        claimed, deleted = [], []
+        for msg_id in claimable[:count]:
+            if msg_id in entries:
+                pending[msg_id] = [consumer, now]
+                claimed.append((msg_id, entries[msg_id]))
+            else:
+                pending.pop(msg_id)  # trimmed away while pending
+                deleted.append(msg_id)
+        next_id = claimable[count] if len(claimable) > count else "0-0"
+        return [next_id, claimed, deleted]
+
+
+def _id_key(msg_id: str) -> Tuple[int, int]:
+    ms, _, seq = msg_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+_store = _Store()
+
+
+class StandInRedis:
+    """Sync client (redis.Redis)."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get(self, key):
+        return _store.get(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        return _store.set(key, value, ex or (px / 1000 if px else None), nx)
+
+    def setex(self, key, ttl, value):
+        return _store.set(key, value, ttl)
+
+    def pexpire(self, key, ms):
+        return _store.expire(key, ms / 1000)
+
+    def incrby(self, key, amount=1):
+        return _store.incrby(key, amount)
+
+    def expire(self, key, seconds):
+        return _store.expire(key, seconds)
+
+    def delete(self, *keys):
+        return _store.delete(*keys)
+
+    def publish(self, channel, message):
+        return _store.publish(channel, message)
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        return _store.xadd(name, fields, maxlen)
+
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class _PubSub:
+    def __init__(self):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._channels: Set[str] = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def subscribe(self, *channels):
+        for ch in channels:
+            self._channels.add(ch)
+            _store.channels.setdefault(ch, set()).add(self._queue)
+            self._queue.put_nowait({"type": "subscribe", "channel": ch, "data": len(self._channels)})
+
+    async def listen(self):
+        while True:
+            yield await self._queue.get()
+
+    async def aclose(self):
+        for ch in self._channels:
+            _store.channels.get(ch, set()).discard(self._queue)
+        self._channels.clear()
+
+
+class StandInAsyncRedis:
+    """Async client (redis.asyncio.Redis)."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def get(self, key):
+        return _store.get(key)
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        return _store.set(key, value, ex or (px / 1000 if px else None), nx)
+
+    async def setex(self, key, ttl, value):
+        return _store.set(key, value, ttl)
+
+    async def pexpire(self, key, ms):
+        return _store.expire(key, ms / 1000)
+
+    async def incrby(self, key, amount=1):
+        return _store.incrby(key, amount)
+
+    async def expire(self, key, seconds):
+        return _store.expire(key, seconds)
+
+    async def delete(self, *keys):
+        return _store.delete(*keys)
+
+    async def publish(self, channel, message):
+        return _store.publish(channel, message)
+
+    async def xadd(self, name, fields, maxlen=None, approximate=True):
+        return _store.xadd(name, fields, maxlen)
+
+    async def xgroup_create(self, name, groupname, id="$", mkstream=False):
+        return _store.xgroup_create(name, groupname, id, mkstream)
+
+    async def xreadgroup(self, groupname, consumername, streams, count=None, block=None):
+        # RESP2 shape: [[stream, [(id, fields), ...]], ...]; only ">" (new messages) is supported
+        (stream, _), = streams.items()
+        deadline = time.monotonic() + block / 1000 if block else None
+        while True:
+            added = _store.stream_added()
+            new = _store.xreadgroup_now(groupname, consumername, stream, count or 1 << 30)
+            if new:
+                return [[stream, new]]
+            remaining = deadline - time.monotonic() if deadline is not None else 0
+            if remaining <= 0:
+                return []
+            try:
+                await asyncio.wait_for(added.wait(), remaining)
+            except asyncio.TimeoutError:
+                return []
+
+    async def xack(self, name, groupname, *ids):
+        return _store.xack(name, groupname, *ids)
+
+    async def xautoclaim(self, name, groupname, consumername, min_idle_time, start_id="0-0", count=None):
+        return _store.xautoclaim(name, groupname, consumername, min_idle_time, start_id, count or 100)
+
+    async def ping(self):
+        return True
+
+    def pubsub(self):
+        return _PubSub()
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+    async def aclose(self):
+        pass
+
+    close = aclose
+
+
+class _Pipeline:
+    """Queues async client calls and runs them in order on execute()."""
+
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._calls.clear()
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        calls, self._calls = self._calls, []
+        return [await method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+def install() -> None:
+    redis.Redis = StandInRedis
+    redis.asyncio.Redis = StandInAsyncRedis
@@ -0,0 +1,187 @@
+"""Benchmark scenarios. Each has async setup(client, scale) -> state, and
+step(client, state, local, rng) -> (label, awaitable response) used by harness.run_load."""
+import asyncio, uuid
+from typing import Dict, List
+
+import httpx
+
+PASSWORD = "bench-password-123"
+
+
+async def _check(resp_coro) -> httpx.Response:
+    r = await resp_coro
+    r.raise_for_status()
+    return r
+
+
+async def _bounded(coros, limit: int = 16):
+    sem = asyncio.Semaphore(limit)
+
+    async def run(c):
+        async with sem:
+            return await c
+    return await asyncio.gather(*(run(c) for c in coros))
+
+
+async def make_user(client: httpx.AsyncClient) -> Dict:
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    await _check(client.post("/auth/signup", json={"email": email, "password": PASSWORD}))
+    r = await _check(client.post("/auth/login", json={"email": email, "password": PASSWORD}))
+    token = r.json()["access_token"]
+    return {"email": email, "headers": {"Authorization": f"Bearer {token}"}}
+
+
+async def make_posts(client: httpx.AsyncClient, user: Dict, n: int) -> List[str]:
+    rs = await _bounded(_check(client.post("/posts", headers=user["headers"],
+                                           json={"title": f"bench post {i}", "body": "lorem ipsum " * 20}))
+                        for i in range(n))
+    return [r.json()["id"] for r in rs]
+
+
+class AuthStorm:
+    """Signup/login storm: mostly logins of existing users, some fresh signups."""
+    name = "auth_storm"
+
+    async def setup(self, client, scale: float) -> Dict:
+        users = await _bounded((make_user(client) for _ in range(max(4, int(20 * scale)))), 4)
+        return {"emails": [u["email"] for u in users]}
+
+    def step(self, client, state, local, rng):
+        if rng.random() < 0.8:
+            email = rng.choice(state["emails"])
+            return "login", client.post("/auth/login", json={"email": email, "password": PASSWORD})
+        email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+        return "signup", client.post("/auth/signup", json={"email": email, "password": PASSWORD})
+
+
+class BrowsePosts:
+    """Read-heavy browsing: skewed single-post reads, first pages, next pages and batch gets."""
+    name = "browse_posts"
+
+    async def setup(self, client, scale: float) -> Dict:
+        user = await make_user(client)
+        return {"ids": await make_posts(client, user, max(20, int(300 * scale)))}
+
+    def step(self, client, state, local, rng):
+        ids = state["ids"]
+        x = rng.random()
+        if x < 0.6:
+            # Pareto-ish popularity: a few posts get most of the reads
+            i = min(len(ids) - 1, int(rng.paretovariate(1.2)) - 1)
+            return "get_post", client.get(f"/posts/{ids[i]}")
+        if x < 0.8:
+            return "list_first_page", self._page(client, local, None)
+        if x < 0.95 and local.get("cursor"):
+            return "list_next_page", self._page(client, local, local["cursor"])
+        return "batch_get", client.get("/posts:batchGet", params={"ids": ",".join(rng.sample(ids, min(20, len(ids))))})
+
+    async def _page(self, client, local, cursor):
+        params = {"limit": 20}
+        if cursor:
+            params["cursor"] = cursor
+        r = await client.get("/posts", params=params)
+        local["cursor"] = r.headers.get("X-Next-Cursor")
+        return r
+
+
+class HotPostComments:
+    """Comment burst on one hot post, with readers listing its comments."""
+    name = "hot_post_comments"
+
+    async def setup(self, client, scale: float) -> Dict:
+        users = await _bounded((make_user(client) for _ in range(max(2, int(8 * scale)))), 4)
+        post_id = (await make_posts(client, users[0], 1))[0]
+        return {"users": users, "post_id": post_id}
+
+    def step(self, client, state, local, rng):
+        if rng.random() < 0.8:
+            user = rng.choice(state["users"])
+            return "create_comment", client.post("/comments", headers=user["headers"],
+                                                 json={"postId": state["post_id"], "body": "first!"})
+        return "list_comments", client.get("/comments", params={"postId": state["post_id"], "limit": 20})
+
+
+class DeepPagination:
+    """Walks the whole post list with cursors, against deep offset pages of the same size."""
+    name = "deep_pagination"
+    page_size = 50
+
+    async def setup(self, client, scale: float) -> Dict:
+        user = await make_user(client)
+        n = max(200, int(1000 * scale))
+        await make_posts(client, user, n)
+        return {"total": n}
+
+    def step(self, client, state, local, rng):
+        local["n"] = local.get("n", 0) + 1
+        if local["n"] % 2:
+            return "cursor_page", self._walk(client, local)
+        offset = rng.randrange(state["total"] // 2, state["total"])
+        return "offset_page", client.get("/posts", params={"limit": self.page_size, "offset": offset})
+
+    async def _walk(self, client, local):
+        params = {"limit": self.page_size}
+        if local.get("cursor"):
+            params["cursor"] = local["cursor"]
+        r = await client.get("/posts", params=params)
+        local["cursor"] = r.headers.get("X-Next-Cursor")  # None at the end -> start over
+        return r
+
+
+class FeedPage:
+    """One rendered post list page: GET /feed against /posts plus a profile and comment
+    list call per post (the client-side fan-out /feed replaces)."""
+    name = "feed_page"
+    page_size = 20
+
+    async def setup(self, client, scale: float) -> Dict:
+        users = await _bounded((make_user(client) for _ in range(max(4, int(10 * scale)))), 4)
+        await _bounded(_check(client.post("/users/me/profile", headers=u["headers"], json={"display_name": u["email"]}))
+                       for u in users)
+        ids = []
+        for u in users:
+            ids += await make_posts(client, u, max(5, int(10 * scale)))
+        await _bounded(_check(client.post("/comments:batch", headers=users[0]["headers"],
+                                          json={"items": [{"postId": i, "body": "nice"}] * 3}))
+                       for i in ids)
+        return {}
+
+    def step(self, client, state, local, rng):
+        if rng.random() < 0.5:
+            return "feed", client.get("/feed", params={"limit": self.page_size})
+        return "list_fan_out", self._fan_out(client)
+
+    async def _fan_out(self, client):
+        r = await _check(client.get("/posts", params={"limit": self.page_size}))
+        posts = r.json()
+        await asyncio.gather(*(client.get(f"/users/{p['authorId']}") for p in posts),
+                             *(client.get("/comments", params={"postId": p["id"], "limit": 3}) for p in posts))
+        return r
+
+
+class LargePages:
+    """Full 100-post list pages of ~100 KB posts (serialization and compression cost); the
+    _fields variant asks for the list-view columns only."""
+    page_size = 100
+
+    def __init__(self, name: str, fields=None):
+        self.name = name
+        self.fields = fields
+
+    async def setup(self, client, scale: float) -> Dict:
+        user = await make_user(client)
+        body = ("lorem ipsum dolor sit amet " * 3800)[:100_000]
+        await _bounded(_check(client.post("/posts", headers=user["headers"], json={"title": f"large {i}", "body": body}))
+                       for i in range(max(100, int(200 * scale))))
+        return {}
+
+    def step(self, client, state, local, rng):
+        params = {"limit": self.page_size}
+        if self.fields:
+            params["fields"] = self.fields
+        return "list_page", client.get("/posts", params=params)
+
+
+SCENARIOS = {s.name: s for s in (AuthStorm(), BrowsePosts(), HotPostComments(), DeepPagination(), FeedPage(),
+                                 LargePages("large_pages"),
+                                 LargePages("large_pages_fields", "id,authorId,title,created_at"))}
@@ -0,0 +1,330 @@
+import os, math, time, json, asyncio, logging
+from collections import deque
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request
+
+# Load shedding in two parts:
+# - an adaptive (AIMD) concurrency limit per route class ("read", "write", or a class a service
+#   assigns to a route). Past the limit a request gets an immediate 503 + Retry-After instead of
+#   queueing in the threadpool (optionally after a short bounded wait, ADMISSION_QUEUE_*). The
+#   limit grows while requests are as fast as the route's recent best and shrinks when they
+#   queue up (latency > ADMISSION_LATENCY_TOLERANCE x baseline + ADMISSION_LATENCY_SLACK_MS) or
+#   fail.
+# - token buckets per user / client IP for expensive writes (RateLimit). Buckets live in-process;
+#   every RATE_LIMIT_SYNC_S the tokens each replica handed out are added to a per-minute Redis
+#   counter, and a key that is over its limit across all replicas is drained locally. So the
+#   request path never waits on Redis, and the global limit holds to within one sync interval.
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "1") == "1"
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "20"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "200"))
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "2.0"))
+# queueing that short is fine; keeps a burst on a 2 ms route from counting as overload
+ADMISSION_LATENCY_SLACK_S = float(os.getenv("ADMISSION_LATENCY_SLACK_MS", "50")) / 1000
+ADMISSION_WINDOW_S = float(os.getenv("ADMISSION_WINDOW_S", "10"))  # baseline = best latency of the last 2 windows
+# opt-in: up to ADMISSION_QUEUE_MAX requests per class wait ADMISSION_QUEUE_TIMEOUT_MS for a
+# slot before being shed, to smooth bursts just over the limit. Keep the wait short, or the
+# latency pile-up shedding avoids comes back. 0 (default) sheds at once
+ADMISSION_QUEUE_MAX = int(os.getenv("ADMISSION_QUEUE_MAX", "0"))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "20")) / 1000
+ADMISSION_RETRY_AFTER_S = int(os.getenv("ADMISSION_RETRY_AFTER_S", "1"))
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+RATE_LIMIT_SYNC_S = float(os.getenv("RATE_LIMIT_SYNC_S", "1"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+_BACKOFF = 0.9
+_EXEMPT = ("/health", "/metrics", "/internal/", "/debug/")
+_REJECT_BODY = json.dumps({"detail": "Overloaded, retry shortly"}).encode()
+
+log = logging.getLogger(__name__)
+
+
+class ConcurrencyLimit:
+    __slots__ = ("limit", "in_flight", "admitted", "waited", "rejected", "waiters", "_next_decrease")
+
+    def __init__(self, initial: int = ADMISSION_INITIAL_LIMIT):
+        self.limit = float(max(ADMISSION_MIN_LIMIT, min(ADMISSION_MAX_LIMIT, initial)))
+        self.in_flight = 0
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.waiters: deque = deque()  # futures of queued requests, oldest first
+        self._next_decrease = 0.0
+
+    def acquire(self) -> bool:
+        # no overtaking: a free slot goes to the queue first (see release)
+        if self.in_flight >= int(self.limit) or self.waiters:
+            return False
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    async def wait(self) -> bool:
+        """Queues for a slot for up to ADMISSION_QUEUE_TIMEOUT_MS. False: queue full or timed out."""
+        if len(self.waiters) >= ADMISSION_QUEUE_MAX or ADMISSION_QUEUE_TIMEOUT_S <= 0:
+            self.rejected += 1
+            return False
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.waiters.append(fut)
+        timer = loop.call_later(ADMISSION_QUEUE_TIMEOUT_S, lambda: fut.done() or fut.set_result(False))
+        try:
+            granted = await fut
+        except asyncio.CancelledError:
+            # client went away; if the slot had already been handed over, pass it on
+            if fut.done() and not fut.cancelled() and fut.result():
+                self.release()
+            raise
+        finally:
+            timer.cancel()
+            if fut in self.waiters:
+                self.waiters.remove(fut)
+        if not granted:
+            self.rejected += 1
+            return False
+        self.waited += 1
+        return True
+
+    def release(self) -> None:
+        # the oldest waiter takes the slot over (in_flight stays), unless the limit shrank meanwhile
+        while self.waiters and self.in_flight <= int(self.limit):
+            fut = self.waiters.popleft()
+            if not fut.done():
+                fut.set_result(True)
+                self.admitted += 1
+                return
+        self.in_flight -= 1
+
+    def sample(self, rtt: float, overloaded: bool) -> None:
+        now = time.monotonic()
+        if overloaded:
+            # multiplicative decrease, at most once per round trip so one burst doesn't collapse it
+            if now >= self._next_decrease:
+                self.limit = max(ADMISSION_MIN_LIMIT, self.limit * _BACKOFF)
+                self._next_decrease = now + rtt
+        elif self.in_flight * 2 >= self.limit:
+            # additive increase, only while the limit is actually being used
+            self.limit = min(ADMISSION_MAX_LIMIT, self.limit + 1)
+
+
+class _Baseline:
+    """Best latency of a route over the last two windows: its cost without queueing."""
+    __slots__ = ("best", "prev", "window_end")
+
+    def __init__(self):
+        self.best = self.prev = math.inf
+        self.window_end = time.monotonic() + ADMISSION_WINDOW_S
+
+    def update(self, rtt: float) -> float:
+        now = time.monotonic()
+        if now >= self.window_end:
+            self.prev, self.best = self.best, math.inf
+            self.window_end = now + ADMISSION_WINDOW_S
+        self.best = min(self.best, rtt)
+        return min(self.best, self.prev)
+
+
+_classes: Dict[str, ConcurrencyLimit] = {}
+
+
+class _AdmittedRoute:
+    __slots__ = ("app", "limit", "baseline")
+
+    def __init__(self, app, limit: ConcurrencyLimit):
+        self.app = app
+        self.limit = limit
+        self.baseline = _Baseline()
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit
+        if not limit.acquire() and not await limit.wait():
+            await send({"type": "http.response.start", "status": 503, "headers": [
+                (b"content-type", b"application/json"), (b"retry-after", str(ADMISSION_RETRY_AFTER_S).encode()),
+                (b"content-length", str(len(_REJECT_BODY)).encode())]})
+            await send({"type": "http.response.body", "body": _REJECT_BODY})
+            return
+        t0 = time.perf_counter()
+        sampled = False
+
+        def done(status: int) -> None:
+            nonlocal sampled
+            if not sampled:
+                sampled = True
+                rtt = time.perf_counter() - t0
+                base = self.baseline.update(rtt)
+                limit.sample(rtt, status >= 500 or rtt > base * ADMISSION_LATENCY_TOLERANCE + ADMISSION_LATENCY_SLACK_S)
+
+        async def send_status(message):
+            # latency to the response headers, so streamed responses count as fast
+            if message["type"] == "http.response.start":
+                done(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        except BaseException:
+            done(500)
+            raise
+        finally:
+            limit.release()
+
+
+class AdmissionMiddleware:
+    """Wraps each route's app like MetricsMiddleware does, so rejection happens after routing
+    (the route's class and latency baseline are known) but before the request body is read.
+    `classes` maps "METHOD /route/path" to a class name; other routes are "read" (GET/HEAD)
+    or "write". `initial` overrides ADMISSION_INITIAL_LIMIT per class. Health, metrics, /internal
+    and /debug routes are never limited."""
+
+    def __init__(self, app, router, classes: Optional[Dict[str, str]] = None,
+                 initial: Optional[Dict[str, int]] = None):
+        self.app = app
+        if not ADMISSION_CONTROL:
+            return
+        classes = classes or {}
+        initial = initial or {}
+        for route in router.routes:
+            methods = getattr(route, "methods", None)
+            if not methods or isinstance(route.app, _AdmittedRoute) or route.path.startswith(_EXEMPT):
+                continue
+            method = sorted(methods)[0]
+            name = classes.get(f"{method} {route.path}") or ("read" if methods <= {"GET", "HEAD"} else "write")
+            route.app = _AdmittedRoute(route.app, _classes.setdefault(
+                name, ConcurrencyLimit(initial.get(name, ADMISSION_INITIAL_LIMIT))))
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+
+
+class RateLimit:
+    """Token bucket per key: `spec` is "per-minute:burst", e.g. "30:10"; "0" disables it."""
+
+    def __init__(self, name: str, spec: str):
+        per_minute, _, burst = spec.partition(":")
+        self.name = name
+        self.rate = float(per_minute) / 60
+        self.burst = float(burst or per_minute)
+        self.buckets: Dict[str, list] = {}  # key -> [tokens, last refill]
+        self.pending: Dict[str, int] = {}   # tokens taken since the last Redis sync
+        self.allowed = 0
+        self.limited = 0
+        _rate_limits[name] = self
+
+    def _bucket(self, key: str, now: float) -> list:
+        b = self.buckets.get(key)
+        if b is None:
+            if len(self.buckets) >= RATE_LIMIT_MAX_KEYS:
+                del self.buckets[next(iter(self.buckets))]
+            b = self.buckets[key] = [self.burst, now]
+        else:
+            b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+            b[1] = now
+        return b
+
+    def check(self, key: str, n: int = 1) -> None:
+        """Takes `n` tokens for `key` (one per item of a batch) or raises 429 with the seconds
+        until there are enough; all or nothing."""
+        if self.rate <= 0 or n <= 0:
+            return
+        if n > self.burst:
+            # the bucket never holds that many, so there is no point in retrying
+            self.limited += 1
+            raise HTTPException(status_code=429, detail=f"Rate limit exceeded: at most {self.burst:g} at once")
+        b = self._bucket(key, time.monotonic())
+        if b[0] < n:
+            self.limited += 1
+            raise HTTPException(status_code=429, detail="Rate limit exceeded",
+                                headers={"Retry-After": str(math.ceil((n - b[0]) / self.rate))})
+        b[0] -= n
+        self.pending[key] = self.pending.get(key, 0) + n
+        self.allowed += n
+
+    def apply_global(self, key: str, used: int) -> None:
+        # `used`: tokens all replicas took for key this minute; the minute allows burst + one
+        # minute of refill, anything beyond that comes off the local bucket
+        b = self._bucket(key, time.monotonic())
+        b[0] = min(b[0], self.burst + self.rate * 60 - used)
+
+    def prune(self) -> None:
+        # a full bucket is the same as no bucket
+        now = time.monotonic()
+        full = [k for k, (tokens, last) in self.buckets.items() if tokens + (now - last) * self.rate >= self.burst]
+        for k in full:
+            del self.buckets[k]
+
+
+_rate_limits: Dict[str, RateLimit] = {}
+_sync_task: Optional[asyncio.Task] = None
+_sync_stats: Dict[str, int] = dict.fromkeys(("syncs", "errors"), 0)
+
+
+def client_ip(request: Request) -> str:
+    # nginx overwrites X-Real-IP with the connecting address, so clients can't pick their key
+    return request.headers.get("x-real-ip") or (request.client.host if request.client else "unknown")
+
+
+async def sync_once(r) -> None:
+    minute = int(time.time() // 60)
+    batch: list = []
+    async with r.pipeline(transaction=False) as pipe:
+        for rl in _rate_limits.values():
+            pending, rl.pending = rl.pending, {}
+            for key, n in pending.items():
+                redis_key = f"ratelimit:{rl.name}:{key}:{minute}"
+                pipe.incrby(redis_key, n)
+                pipe.expire(redis_key, 120)
+                batch.append((rl, key))
+        results = await pipe.execute() if batch else []
+    for (rl, key), used in zip(batch, results[::2]):
+        rl.apply_global(key, int(used))
+    for rl in _rate_limits.values():
+        rl.prune()
+    _sync_stats["syncs"] += 1
+
+
+async def _sync() -> None:
+    import redis.asyncio as aredis
+    r = aredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    try:
+        while True:
+            await asyncio.sleep(RATE_LIMIT_SYNC_S)
+            try:
+                await sync_once(r)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # local buckets keep working; only the cross-replica part is missing meanwhile
+                _sync_stats["errors"] += 1
+                log.warning("rate limit sync failed: %s", e)
+    finally:
+        await r.aclose()
+
+
+def start() -> None:
+    global _sync_task
+    if REDIS_HOST and _sync_task is None and any(rl.rate > 0 for rl in _rate_limits.values()):
+        _sync_task = asyncio.get_running_loop().create_task(_sync())
+
+
+async def stop() -> None:
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        try:
+            await _sync_task
+        except asyncio.CancelledError:
+            pass
+        _sync_task = None
+
+
+def stats() -> Dict:
+    return {
+        "concurrency": {name: {"limit": int(c.limit), "in_flight": c.in_flight, "queued": len(c.waiters),
+                               "admitted": c.admitted, "waited": c.waited, "rejected": c.rejected} for name, c in _classes.items()},
+        "rate_limits": {name: {"per_minute": round(rl.rate * 60, 3), "burst": rl.burst, "allowed": rl.allowed,
+                               "limited": rl.limited, "keys": len(rl.buckets)} for name, rl in _rate_limits.items()},
+        "redis_sync": {**_sync_stats, "running": _sync_task is not None},
+    }
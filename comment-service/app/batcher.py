@@ -0,0 +1,168 @@
+import os, time, asyncio, logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import tracing
+from .db import Shard, shards, shard_for
+
+# Group commit for hot inserts. Handlers hand their rows to a WriteBatcher and await it; one
+# writer task per batcher and shard takes everything queued (waiting up to
+# WRITE_BATCH_WINDOW_MS for more, at most WRITE_BATCH_MAX rows) and commits it as one
+# transaction, so a burst costs one WAL sync instead of one per row and inserts stop queueing
+# on SQLite's write lock. A caller resumes only after its row's transaction committed. If a
+# batch fails, its rows are retried one transaction each, so a bad row only fails its own
+# request. The writer runs the batch's SQL under each traced caller's "write_batch" span
+# (tracing.fan_in), which also records the batch size and how long the row waited in the queue.
+
+WRITE_BATCHING = os.getenv("WRITE_BATCHING", "1") == "1"
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "100"))
+WRITE_BATCH_WINDOW_S = float(os.getenv("WRITE_BATCH_WINDOW_MS", "2")) / 1000
+WRITE_BATCH_QUEUE = int(os.getenv("WRITE_BATCH_QUEUE", "1000"))
+# how long a request waits for queue space before it gets a 503 (backpressure)
+WRITE_BATCH_QUEUE_TIMEOUT_S = float(os.getenv("WRITE_BATCH_QUEUE_TIMEOUT_MS", "1000")) / 1000
+WRITE_BATCH_RETRY_AFTER_S = int(os.getenv("WRITE_BATCH_RETRY_AFTER_S", "1"))
+
+log = logging.getLogger(__name__)
+
+# apply(session, items): adds a batch's rows/statements to its session (one call per batch,
+# so per-batch work like counter upserts can be aggregated)
+Apply = Callable[[AsyncSession, list], Awaitable[None]]
+
+
+class WriteBatcher:
+    def __init__(self, name: str, apply: Apply, key: Callable[[object], str]):
+        self.name = name
+        self.apply = apply
+        self.key = key  # item -> shard key
+        self.queues: List[asyncio.Queue] = []  # one per shard while started
+        self.tasks: List[asyncio.Task] = []
+        self.stats: Dict[str, int] = dict.fromkeys(
+            ("rows", "batches", "max_batch", "failed", "fallbacks", "rejected"), 0)
+        _batchers[name] = self
+
+    async def submit(self, item) -> None:
+        """Returns once `item` is committed; raises what its commit raised, 503 when backed up."""
+        shard = shard_for(self.key(item))
+        if not self.queues:
+            # not started (batching off, scripts): a transaction of its own
+            return await self._commit(shard, [item])
+        fut = asyncio.get_running_loop().create_future()
+        with tracing.span("write_batch", batcher=self.name, shard=shard.index) as sp:
+            try:
+                await asyncio.wait_for(self.queues[shard.index].put((item, fut, sp)), WRITE_BATCH_QUEUE_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                self.stats["rejected"] += 1
+                raise HTTPException(status_code=503, detail="Too many pending writes, retry shortly",
+                                    headers={"Retry-After": str(WRITE_BATCH_RETRY_AFTER_S)})
+            await fut
+
+    async def _commit(self, shard: Shard, items: list) -> None:
+        async with AsyncSession(shard.async_engine, expire_on_commit=False) as session:
+            await self.apply(session, items)
+            await session.commit()
+
+    async def _flush(self, shard: Shard, batch: List[Tuple[object, asyncio.Future, object]]) -> None:
+        # callers that went away before their turn (client disconnect) are dropped, not written
+        batch = [e for e in batch if not e[1].done()]
+        if not batch:
+            return
+        traced = [sp for _, _, sp in batch if sp.id]
+        t0 = time.perf_counter()
+        for sp in traced:
+            # a row retried alone after a failed batch ends up with its final attempt's numbers
+            sp.set(batch=len(batch), queue_ms=round((t0 - sp.t0) * 1000, 3))
+        try:
+            with tracing.fan_in(traced):
+                await self._commit(shard, [item for item, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                self.stats["failed"] += 1
+                return _resolve(batch[0][1], e)
+            self.stats["fallbacks"] += 1
+            log.warning("%s write batch of %d failed (%s), retrying rows one by one", self.name, len(batch), e)
+            for one in batch:
+                await self._flush(shard, [one])
+            return
+        commit_ms = round((time.perf_counter() - t0) * 1000, 3)
+        for sp in traced:
+            sp.set(commit_ms=commit_ms)
+        for _, fut, _ in batch:
+            _resolve(fut)
+        self.stats["rows"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+
+    async def _run(self, shard: Shard, queue: asyncio.Queue) -> None:
+        closing = False
+        while not closing:
+            first = await queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + WRITE_BATCH_WINDOW_S
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    entry = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if entry is None:
+                    closing = True  # flush what was queued before stop(), then exit
+                    break
+                batch.append(entry)
+            await self._flush(shard, batch)
+
+    def start(self) -> None:
+        if WRITE_BATCHING and not self.tasks:
+            loop = asyncio.get_running_loop()
+            self.queues = [asyncio.Queue(WRITE_BATCH_QUEUE) for _ in shards]
+            self.tasks = [loop.create_task(self._run(shard, q)) for shard, q in zip(shards, self.queues)]
+
+    async def stop(self) -> None:
+        if not self.tasks:
+            return
+        queues, self.queues = self.queues, []  # new submits commit on their own from here on
+        for queue in queues:
+            await queue.put(None)              # behind everything already queued
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # submits that were still waiting for queue space landed behind the sentinel
+        for shard, queue in zip(shards, queues):
+            while not queue.empty():
+                entries = [queue.get_nowait() for _ in range(min(queue.qsize(), WRITE_BATCH_MAX))]
+                await self._flush(shard, [e for e in entries if e is not None])
+
+
+def _resolve(fut: asyncio.Future, error: Optional[BaseException] = None) -> None:
+    if fut.done():
+        return
+    if error is None:
+        fut.set_result(None)
+    else:
+        fut.set_exception(error)
+
+
+_batchers: Dict[str, WriteBatcher] = {}
+
+
+def start() -> None:
+    for b in _batchers.values():
+        b.start()
+
+
+async def stop() -> None:
+    # lifespan shutdown: pending writes are committed before the engines are disposed
+    for b in _batchers.values():
+        await b.stop()
+
+
+def stats() -> Dict:
+    return {name: {**b.stats, "queued": sum(q.qsize() for q in b.queues),
+                   "writers": len(b.tasks)} for name, b in _batchers.items()}
@@ -0,0 +1,51 @@
+import sys
+from collections import Counter
+from typing import Dict, Iterable
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .models import Comment, PostCommentCount
+
+# Per-post comment counters. Callers bump them inside the transaction that inserts or
+# deletes the comments, so a counter is never visible without its rows (or vice versa).
+
+def _bump_statements(post_ids: Iterable[str], delta: int):
+    for post_id, n in Counter(post_ids).items():
+        stmt = insert(PostCommentCount).values(postId=post_id, count=n * delta)
+        yield stmt.on_conflict_do_update(
+            index_elements=["postId"], set_={"count": PostCommentCount.count + n * delta})
+
+def bump(session: Session, post_ids: Iterable[str], delta: int = 1) -> None:
+    for stmt in _bump_statements(post_ids, delta):
+        session.exec(stmt)
+
+async def abump(session: AsyncSession, post_ids: Iterable[str], delta: int = 1) -> None:
+    for stmt in _bump_statements(post_ids, delta):
+        await session.exec(stmt)
+
+def get_counts(session: Session, post_ids: Iterable[str]) -> Dict[str, int]:
+    ids = list(post_ids)
+    rows = session.exec(select(PostCommentCount).where(PostCommentCount.postId.in_(ids))).all()
+    found = {r.postId: r.count for r in rows}
+    return {i: found.get(i, 0) for i in ids}
+
+def rebuild(session: Session) -> int:
+    """Recomputes every counter from the comment table in one transaction."""
+    session.exec(delete(PostCommentCount))
+    grouped = select(Comment.postId, func.count()).group_by(Comment.postId)
+    session.exec(insert(PostCommentCount).from_select(["postId", "count"], grouped))
+    session.commit()
+    return session.exec(select(func.count()).select_from(PostCommentCount)).one()
+
+if __name__ == "__main__":
+    # docker compose exec comment-service python -m app.counts rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m app.counts rebuild")
+    from .db import shards, init_db
+    init_db()
+    for shard in shards:
+        with Session(shard.engine) as session:
+            print(f"shard {shard.index}: rebuilt comment counts for {rebuild(session)} posts")
@@ -1,15 +1,129 @@
-import os
+import os, heapq, itertools, asyncio, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Sequence
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel, create_engine, Session
 
+from . import metrics, tracing, search, sharding, timestamps
+
 DB_DIR = "/app/data"
 DB_PATH = f"{DB_DIR}/comment.db"
-
 os.makedirs(DB_DIR, exist_ok=True)
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
+
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
+# comments are split by postId hash over this many databases (see sharding.py); change it with
+# tools/reshard.py while the service is stopped
+DB_SHARDS = int(os.getenv("DB_SHARDS", "1"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "10"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+def _async_url(url: str) -> str:
+    # sqlite:///x.db -> sqlite+aiosqlite:///x.db; URLs that already name a driver are kept
+    scheme, rest = url.split("://", 1)
+    if scheme == "sqlite":
+        scheme = "sqlite+aiosqlite"
+    return f"{scheme}://{rest}"
+
+def _sqlite_pragmas(query_only: bool = False):
+    def on_connect(dbapi_conn, _record):
+        # WAL lets readers run alongside the single writer; busy_timeout makes writers from
+        # other replicas sharing the volume wait for the lock instead of "database is locked"
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        if query_only:
+            cur.execute("PRAGMA query_only=ON")
+        cur.close()
+    return on_connect
+
+def _pool_args(url: str, size: int):
+    if IS_SQLITE and (":memory:" in url or url.rstrip("/") == "sqlite:"):
+        return {}  # in-memory databases use a single shared connection, not a queue pool
+    return {"pool_size": size, "max_overflow": size * 2, "pool_pre_ping": not IS_SQLITE}
+
+class Shard:
+    """One database, with a write, a read-only and an async engine."""
+
+    def __init__(self, index: int, url: str):
+        self.index = index
+        self.engine = create_engine(url, echo=False, **_pool_args(url, DB_POOL_SIZE))
+        # separate pool for read-only queries so long list scans never hold a writer's connection
+        self.read_engine = create_engine(url, echo=False, **_pool_args(url, DB_READ_POOL_SIZE))
+        self.async_engine = create_async_engine(_async_url(url), echo=False, **_pool_args(url, DB_POOL_SIZE))
+        if IS_SQLITE:
+            event.listen(self.engine, "connect", _sqlite_pragmas())
+            event.listen(self.read_engine, "connect", _sqlite_pragmas(query_only=True))
+            event.listen(self.async_engine.sync_engine, "connect", _sqlite_pragmas())
+        # metrics: one series per pool kind, summed over shards; spans name the shard
+        for e, pool in ((self.engine, "write"), (self.read_engine, "read"), (self.async_engine.sync_engine, "async")):
+            metrics.instrument_engine(e, pool)
+            tracing.instrument_engine(e, pool if DB_SHARDS == 1 else f"{pool}:{index}")
+
+shards = [Shard(i, sharding.shard_url(DATABASE_URL, i, DB_SHARDS)) for i in range(DB_SHARDS)]
+# a request's per-shard queries run here, in parallel (the calling thread takes the first shard)
+_scatter_pool = ThreadPoolExecutor(DB_SHARDS * DB_READ_POOL_SIZE, thread_name_prefix="shard") if DB_SHARDS > 1 else None
+
+def shard_for(key: str) -> Shard:
+    return shards[sharding.shard_of(key, DB_SHARDS)]
+
+def scatter(fn: Callable, items: Sequence) -> list:
+    """[fn(item) for item in items], run in parallel; results in item order."""
+    if len(items) == 1:
+        return [fn(items[0])]
+    # each task gets its own copy of the context, so request ids and spans follow the query
+    futures = [_scatter_pool.submit(contextvars.copy_context().run, fn, item) for item in items[1:]]
+    return [fn(items[0])] + [f.result() for f in futures]
+
+def on_shards(fn: Callable, targets: Optional[Sequence[Shard]] = None) -> list:
+    """fn(session, shard) with a read session on every shard (or on `targets`); one result per shard."""
+    def run(shard: Shard):
+        with Session(shard.read_engine) as session:
+            return fn(session, shard)
+    return scatter(run, shards if targets is None else targets)
+
+def on_key_shards(fn: Callable, keys: Iterable[str]) -> list:
+    """fn(session, keys) on each shard holding any of `keys`, with that shard's share of them."""
+    groups = list(sharding.group(keys, DB_SHARDS).items())
+    def run(group):
+        index, part = group
+        with Session(shards[index].read_engine) as session:
+            return fn(session, part)
+    return scatter(run, groups) if groups else []
+
+def read(stmt, targets: Optional[Sequence[Shard]] = None) -> list:
+    """All rows of `stmt` from every shard (or `targets`), concatenated."""
+    return [row for part in on_shards(lambda session, _: session.execute(stmt).all(), targets) for row in part]
+
+def read_merged(stmt, key: Callable, n: int, reverse: bool = False, skip: int = 0,
+                targets: Optional[Sequence[Shard]] = None) -> list:
+    """Rows skip..skip+n of `stmt` (already ordered by `key`) across shards: every shard returns
+    its first skip+n rows and heapq.merge interleaves them. One shard is a plain OFFSET/LIMIT."""
+    targets = shards if targets is None else targets
+    if len(targets) == 1:
+        return read(stmt.offset(skip).limit(n) if skip else stmt.limit(n), targets)
+    parts = on_shards(lambda session, _: session.execute(stmt.limit(skip + n)).all(), targets)
+    return list(itertools.islice(heapq.merge(*parts, key=key, reverse=reverse), skip, skip + n))
 
 def init_db() -> None:
-    SQLModel.metadata.create_all(engine)
+    for shard in shards:
+        SQLModel.metadata.create_all(shard.engine)
+        if IS_SQLITE:
+            timestamps.migrate(shard.engine, SQLModel.metadata.sorted_tables)
+        # create_all skips tables that already exist, so indexes added later need an explicit pass
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(shard.engine, checkfirst=True)
+        if IS_SQLITE:
+            search.ensure_schema(shard.engine)
 
-def get_session():
-    with Session(engine) as session:
-        yield session
+async def dispose() -> None:
+    await asyncio.gather(*(shard.async_engine.dispose() for shard in shards))
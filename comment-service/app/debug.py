@@ -0,0 +1,95 @@
+import os, sys, time, hmac, asyncio, threading
+from collections import Counter
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from . import tracing
+
+# On-demand diagnostics of one replica. Off unless DEBUG_ENDPOINTS=1; nginx doesn't route
+# /debug, so they are reachable only inside the Docker network, and with DEBUG_TOKEN set they
+# also need a matching X-Debug-Token header.
+#   GET /debug/profile?seconds=N  samples every thread's Python stack DEBUG_PROFILE_HZ times a
+#       second for N seconds and returns collapsed stacks ("thread;frame;frame count" lines),
+#       the input format of flamegraph.pl, speedscope and inferno. Nothing runs between profiles.
+#   GET /debug/slow  the last SLOW_REQUEST_BUFFER requests slower than SLOW_REQUEST_MS, with
+#       their SQL and upstream calls (recorded by tracing.py).
+
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "0") == "1"
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+DEBUG_PROFILE_HZ = int(os.getenv("DEBUG_PROFILE_HZ", "100"))
+DEBUG_PROFILE_MAX_S = float(os.getenv("DEBUG_PROFILE_MAX_S", "60"))
+
+# leaf frames of threads that are waiting for work: the event loop in select(), idle pool
+# threads. Left out unless ?idle=1, so the profile shows where the CPU goes
+_IDLE = {("selectors", "select"), ("threading", "wait"), ("concurrent.futures.thread", "_worker"),
+         ("aiosqlite.core", "run")}
+
+_profiling = False
+
+
+def _guard(x_debug_token: Optional[str] = Header(None)) -> None:
+    if DEBUG_TOKEN and not hmac.compare_digest((x_debug_token or "").encode(), DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+router = APIRouter(dependencies=[Depends(_guard)])
+
+
+def sample(seconds: float, hz: int, idle: bool) -> Counter:
+    """Collapsed stacks of every other thread, sampled `hz` times a second for `seconds`."""
+    me = threading.get_ident()
+    names: Dict[object, str] = {}  # code object -> "module:qualname"
+    stacks: Counter = Counter()
+    interval = 1 / hz
+    next_at = time.monotonic()
+    deadline = next_at + seconds
+    while next_at < deadline:
+        threads = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            if not idle and (frame.f_globals.get("__name__"), frame.f_code.co_name) in _IDLE:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = names.get(code)
+                if name is None:
+                    name = names[code] = f"{frame.f_globals.get('__name__', '?')}:{code.co_qualname}"
+                stack.append(name)
+                frame = frame.f_back
+            stack.append(threads.get(ident, str(ident)))
+            stacks[";".join(reversed(stack))] += 1
+        next_at += interval
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    return stacks
+
+
+@router.get("/debug/profile")
+async def profile(seconds: float = Query(10, gt=0),
+                  hz: int = Query(DEBUG_PROFILE_HZ, ge=1, le=1000),
+                  idle: bool = Query(False)):
+    global _profiling
+    if seconds > DEBUG_PROFILE_MAX_S:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {DEBUG_PROFILE_MAX_S:g}")
+    if _profiling:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    _profiling = True
+    try:
+        stacks = await asyncio.to_thread(sample, seconds, hz, idle)
+    finally:
+        _profiling = False
+    body = "".join(f"{stack} {n}\n" for stack, n in stacks.most_common())
+    filename = f"{tracing._service or 'service'}-{time.strftime('%Y%m%dT%H%M%S')}.collapsed"
+    return PlainTextResponse(body, headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                                            "X-Profile-Samples": str(sum(stacks.values()))})
+
+
+@router.get("/debug/slow")
+def slow(limit: int = Query(tracing.SLOW_REQUEST_BUFFER, ge=1)):
+    # newest first
+    return {"threshold_ms": tracing.SLOW_REQUEST_MS or None, "recorded": tracing.slow_total,
+            "requests": list(reversed(tracing.slow_requests))[:limit]}
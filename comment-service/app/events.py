@@ -0,0 +1,142 @@
+import os, time, socket, asyncio, logging
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import counts, post_exists
+from .db import shard_for
+from .models import Comment, PostCommentCount
+
+# Consumes post-service's domain events (Redis stream written by its outbox relay) through a
+# consumer group, so each event is handled by one comment-service replica. Delivery is
+# at-least-once: an event is acked only after it was handled, and events left pending by a
+# crashed replica are claimed by another after POST_EVENTS_CLAIM_IDLE_MS. Handlers are
+# idempotent. post.deleted removes the post's comments in small transactions, off the
+# request path, so a post with 100k comments never holds the write lock for long.
+
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+POST_EVENTS_STREAM = os.getenv("POST_EVENTS_STREAM", "post-events")
+POST_EVENTS_GROUP = os.getenv("POST_EVENTS_GROUP", "comment-service")
+POST_EVENTS_BATCH = int(os.getenv("POST_EVENTS_BATCH", "100"))
+POST_EVENTS_BLOCK_MS = int(os.getenv("POST_EVENTS_BLOCK_MS", "2000"))
+POST_EVENTS_CLAIM_IDLE_MS = int(os.getenv("POST_EVENTS_CLAIM_IDLE_MS", "60000"))
+CASCADE_DELETE_BATCH = int(os.getenv("CASCADE_DELETE_BATCH", "500"))
+CONSUMER = f"{socket.gethostname()}-{os.getpid()}"
+
+log = logging.getLogger(__name__)
+
+_task: Optional[asyncio.Task] = None
+_stats: Dict[str, int] = dict.fromkeys(
+    ("handled", "skipped", "errors", "claimed", "posts_deleted", "comments_deleted"), 0)
+
+async def cascade_delete(post_id: str) -> int:
+    """Deletes a post's comments CASCADE_DELETE_BATCH at a time; returns how many."""
+    total = 0
+    engine = shard_for(post_id).async_engine
+    while True:
+        async with AsyncSession(engine) as session:
+            ids = (await session.exec(
+                select(Comment.id).where(Comment.postId == post_id).limit(CASCADE_DELETE_BATCH))).all()
+            if ids:
+                await session.exec(delete(Comment).where(Comment.id.in_(ids)))
+                await counts.abump(session, [post_id], -len(ids))
+            else:
+                await session.exec(delete(PostCommentCount).where(PostCommentCount.postId == post_id))
+            await session.commit()
+        if not ids:
+            return total
+        total += len(ids)
+        await asyncio.sleep(0)  # let request handlers in between batches
+
+async def handle(fields: Dict[str, str]) -> None:
+    post_id = fields["post_id"]
+    kind = fields["type"]
+    if kind == "post.deleted":
+        # reject new comments on this replica right away; the HTTP check would say 404 too
+        post_exists.remember(post_id, False)
+        _stats["comments_deleted"] += await cascade_delete(post_id)
+        _stats["posts_deleted"] += 1
+    elif kind == "post.created":
+        post_exists.remember(post_id, True)
+    # post.updated: nothing derived from a post's content is kept here
+
+async def _process(r, messages: List[Tuple[str, Dict[str, str]]]) -> None:
+    for msg_id, fields in messages:
+        try:
+            await handle(fields)
+            _stats["handled"] += 1
+        except KeyError:
+            _stats["skipped"] += 1  # malformed: retrying would never succeed
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # left pending: claimed and retried after POST_EVENTS_CLAIM_IDLE_MS
+            _stats["errors"] += 1
+            log.warning("post event %s (%s) failed: %s", msg_id, fields.get("type"), e)
+            continue
+        await r.xack(POST_EVENTS_STREAM, POST_EVENTS_GROUP, msg_id)
+
+async def _claim(r) -> None:
+    start = "0-0"
+    while True:
+        res = await r.xautoclaim(POST_EVENTS_STREAM, POST_EVENTS_GROUP, CONSUMER,
+                                 POST_EVENTS_CLAIM_IDLE_MS, start_id=start, count=POST_EVENTS_BATCH)
+        start, messages = res[0], res[1]
+        _stats["claimed"] += len(messages)
+        await _process(r, messages)
+        if start == "0-0" or not messages:
+            return
+
+async def _run() -> None:
+    import redis.asyncio as aredis
+    from redis.exceptions import ResponseError
+    backoff = 1.0
+    while True:
+        r = aredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        try:
+            try:
+                # "0": a new group starts from the oldest event still in the stream
+                await r.xgroup_create(POST_EVENTS_STREAM, POST_EVENTS_GROUP, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+            next_claim = 0.0
+            backoff = 1.0
+            while True:
+                if time.monotonic() >= next_claim:
+                    await _claim(r)
+                    next_claim = time.monotonic() + POST_EVENTS_CLAIM_IDLE_MS / 2000
+                res = await r.xreadgroup(POST_EVENTS_GROUP, CONSUMER, {POST_EVENTS_STREAM: ">"},
+                                         count=POST_EVENTS_BATCH, block=POST_EVENTS_BLOCK_MS)
+                for _stream, messages in res or ():
+                    await _process(r, messages)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("post event consumer disconnected: %s", e)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+        finally:
+            await r.aclose()
+
+def start() -> None:
+    global _task
+    # without Redis there is no stream: comments of deleted posts stay until cleaned up
+    if REDIS_HOST and _task is None:
+        _task = asyncio.get_running_loop().create_task(_run())
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+def stats() -> Dict:
+    return {**_stats, "consumer": CONSUMER, "group": POST_EVENTS_GROUP, "running": _task is not None}
@@ -0,0 +1,156 @@
+import os, time, asyncio
+from typing import Dict, Optional
+
+import httpx
+
+from . import metrics, tracing
+
+# One pooled AsyncClient per process for every inter-service call (token verification,
+# post existence checks, health probes). Opened/closed by the FastAPI lifespan in main.py.
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+# cap per upstream host:port so one slow dependency can't take the whole pool
+HTTP_MAX_PER_UPSTREAM = int(os.getenv("HTTP_MAX_PER_UPSTREAM", "64"))
+HTTP2 = os.getenv("HTTP2", "1") == "1"
+
+try:
+    import h2  # noqa: F401  (installed by httpx[http2])
+    _HAS_H2 = True
+except ImportError:
+    _HAS_H2 = False
+
+
+class _UpstreamStats:
+    __slots__ = ("in_flight", "waiting", "requests", "errors", "metrics")
+
+    def __init__(self, key: str):
+        self.metrics = metrics.upstream(key)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, inner: httpx.AsyncByteStream, release):
+        self._inner = inner
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._inner:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._inner.aclose()
+        finally:
+            self._release()
+
+
+class UpstreamLimitedTransport(httpx.AsyncBaseTransport):
+    """Wraps the pooled transport with a per-upstream concurrency cap and counters."""
+
+    def __init__(self, inner: httpx.AsyncHTTPTransport, per_upstream: int):
+        self.inner = inner
+        self.per_upstream = per_upstream
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+        self.upstreams: Dict[str, _UpstreamStats] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = f"{request.url.host}:{request.url.port or (443 if request.url.scheme == 'https' else 80)}"
+        with tracing.span("upstream", upstream=key, method=request.method, path=request.url.path) as sp:
+            tracing.inject(request.headers, sp)
+            return await self._send(key, request)
+
+    async def _send(self, key: str, request: httpx.Request) -> httpx.Response:
+        sem = self._sems.get(key)
+        if sem is None:
+            sem = self._sems[key] = asyncio.Semaphore(self.per_upstream)
+            self.upstreams[key] = _UpstreamStats(key)
+        st = self.upstreams[key]
+        t0 = time.perf_counter()  # includes time spent waiting for an upstream slot
+        st.waiting += 1
+        try:
+            await sem.acquire()
+        finally:
+            st.waiting -= 1
+        st.in_flight += 1
+        st.requests += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                st.in_flight -= 1
+                sem.release()
+
+        try:
+            response = await self.inner.handle_async_request(request)
+        except BaseException:
+            st.errors += 1
+            st.metrics.errors += 1
+            release()
+            raise
+        st.metrics.latency.observe(time.perf_counter() - t0)
+        # the connection stays checked out until the body is read and the response closed
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+_client: Optional[httpx.AsyncClient] = None
+_transport: Optional[UpstreamLimitedTransport] = None
+
+def start() -> httpx.AsyncClient:
+    global _client, _transport
+    if _client is None:
+        limits = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                              max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                              keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+        inner = httpx.AsyncHTTPTransport(limits=limits, http2=HTTP2 and _HAS_H2)
+        _transport = UpstreamLimitedTransport(inner, HTTP_MAX_PER_UPSTREAM)
+        _client = httpx.AsyncClient(
+            transport=_transport,
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+    return _client
+
+def get_client() -> httpx.AsyncClient:
+    # lazily started so helpers also work outside the app lifespan (scripts, tests)
+    return _client if _client is not None else start()
+
+async def close() -> None:
+    global _client, _transport
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _transport = None
+
+def stats() -> Dict:
+    if _transport is None:
+        return {"started": False}
+    # the bench's in-process transport has no connection pool
+    conns = list(getattr(getattr(_transport.inner, "_pool", None), "connections", []))
+    idle = sum(1 for c in conns if c.is_idle())
+    return {
+        "started": True,
+        "http2": HTTP2 and _HAS_H2,
+        "max_connections": HTTP_MAX_CONNECTIONS,
+        "max_keepalive": HTTP_MAX_KEEPALIVE,
+        "max_per_upstream": HTTP_MAX_PER_UPSTREAM,
+        "connections": len(conns),
+        "idle": idle,
+        "active": len(conns) - idle,
+        "utilisation": round((len(conns) - idle) / HTTP_MAX_CONNECTIONS, 4),
+        "upstreams": {
+            k: {"in_flight": s.in_flight, "waiting": s.waiting, "requests": s.requests, "errors": s.errors}
+            for k, s in _transport.upstreams.items()
+        },
+    }
@@ -1,113 +1,174 @@
 import os, uuid
-from datetime import datetime, timezone
+from contextlib import asynccontextmanager
 from typing import Dict, Optional, List
 
 import httpx
-from fastapi import FastAPI, Depends, Header, HTTPException, Query, status
+from pydantic import ValidationError
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import update
 from sqlmodel import select, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .db import init_db, get_session
+from . import token_verifier, http_client, pagination, post_exists, counts, health, metrics, tracing, debug, search, etag, export, events, admission, responses, batcher, timestamps
+from .db import init_db, dispose, shards, shard_for, on_shards, on_key_shards, read, read_merged, IS_SQLITE
 from .models import Comment
 from .schemas import (
-    HealthResponse, DependencyHealth, Status,
-    CommentCreate, CommentUpdate
+    HealthResponse,
+    CommentCreate, CommentUpdate, CommentBatchCreate, CommentOut
 )
 
 APP_NAME = "comment-service"
 AUTH_SERVICE_BASE = os.getenv("AUTH_SERVICE_BASE", "http://auth-service:8000")
 POST_SERVICE_BASE = os.getenv("POST_SERVICE_BASE", "http://post-service:8000")
+BATCH_MAX_IDS = 100
+# per user, "per-minute:burst" ("0" = off)
+comment_limit = admission.RateLimit("create_comment", os.getenv("RATE_LIMIT_COMMENTS", "60:20"))
 
-app = FastAPI(title=APP_NAME)
+async def _insert_comments(session: AsyncSession, comments: List[Comment]) -> None:
+    session.add_all(comments)
+    await counts.abump(session, (c.postId for c in comments))
 
-#startup
-@app.on_event("startup")
-def on_startup():
+# concurrent POST /comments share one transaction (group commit): a burst on a hot post is
+# one counter upsert and one WAL sync instead of one per comment
+comment_writes = batcher.WriteBatcher("comments", _insert_comments, key=lambda c: c.postId)
+
+#startup / shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     init_db()
+    http_client.start()
+    token_verifier.start()
+    post_exists.start()
+    events.start()
+    batcher.start()
+    admission.start()
+    health.start(APP_NAME, {
+        "auth-service": health.http_check(http_client.get_client, f"{AUTH_SERVICE_BASE}/health/ready"),
+        "post-service": health.http_check(http_client.get_client, f"{POST_SERVICE_BASE}/health/ready"),
+        "database": health.check_database,
+    })
+    tracing.start()
+    yield
+    await tracing.stop()
+    await health.stop()
+    await admission.stop()
+    await batcher.stop()
+    await events.stop()
+    await post_exists.stop()
+    await token_verifier.stop()
+    await http_client.close()
+    await dispose()
+
+app = FastAPI(title=APP_NAME, lifespan=lifespan, default_response_class=ORJSONResponse)
+# inserts are group-committed: their class starts wide enough to fill a batch
+app.add_middleware(admission.AdmissionMiddleware, router=app.router,
+                   classes={"GET /comments/export": "export", "POST /comments": "insert"},
+                   initial={"insert": batcher.WRITE_BATCH_MAX} if batcher.WRITE_BATCHING else None)
+app.add_middleware(responses.CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware, router=app.router)
+app.add_middleware(tracing.TracingMiddleware, service=APP_NAME)  # added last = outermost
+if debug.DEBUG_ENDPOINTS:
+    app.include_router(debug.router)  # /debug/profile, /debug/slow
 
 # helpers
+def parse_ids(ids: str) -> List[str]:
+    # ?postIds=a,b,c -> unique ids in request order
+    parsed = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not parsed:
+        raise HTTPException(status_code=400, detail="ids required")
+    if len(parsed) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IDS} ids per batch")
+    return parsed
+
 async def verify_token_and_get_user(authorization: Optional[str] = Header(None)) -> Dict:
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
     token = authorization.split(" ", 1)[1]
+    if token_verifier.AUTH_VERIFY_MODE != "remote":
+        return token_verifier.verify_local(token)
     url = f"{AUTH_SERVICE_BASE}/auth/verify"
-    async with httpx.AsyncClient(timeout=10) as client:
-        try:
-            r = await client.post(url, json={"token": token})
-            if r.status_code != 200:
-                error_detail = r.json().get("detail", "Unknown error") if r.status_code < 500 else "Auth service error"
-                raise HTTPException(status_code=401, detail=f"Invalid token: {error_detail}")
-            return r.json()  # {"user_id": "...", "email": "..."}
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=503, detail=f"auth-service unavailable: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=401, detail=f"Token verification failed: {str(e)}")
+    try:
+        r = await http_client.get_client().post(url, json={"token": token})
+        if r.status_code != 200:
+            error_detail = r.json().get("detail", "Unknown error") if r.status_code < 500 else "Auth service error"
+            raise HTTPException(status_code=401, detail=f"Invalid token: {error_detail}")
+        return r.json()  # {"user_id": "...", "email": "..."}
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"auth-service unavailable: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=401, detail=f"Token verification failed: {str(e)}")
+
+def _page_key(c):
+    return (c.created_at, c.id)
+
+def _targets(post_id: Optional[str]):
+    # a post's comments all live on its shard; without a post, every shard is read
+    return [shard_for(post_id)] if post_id else shards
+
+def comment_session(comment_id: str):
+    # comments are sharded by postId, so a lookup by id asks every shard (in parallel)
+    shard = shards[0]
+    if len(shards) > 1:
+        found = on_shards(lambda session, s: s if session.exec(
+            select(Comment.id).where(Comment.id == comment_id)).first() else None)
+        shard = next((s for s in found if s is not None), shard)
+    with Session(shard.engine) as session:
+        yield session
 
 async def ensure_post_exists(post_id: str) -> None:
-    url = f"{POST_SERVICE_BASE}/posts/{post_id}"
-    async with httpx.AsyncClient(timeout=10) as client:
-        try:
-            r = await client.get(url)
-            if r.status_code == 404:
-                raise HTTPException(status_code=400, detail="Post does not exist")
-            r.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            if e.response.status_code == 404:
-                raise HTTPException(status_code=400, detail="Post does not exist")
-            raise HTTPException(status_code=503, detail="post-service error")
-        except httpx.RequestError:
-            raise HTTPException(status_code=503, detail="post-service unavailable")
+    # cached and coalesced HEAD /posts/{id}; raises 503 itself when post-service is down
+    if not await post_exists.check(post_id):
+        raise HTTPException(status_code=400, detail="Post does not exist")
 
 # health
+# Served from the background prober's snapshot: O(1), never calls other services inline
 @app.get("/health", response_model=HealthResponse)
-async def health() -> HealthResponse:
-    deps: Dict[str, DependencyHealth] = {}
+async def health_check():
+    return health.snapshot()
 
-    async with httpx.AsyncClient(timeout=5) as client:
-        # auth-service
-        try:
-            start = datetime.now(timezone.utc)
-            ar = await client.get(f"{AUTH_SERVICE_BASE}/health")
-            ms = (datetime.now(timezone.utc) - start).total_seconds() * 1000
-            deps["auth-service"] = DependencyHealth(
-                status="healthy" if ar.status_code == 200 else "unhealthy",
-                response_time_ms=round(ms, 2),
-                error=None if ar.status_code == 200 else f"HTTP {ar.status_code}",
-            )
-        except Exception as e:
-            deps["auth-service"] = DependencyHealth(status="unhealthy", response_time_ms=None, error=str(e))
-
-        # post-service
-        try:
-            start = datetime.now(timezone.utc)
-            pr = await client.get(f"{POST_SERVICE_BASE}/health")
-            ms = (datetime.now(timezone.utc) - start).total_seconds() * 1000
-            deps["post-service"] = DependencyHealth(
-                status="healthy" if pr.status_code == 200 else "unhealthy",
-                response_time_ms=round(ms, 2),
-                error=None if pr.status_code == 200 else f"HTTP {pr.status_code}",
-            )
-        except Exception as e:
-            deps["post-service"] = DependencyHealth(status="unhealthy", response_time_ms=None, error=str(e))
-
-    # DB check (simple open session)
-    try:
-        for _ in get_session():
-            pass
-        db_status: Status = "healthy"
-    except Exception as e:
-        db_status = "unhealthy"
-        deps["database"] = DependencyHealth(status="unhealthy", response_time_ms=None, error=str(e))
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready(response: Response):
+    if not health.ready():
+        response.status_code = 503
+        return {"status": "not ready"}
+    return {"status": "ready"}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(APP_NAME), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/internal/http-pool")
+def http_pool_stats():
+    return http_client.stats()
 
-    overall: Status = "healthy" if all(d.status == "healthy" for d in deps.values()) and db_status == "healthy" else "unhealthy"
-    return HealthResponse(service=APP_NAME, status=overall, dependencies=deps)
+@app.get("/internal/post-exists-stats")
+def post_exists_stats():
+    return post_exists.stats()
+
+@app.get("/internal/post-events")
+def post_events_stats():
+    return events.stats()
+
+@app.get("/internal/admission")
+def admission_stats():
+    return admission.stats()
+
+@app.get("/internal/write-batches")
+def write_batch_stats():
+    return batcher.stats()
 
 # CRUD
 @app.post("/comments", status_code=201)
 async def create_comment(
     payload: CommentCreate,
     user=Depends(verify_token_and_get_user),
-    session: Session = Depends(get_session)
 ):
+    comment_limit.check(user["user_id"])
     await ensure_post_exists(payload.postId)
     cid = str(uuid.uuid4())
     c = Comment(
@@ -116,56 +177,220 @@ async def create_comment(
         authorId=user["user_id"],
         body=payload.body,
     )
-    session.add(c)
-    session.commit()
-    session.refresh(c)
+    await comment_writes.submit(c)
     return c
 
-@app.get("/comments/{comment_id}")
-def get_comment(comment_id: str, session: Session = Depends(get_session)):
-    c = session.get(Comment, comment_id)
+# Creates many comments in one transaction per shard: one auth check and one post-existence
+# lookup for the whole batch. Results line up with the request items; failures are per item.
+@app.post("/comments:batch")
+async def create_comments_batch(
+    payload: CommentBatchCreate,
+    user=Depends(verify_token_and_get_user),
+):
+    results: List[Dict] = [{} for _ in payload.items]
+    valid: Dict[int, CommentCreate] = {}
+    for i, raw in enumerate(payload.items):
+        try:
+            valid[i] = CommentCreate.model_validate(raw)
+        except ValidationError as e:
+            results[i] = {"status": 422, "error": e.errors(include_url=False, include_context=False)}
+    # a batch costs what its comments would cost one by one
+    comment_limit.check(user["user_id"], len(valid))
+    exists = await post_exists.check_many(c.postId for c in valid.values()) if valid else {}
+    created: Dict[int, Comment] = {}
+    for i, item in valid.items():
+        if not exists.get(item.postId):
+            results[i] = {"status": 400, "error": "Post does not exist"}
+            continue
+        created[i] = Comment(id=str(uuid.uuid4()), postId=item.postId, authorId=user["user_id"], body=item.body)
+    per_shard: Dict[int, Dict[int, Comment]] = {}
+    for i, c in created.items():
+        per_shard.setdefault(shard_for(c.postId).index, {})[i] = c
+    for index, part in per_shard.items():
+        try:
+            async with AsyncSession(shards[index].async_engine, expire_on_commit=False) as session:
+                await _insert_comments(session, list(part.values()))
+                await session.commit()
+        except Exception:
+            # the other shards' transactions stand; only this shard's items failed
+            for i in part:
+                results[i] = {"status": 500, "error": "Could not store comment"}
+            continue
+        for i, c in part.items():
+            results[i] = {"status": 201, "comment": c.model_dump()}
+    return {"results": results}
+
+@app.get("/comments/counts")
+def comment_counts(postIds: str = Query(..., description="Comma-separated post ids")):
+    wanted = parse_ids(postIds)
+    found = {k: v for part in on_key_shards(counts.get_counts, wanted) for k, v in part.items()}
+    return {"counts": {i: found[i] for i in wanted}}
+
+def _previews(session: Session, post_ids: List[str], per_post: int) -> Dict:
+    found = counts.get_counts(session, post_ids)
+    previews = {}
+    for post_id in post_ids:
+        latest = []
+        if per_post and found[post_id]:
+            latest = responses.rows(session.exec(
+                select(*Comment.__table__.c).where(Comment.postId == post_id)
+                .order_by(Comment.created_at.desc(), Comment.id.desc()).limit(per_post)).all())
+        previews[post_id] = {"count": found[post_id], "latest": latest}
+    return previews
+
+# Comment count plus the newest `per_post` comments of many posts in one call (feed pages).
+# Each post is one short descending range scan of the (postId, created_at, id) index.
+@app.get("/comments:previews")
+def comment_previews(
+    postIds: str = Query(..., description="Comma-separated post ids"),
+    per_post: int = Query(3, ge=0, le=20),
+):
+    wanted = parse_ids(postIds)
+    found = {k: v for part in on_key_shards(lambda session, keys: _previews(session, keys, per_post), wanted)
+             for k, v in part.items()}
+    return responses.json({"previews": {i: found[i] for i in wanted}})
+
+# Full-text search (FTS5, BM25-ranked, best match first), optionally within one post.
+# Page with the X-Next-Cursor header.
+@app.get("/comments/search")
+def search_comments(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    postId: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None),
+):
+    if not IS_SQLITE:
+        raise HTTPException(status_code=501, detail="Search requires the SQLite database")
+    key = search.decode_cursor(cursor)
+    rows, next_cursor = search.merge(on_shards(
+        lambda session, shard: search.search_comments(session, shard.index, q, postId, limit, key),
+        _targets(postId)), limit)
+    pagination.set_cursor_headers(response, next_cursor, None)
+    return responses.json(rows, response)
+
+# Comments as NDJSON in (created_at, id) order, streamed; gzip with Accept-Encoding: gzip.
+# Optionally one post's only (postId) and/or created in [since, until). Resume with
+# ?cursor=<_cursor of the last line received>.
+@app.get("/comments/export")
+def export_comments(
+    postId: Optional[str] = Query(None),
+    since: Optional[str] = Query(None),
+    until: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None),
+    accept_encoding: Optional[str] = Header(None),
+):
+    stmt = timestamps.between(select(*Comment.__table__.columns), Comment.created_at, since, until)
+    if postId:
+        stmt = stmt.where(Comment.postId == postId)
+    stmt = export.seek(stmt, (Comment.created_at, Comment.id), cursor)
+    return export.ndjson_response(stmt, lambda r: (r["created_at"], r["id"]), accept_encoding, _targets(postId))
+
+# Strong ETag per comment; If-None-Match is checked against the version columns only.
+# Comments are sharded by postId, so with several shards the id is looked up on all of them.
+@app.get("/comments/{comment_id}", response_model=CommentOut)
+def get_comment(
+    comment_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+):
+    if if_none_match:
+        found = read(select(Comment.id, Comment.created_at, Comment.updated_at).where(Comment.id == comment_id))
+        row = found[0] if found else None
+        if row and etag.none_match(if_none_match, etag.of(*row)):
+            response.headers["ETag"] = etag.of(*row)
+            return etag.not_modified(response)
+    found = read(select(*Comment.__table__.c).where(Comment.id == comment_id))
+    c = found[0] if found else None
     if not c:
         raise HTTPException(status_code=404, detail="Comment not found")
-    return c
+    response.headers["ETag"] = etag.of(c.id, c.created_at, c.updated_at)
+    return responses.json(dict(c._mapping), response)
 
-@app.get("/comments")
+@app.get("/comments", response_model=List[CommentOut])
 def list_comments(
+    response: Response,
     postId: Optional[str] = Query(None),
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    session: Session = Depends(get_session),
+    cursor: Optional[str] = Query(None),
+    since: Optional[str] = Query(None),
+    until: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    if_none_match: Optional[str] = Header(None),
 ):
-    stmt = select(Comment)
+    # Ordered by (created_at, id); with postId this is a range scan of the
+    # (postId, created_at, id) index on the post's shard, otherwise every shard is read in
+    # parallel and the pages merged. Page with the X-Next-Cursor / X-Prev-Cursor
+    # response headers via ?cursor=; offset is kept for old clients but is the slow path.
+    # Pages carry a collection ETag; with If-None-Match the page is first read as version
+    # columns only and bodies are loaded just when it has changed. ?fields= returns (and
+    # reads) only the named columns. ?since= / ?until= (ISO-8601) keep comments created in
+    # [since, until), a range of the same index ("a post's last 24 hours").
+    order = (Comment.created_at, Comment.id)
+    names = responses.parse_fields(fields, Comment)
+    full = responses.columns(Comment, names, "id", "created_at", "updated_at")
+    light = bool(if_none_match)
+    stmt = select(Comment.id, Comment.created_at, Comment.updated_at) if light else select(*full)
+    stmt = timestamps.between(stmt, Comment.created_at, since, until)
     if postId:
         stmt = stmt.where(Comment.postId == postId)
-    rows = session.exec(stmt.offset(offset).limit(limit)).all()
-    return rows
+    if cursor is not None and offset:
+        raise HTTPException(status_code=400, detail="Use either cursor or offset, not both")
+    targets = _targets(postId)
+    next_cursor = prev_cursor = None
+    if offset:
+        rows = read_merged(stmt.order_by(*order), _page_key, limit, skip=offset, targets=targets)
+    else:
+        stmt, direction, key = pagination.keyset(stmt, order, cursor, limit)
+        rows, next_cursor, prev_cursor = pagination.page(
+            read_merged(stmt, _page_key, limit + 1, reverse=direction == "prev", targets=targets),
+            limit, direction, key, _page_key)
+        pagination.set_cursor_headers(response, next_cursor, prev_cursor)
+    response.headers["ETag"] = etag.of_rows(rows, next_cursor, prev_cursor, names and ",".join(names))
+    if light:
+        if etag.none_match(if_none_match, response.headers["ETag"]):
+            return etag.not_modified(response)
+        found = {c.id: c for c in read(select(*full).where(Comment.id.in_([r.id for r in rows])), targets)}
+        rows = [found[r.id] for r in rows if r.id in found]
+    return responses.json(responses.rows(rows, names), response)
 
 @app.put("/comments/{comment_id}")
 def update_comment(
     comment_id: str,
     payload: CommentUpdate,
+    response: Response,
     user=Depends(verify_token_and_get_user),
-    session: Session = Depends(get_session),
+    if_match: Optional[str] = Header(None),
+    session: Session = Depends(comment_session),
 ):
     c = session.get(Comment, comment_id)
     if not c:
         raise HTTPException(status_code=404, detail="Comment not found")
     if c.authorId != user["user_id"]:
         raise HTTPException(status_code=403, detail="Forbidden")
+    # If-Match: 412 unless the comment still has that ETag, re-checked in the UPDATE itself
+    etag.check_match(if_match, etag.of(c.id, c.created_at, c.updated_at))
     if payload.body is not None:
-        c.body = payload.body
-        c.updated_at = datetime.now(timezone.utc).isoformat()
-    session.add(c)
-    session.commit()
-    session.refresh(c)
+        stmt = (update(Comment).where(Comment.id == comment_id)
+                .values(body=payload.body, updated_at=timestamps.now()))
+        if if_match:
+            stmt = stmt.where(Comment.updated_at.is_not_distinct_from(c.updated_at))
+        if session.exec(stmt).rowcount == 0:  # changed (If-Match) or deleted since the read above
+            session.rollback()
+            if if_match:
+                raise HTTPException(status_code=412, detail="Precondition failed: the resource has changed")
+            raise HTTPException(status_code=404, detail="Comment not found")
+        session.commit()
+        session.refresh(c)
+    response.headers["ETag"] = etag.of(c.id, c.created_at, c.updated_at)
     return c
 
 @app.delete("/comments/{comment_id}", status_code=204)
 def delete_comment(
     comment_id: str,
     user=Depends(verify_token_and_get_user),
-    session: Session = Depends(get_session),
+    session: Session = Depends(comment_session),
 ):
     c = session.get(Comment, comment_id)
     if not c:
@@ -173,5 +398,6 @@ def delete_comment(
     if c.authorId != user["user_id"]:
         raise HTTPException(status_code=403, detail="Forbidden")
     session.delete(c)
+    counts.bump(session, [c.postId], -1)
     session.commit()
     return None
@@ -1,13 +1,25 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from typing import Optional
-from datetime import datetime, timezone
+
+from . import timestamps
+from .timestamps import Timestamp
 
 class Comment(SQLModel, table=True):
+    # keyset pagination orders for GET /comments, with and without ?postId=
+    __table_args__ = (
+        Index("ix_comment_postId_created_at_id", "postId", "created_at", "id"),
+        Index("ix_comment_created_at_id", "created_at", "id"),
+    )
+
     id: str = Field(primary_key=True, index=True)
     postId: str = Field(index=True)
     authorId: str = Field(index=True)
     body: str
-    created_at: str = Field(
-        default_factory=lambda: datetime.now(timezone.utc).isoformat()
-    )
-    updated_at: Optional[str] = None
+    created_at: str = Field(default_factory=timestamps.now, sa_type=Timestamp)
+    updated_at: Optional[str] = Field(default=None, sa_type=Timestamp)
+
+class PostCommentCount(SQLModel, table=True):
+    # maintained in the same transaction as comment inserts/deletes (see counts.py)
+    postId: str = Field(primary_key=True)
+    count: int = Field(default=0)
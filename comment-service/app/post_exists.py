@@ -0,0 +1,167 @@
+import os, json, time, asyncio, logging
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from . import http_client
+
+# Post-existence checks against post-service with a bounded positive/negative cache.
+# Concurrent checks for the same post share one upstream request, and post-service's
+# cache invalidation channel (published on post update/delete) evicts cached positives.
+
+POST_SERVICE_BASE = os.getenv("POST_SERVICE_BASE", "http://post-service:8000")
+POST_EXISTS_CACHE_SIZE = int(os.getenv("POST_EXISTS_CACHE_SIZE", "50000"))
+POST_EXISTS_POSITIVE_TTL = float(os.getenv("POST_EXISTS_POSITIVE_TTL", "300"))
+POST_EXISTS_NEGATIVE_TTL = float(os.getenv("POST_EXISTS_NEGATIVE_TTL", "5"))
+REDIS_HOST = os.getenv("REDIS_HOST")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "post-cache:invalidate")
+
+log = logging.getLogger(__name__)
+
+# post_id -> (exists, expires_at); ordered oldest -> most recently used
+_cache: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+_inflight: Dict[str, asyncio.Task] = {}
+_listener: Optional[asyncio.Task] = None
+_stats: Dict[str, int] = dict.fromkeys(
+    ("hits", "negative_hits", "misses", "coalesced", "upstream_calls", "invalidations"), 0)
+
+def _get(post_id: str) -> Optional[bool]:
+    item = _cache.get(post_id)
+    if item is None:
+        return None
+    exists, expires = item
+    if expires < time.monotonic():
+        del _cache[post_id]
+        return None
+    _cache.move_to_end(post_id)
+    return exists
+
+def _put(post_id: str, exists: bool, ttl: Optional[float] = None) -> None:
+    if ttl is None:
+        ttl = POST_EXISTS_POSITIVE_TTL if exists else POST_EXISTS_NEGATIVE_TTL
+    _cache[post_id] = (exists, time.monotonic() + ttl)
+    _cache.move_to_end(post_id)
+    if len(_cache) > POST_EXISTS_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+def remember(post_id: str, exists: bool) -> None:
+    # authoritative answer from post-service's event stream (ids are never reused), so a
+    # deleted post is cached as long as a live one
+    _put(post_id, exists, POST_EXISTS_POSITIVE_TTL)
+
+def forget(post_id: str) -> None:
+    if _cache.pop(post_id, None) is not None:
+        _stats["invalidations"] += 1
+
+async def _fetch_one(post_id: str) -> bool:
+    _stats["upstream_calls"] += 1
+    try:
+        r = await http_client.get_client().head(f"{POST_SERVICE_BASE}/posts/{post_id}")
+    except httpx.RequestError:
+        raise HTTPException(status_code=503, detail="post-service unavailable")
+    if r.status_code not in (200, 404):
+        raise HTTPException(status_code=503, detail="post-service error")
+    exists = r.status_code == 200
+    _put(post_id, exists)
+    return exists
+
+async def check(post_id: str) -> bool:
+    cached = _get(post_id)
+    if cached is not None:
+        _stats["hits" if cached else "negative_hits"] += 1
+        return cached
+    task = _inflight.get(post_id)
+    if task is not None:
+        _stats["coalesced"] += 1
+    else:
+        _stats["misses"] += 1
+        task = asyncio.get_running_loop().create_task(_fetch_one(post_id))
+        _inflight[post_id] = task
+        task.add_done_callback(lambda t: _done(post_id, t))
+    return await asyncio.shield(task)
+
+def _done(post_id: str, task: asyncio.Task) -> None:
+    if _inflight.get(post_id) is task:
+        del _inflight[post_id]
+    if not task.cancelled():
+        task.exception()
+
+async def check_many(post_ids: Iterable[str]) -> Dict[str, bool]:
+    """One POST /posts/exists for every id that is neither cached nor already in flight."""
+    result: Dict[str, bool] = {}
+    waiting: Dict[str, asyncio.Task] = {}
+    missing = []
+    for pid in dict.fromkeys(post_ids):
+        cached = _get(pid)
+        if cached is not None:
+            _stats["hits" if cached else "negative_hits"] += 1
+            result[pid] = cached
+        elif pid in _inflight:
+            _stats["coalesced"] += 1
+            waiting[pid] = _inflight[pid]
+        else:
+            _stats["misses"] += 1
+            missing.append(pid)
+    if missing:
+        _stats["upstream_calls"] += 1
+        try:
+            r = await http_client.get_client().post(f"{POST_SERVICE_BASE}/posts/exists", json={"ids": missing})
+            r.raise_for_status()
+        except httpx.RequestError:
+            raise HTTPException(status_code=503, detail="post-service unavailable")
+        except httpx.HTTPStatusError:
+            raise HTTPException(status_code=503, detail="post-service error")
+        for pid, exists in r.json()["exists"].items():
+            _put(pid, exists)
+            result[pid] = exists
+    for pid, task in waiting.items():
+        result[pid] = await asyncio.shield(task)
+    return result
+
+async def _listen() -> None:
+    import redis.asyncio as aredis
+    backoff = 1.0
+    while True:
+        client = aredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                # deletions published while disconnected were missed
+                _cache.clear()
+                backoff = 1.0
+                async for msg in pubsub.listen():
+                    if msg.get("type") != "message":
+                        continue
+                    for key in json.loads(msg["data"]).get("keys", []):
+                        if key.startswith("post:"):
+                            forget(key[len("post:"):])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("post invalidation listener disconnected: %s", e)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+        finally:
+            await client.aclose()
+
+def start() -> None:
+    global _listener
+    # without Redis, cached positives simply live out POST_EXISTS_POSITIVE_TTL
+    if REDIS_HOST and _listener is None:
+        _listener = asyncio.get_running_loop().create_task(_listen())
+
+async def stop() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+
+def stats() -> Dict:
+    return {**_stats, "entries": len(_cache), "in_flight": len(_inflight)}
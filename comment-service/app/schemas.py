@@ -1,4 +1,4 @@
-from typing import Optional, Dict, Literal
+from typing import Any, Optional, Dict, List, Literal
 from pydantic import BaseModel, Field
 
 Status = Literal["healthy", "unhealthy"]
@@ -19,3 +19,17 @@ class CommentCreate(BaseModel):
 
 class CommentUpdate(BaseModel):
     body: Optional[str] = Field(None, min_length=1, max_length=10_000)
+
+# Response shape for the API docs only: read handlers return pre-rendered JSON, so FastAPI
+# never validates rows against it
+class CommentOut(BaseModel):
+    id: str
+    postId: str
+    authorId: str
+    body: str
+    created_at: str
+    updated_at: Optional[str] = None
+
+class CommentBatchCreate(BaseModel):
+    # items are validated one by one so a bad item is reported without failing the batch
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=100)
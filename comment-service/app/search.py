@@ -0,0 +1,134 @@
+import sys, heapq, itertools
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlmodel import Session
+
+from . import pagination
+from .timestamps import Timestamp
+
+# Full-text search over comment bodies with an FTS5 external-content index (text stored once,
+# in comment; triggers keep the index in step; hits joined back by rowid). postId is indexed
+# too, so ?postId= narrows the match inside the index instead of filtering afterwards.
+# comment has no INTEGER PRIMARY KEY, so VACUUM may renumber its rowids - run
+# `python -m app.search rebuild` after one. With several database shards every shard has its
+# own index; hits are merged by rank (BM25 statistics are per shard, which hash sharding
+# keeps close to the global ones).
+
+SNIPPET_TOKENS = 16
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS comment_fts USING fts5(
+           body, "postId", content='comment', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')""",
+    # rank on body only; postId is just for filtering
+    "INSERT INTO comment_fts(comment_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_ai AFTER INSERT ON comment BEGIN
+           INSERT INTO comment_fts(rowid, body, "postId") VALUES (new.rowid, new.body, new."postId");
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_ad AFTER DELETE ON comment BEGIN
+           INSERT INTO comment_fts(comment_fts, rowid, body, "postId") VALUES ('delete', old.rowid, old.body, old."postId");
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS comment_fts_au AFTER UPDATE OF body, "postId" ON comment BEGIN
+           INSERT INTO comment_fts(comment_fts, rowid, body, "postId") VALUES ('delete', old.rowid, old.body, old."postId");
+           INSERT INTO comment_fts(rowid, body, "postId") VALUES (new.rowid, new.body, new."postId");
+       END""",
+]
+
+def ensure_schema(engine) -> None:
+    """Creates the index and triggers if missing; a new index is backfilled from comment."""
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'comment_fts'")).first()
+        for stmt in SCHEMA:
+            conn.execute(text(stmt))
+        if not exists:
+            conn.execute(text("INSERT INTO comment_fts(comment_fts) VALUES ('rebuild')"))
+
+def _quote(s: str) -> str:
+    return '"' + s.replace('"', '""') + '"'
+
+def match_query(q: str, post_id: Optional[str] = None) -> str:
+    # every whitespace separated word must match (implicit AND); "word*" is a prefix search.
+    # Words are quoted so FTS5 operators and punctuation in user input can't break the query
+    terms = []
+    for word in q.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append(_quote(word) + ("*" if prefix else ""))
+    if not terms:
+        raise HTTPException(status_code=400, detail="q must contain at least one search term")
+    query = "{body} : (" + " ".join(terms) + ")"
+    if post_id:
+        query = "{postId} : " + _quote(post_id) + " AND " + query
+    return query
+
+def decode_cursor(cursor: Optional[str]) -> Optional[List]:
+    # (rank, shard, rowid) of the last hit returned
+    if cursor is None:
+        return None
+    direction, key = pagination.decode_cursor(cursor, 3)
+    if direction != "next":
+        raise HTTPException(status_code=400, detail="Search results can only be paged forward")
+    return key
+
+def _seek(shard: int, key: Optional[List]) -> str:
+    # hits after `key` in (rank, shard, rowid) order, as seen from this shard
+    if key is None:
+        return ""
+    if shard < key[1]:
+        return "AND comment_fts.rank > :rank"
+    if shard > key[1]:
+        return "AND comment_fts.rank >= :rank"
+    return "AND (comment_fts.rank > :rank OR (comment_fts.rank = :rank AND comment_fts.rowid > :rowid))"
+
+def search_comments(session: Session, shard: int, q: str, post_id: Optional[str], limit: int, key: Optional[List],
+                    mark: Tuple[str, str] = ("<mark>", "</mark>")) -> List[Dict]:
+    """One shard's best limit+1 matches after `key` (see decode_cursor), best first."""
+    params = {"q": match_query(q, post_id), "open": mark[0], "close": mark[1], "n": limit + 1,
+              "tokens": SNIPPET_TOKENS}
+    if key is not None:
+        params.update(rank=key[0], rowid=key[2])
+    rows = session.execute(text(f"""
+        SELECT c.id, c."postId", c."authorId", c.body, c.created_at, c.updated_at,
+               comment_fts.rank AS rank, comment_fts.rowid AS rowid,
+               snippet(comment_fts, 0, :open, :close, '…', :tokens) AS snippet
+        FROM comment_fts JOIN comment AS c ON c.rowid = comment_fts.rowid
+        WHERE comment_fts MATCH :q {_seek(shard, key)}
+        ORDER BY comment_fts.rank, comment_fts.rowid
+        LIMIT :n""").columns(created_at=Timestamp, updated_at=Timestamp), params).mappings().all()
+    return [{**r, "shard": shard} for r in rows]
+
+def merge(parts: Sequence[List[Dict]], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """Merges the shards' hits into one page. Returns (rows, next_cursor)."""
+    rows = list(itertools.islice(heapq.merge(*parts, key=lambda r: (r["rank"], r["shard"], r["rowid"])), limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    last = rows[-1] if rows else None
+    next_cursor = pagination.encode_cursor("next", [last["rank"], last["shard"], last["rowid"]]) if more else None
+    out = []
+    for r in rows:
+        item = {k: r[k] for k in ("id", "postId", "authorId", "body", "created_at", "updated_at", "snippet")}
+        item["score"] = -r["rank"]  # bm25: higher is better
+        out.append(item)
+    return out, next_cursor
+
+def rebuild(engine) -> int:
+    """Re-indexes every comment from scratch, then merges the index segments."""
+    ensure_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO comment_fts(comment_fts) VALUES ('rebuild')"))
+        conn.execute(text("INSERT INTO comment_fts(comment_fts) VALUES ('optimize')"))
+        return conn.execute(text("SELECT count(*) FROM comment")).scalar_one()
+
+if __name__ == "__main__":
+    # docker compose exec comment-service python -m app.search rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m app.search rebuild")
+    from . import models  # noqa: F401 - registers the tables init_db creates
+    from .db import shards, init_db, IS_SQLITE
+    if not IS_SQLITE:
+        sys.exit("full-text search needs SQLite (FTS5)")
+    init_db()
+    for shard in shards:
+        print(f"shard {shard.index}: rebuilt search index for {rebuild(shard.engine)} comments")
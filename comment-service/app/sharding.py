@@ -0,0 +1,25 @@
+import os, zlib
+from typing import Dict, Iterable, List
+
+# Hash sharding: each row lives in one of DB_SHARDS databases, picked by crc32 of its shard
+# key (post-service: the post id; comment-service: the comment's postId, so a post's comments
+# and its counter share a database). crc32 is stable across processes and Python versions,
+# unlike hash(). No engines here, so tools/reshard.py can use it offline.
+
+def shard_of(key: str, shards: int) -> int:
+    return zlib.crc32(key.encode()) % shards if shards > 1 else 0
+
+def shard_url(url: str, shard: int, shards: int) -> str:
+    """sqlite:////app/data/post.db -> sqlite:////app/data/post-2-of-4.db. One shard keeps the
+    plain URL; "-of-N" keeps the files of different layouts apart, so resharding can write
+    the new set next to the old one."""
+    if shards == 1:
+        return url
+    base, ext = os.path.splitext(url)
+    return f"{base}-{shard}-of-{shards}{ext}"
+
+def group(keys: Iterable[str], shards: int) -> Dict[int, List[str]]:
+    out: Dict[int, List[str]] = {}
+    for key in keys:
+        out.setdefault(shard_of(key, shards), []).append(key)
+    return out
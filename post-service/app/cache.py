@@ -1,8 +1,24 @@
-import json, os, redis
+import json, os, time, uuid, asyncio, logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import redis
+import redis.asyncio as aredis
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+# L1 is per process, L2 (Redis) is shared by all post-service replicas
+CACHE_L1_MAX_BYTES = int(os.getenv("CACHE_L1_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_L1_TTL = float(os.getenv("CACHE_L1_TTL", "30"))
+CACHE_L2_TTL = int(os.getenv("CACHE_L2_TTL", "300"))
+CACHE_REDIS_TIMEOUT = float(os.getenv("CACHE_REDIS_TIMEOUT", "0.25"))
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "post-cache:invalidate")
+
+log = logging.getLogger(__name__)
 
 _redis = redis.Redis(
-    host=os.getenv("REDIS_HOST", "redis"),
-    port=int(os.getenv("REDIS_PORT", "6379")),
+    host=REDIS_HOST,
+    port=REDIS_PORT,
     decode_responses=True,
 )
 
@@ -15,3 +31,217 @@ def set_json(key: str, value, ttl: int):
 
 def delete(key: str):
     _redis.delete(key)
+
+# ---- async two-tier read-through cache -------------------------------------------------
+
+_aredis = aredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True,
+                       socket_timeout=CACHE_REDIS_TIMEOUT, socket_connect_timeout=CACHE_REDIS_TIMEOUT)
+INSTANCE_ID = uuid.uuid4().hex
+_L2_RETRY_AFTER = 5.0  # seconds to skip Redis after an error instead of paying the timeout per request
+_GEN_STRIPES = 1024
+
+_stats: Dict[str, int] = dict.fromkeys(
+    ("l1_hits", "l2_hits", "misses", "loads", "coalesced", "stale_loads_dropped",
+     "invalidations", "remote_invalidations", "l1_evictions", "l2_errors"), 0)
+
+
+class _L1:
+    """TTL + LRU map bounded by the encoded size of its values."""
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._data: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, _, value = item
+        if expires < time.monotonic():
+            self.pop(key)
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        self.pop(key)
+        self._data[key] = (time.monotonic() + self.ttl, size, value)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, old_size, _) = self._data.popitem(last=False)
+            self.bytes -= old_size
+            _stats["l1_evictions"] += 1
+
+    def pop(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+_l1 = _L1(CACHE_L1_MAX_BYTES, CACHE_L1_TTL)
+_inflight: Dict[str, asyncio.Task] = {}
+# bumped on every invalidation; a load that started before an invalidation must not be cached
+_gens = [0] * _GEN_STRIPES
+_l2_down_until = 0.0
+_listener: Optional[asyncio.Task] = None
+
+def _stripe(key: str) -> int:
+    return hash(key) % _GEN_STRIPES
+
+def _l2_available() -> bool:
+    return time.monotonic() >= _l2_down_until
+
+def _l2_failed(e: Exception) -> None:
+    global _l2_down_until
+    _stats["l2_errors"] += 1
+    _l2_down_until = time.monotonic() + _L2_RETRY_AFTER
+    log.warning("redis cache unavailable: %s", e)
+
+async def aget_json(key: str):
+    if not _l2_available():
+        return None
+    try:
+        val = await _aredis.get(key)
+    except Exception as e:
+        _l2_failed(e)
+        return None
+    return json.loads(val) if val else None
+
+async def aset_json(key: str, encoded: str, ttl: int) -> None:
+    if not _l2_available():
+        return
+    try:
+        await _aredis.setex(key, ttl, encoded)
+    except Exception as e:
+        _l2_failed(e)
+
+async def get_or_load(key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+    """L1 -> L2 -> loader(). Concurrent misses on one key share a single loader call.
+    None results (e.g. not found) are returned but never cached."""
+    value = _l1.get(key)
+    if value is not None:
+        _stats["l1_hits"] += 1
+        return value
+    task = _inflight.get(key)
+    if task is not None:
+        _stats["coalesced"] += 1
+    else:
+        # the load runs as its own task so a disconnecting client doesn't cancel it for the others
+        task = asyncio.get_running_loop().create_task(_fill(key, loader))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _finish_load(key, t))
+    return await asyncio.shield(task)
+
+def peek(key: str) -> Any:
+    """The L1 value or None; never loads. For cheap checks that can fall back to the database."""
+    return _l1.get(key)
+
+def _finish_load(key: str, task: asyncio.Task) -> None:
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # mark retrieved even if every waiter went away
+
+async def _fill(key: str, loader: Callable[[], Awaitable[Any]]) -> Any:
+    gen = _gens[_stripe(key)]
+    value = await aget_json(key)
+    if value is not None:
+        _stats["l2_hits"] += 1
+        if gen == _gens[_stripe(key)]:
+            _l1.set(key, value, len(json.dumps(value)))
+        return value
+    _stats["misses"] += 1
+    _stats["loads"] += 1
+    value = await loader()
+    if value is None:
+        return None
+    if gen != _gens[_stripe(key)]:
+        _stats["stale_loads_dropped"] += 1
+        return value
+    encoded = json.dumps(value)
+    _l1.set(key, value, len(encoded))
+    await aset_json(key, encoded, CACHE_L2_TTL)
+    return value
+
+def _drop_local(key: str) -> None:
+    _gens[_stripe(key)] += 1
+    _l1.pop(key)
+
+async def invalidate(key: str) -> None:
+    """Drops key from this process, Redis, and (via pub/sub) every other replica's L1."""
+    _stats["invalidations"] += 1
+    _drop_local(key)
+    if not _l2_available():
+        return
+    try:
+        await _aredis.delete(key)
+        await _aredis.publish(CACHE_INVALIDATION_CHANNEL, json.dumps({"origin": INSTANCE_ID, "keys": [key]}))
+    except Exception as e:
+        _l2_failed(e)
+
+async def _listen() -> None:
+    backoff = 1.0
+    while True:
+        client = aredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        try:
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                # anything published while we were disconnected is lost, so start clean
+                _l1.clear()
+                backoff = 1.0
+                async for msg in pubsub.listen():
+                    if msg.get("type") != "message":
+                        continue
+                    data = json.loads(msg["data"])
+                    if data.get("origin") == INSTANCE_ID:
+                        continue
+                    for key in data.get("keys", []):
+                        _stats["remote_invalidations"] += 1
+                        _drop_local(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("cache invalidation listener disconnected: %s", e)
+            _l1.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+        finally:
+            await client.aclose()
+
+def start() -> None:
+    global _listener
+    if _listener is None:
+        _listener = asyncio.get_running_loop().create_task(_listen())
+
+async def stop() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+    await _aredis.aclose()
+
+def stats() -> Dict:
+    lookups = _stats["l1_hits"] + _stats["l2_hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_ratio": round((_stats["l1_hits"] + _stats["l2_hits"]) / lookups, 4) if lookups else None,
+        "l1_entries": len(_l1),
+        "l1_bytes": _l1.bytes,
+        "l1_max_bytes": _l1.max_bytes,
+        "l2_available": _l2_available(),
+    }
@@ -1,97 +1,384 @@
-import os, uuid, httpx
+import os, uuid, asyncio, httpx
+from contextlib import asynccontextmanager
 from typing import Dict, Optional, List
-from datetime import datetime, timezone
 
-from fastapi import FastAPI, Depends, Header, HTTPException, Query
+from anyio import from_thread
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import update
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .db import init_db, get_session
+from . import cache, token_verifier, http_client, pagination, health, metrics, tracing, debug, search, etag, export, outbox, admission, responses, batcher, timestamps
+from .db import init_db, dispose, shard_for, on_shards, on_key_shards, read_merged, IS_SQLITE
 from .models import Post
-from .schemas import HealthResponse, DependencyHealth, Status, PostCreate, PostUpdate
+from .schemas import HealthResponse, PostCreate, PostUpdate, PostExistsIn, PostOut
 
 APP_NAME = "post-service"
 AUTH_SERVICE_BASE = os.getenv("AUTH_SERVICE_BASE", "http://auth-service:8000")
 USER_SERVICE_BASE = os.getenv("USER_SERVICE_BASE", "http://user-service:8000")
+COMMENT_SERVICE_BASE = os.getenv("COMMENT_SERVICE_BASE", "http://comment-service:8000")
+BATCH_MAX_IDS = 100
+# GET /feed: per-dependency time budgets; a dependency that misses its budget is left out of the page
+FEED_USER_TIMEOUT_S = float(os.getenv("FEED_USER_TIMEOUT_S", "0.5"))
+FEED_COMMENT_TIMEOUT_S = float(os.getenv("FEED_COMMENT_TIMEOUT_S", "0.5"))
+FEED_COMMENTS_PER_POST = int(os.getenv("FEED_COMMENTS_PER_POST", "3"))
+# per user, "per-minute:burst" ("0" = off)
+post_limit = admission.RateLimit("create_post", os.getenv("RATE_LIMIT_POSTS", "30:10"))
 
-app = FastAPI(title=APP_NAME)
+async def _insert_posts(session: AsyncSession, posts: List[Post]) -> None:
+    for p in posts:
+        session.add(p)
+        outbox.add(session, "post.created", p.id, authorId=p.authorId, created_at=p.created_at)
 
-@app.on_event("startup")
-def startup():
+# concurrent POST /posts share one transaction (group commit)
+post_writes = batcher.WriteBatcher("posts", _insert_posts, key=lambda p: p.id)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     init_db()
+    http_client.start()
+    token_verifier.start()
+    cache.start()
+    health.start(APP_NAME, {
+        "auth-service": health.http_check(http_client.get_client, f"{AUTH_SERVICE_BASE}/health/ready"),
+        "user-service": health.http_check(http_client.get_client, f"{USER_SERVICE_BASE}/health/ready"),
+        "comment-service": health.http_check(http_client.get_client, f"{COMMENT_SERVICE_BASE}/health/ready"),
+        "database": health.check_database,
+    })
+    outbox.start()
+    batcher.start()
+    admission.start()
+    tracing.start()
+    yield
+    await tracing.stop()
+    await admission.stop()
+    await batcher.stop()
+    await outbox.stop()
+    await health.stop()
+    await cache.stop()
+    await token_verifier.stop()
+    await http_client.close()
+    await dispose()
+
+app = FastAPI(title=APP_NAME, lifespan=lifespan, default_response_class=ORJSONResponse)
+# inserts are group-committed: their class starts wide enough to fill a batch
+app.add_middleware(admission.AdmissionMiddleware, router=app.router,
+                   classes={"GET /feed": "fanout", "GET /posts/export": "export", "POST /posts": "insert"},
+                   initial={"insert": batcher.WRITE_BATCH_MAX} if batcher.WRITE_BATCHING else None)
+app.add_middleware(responses.CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware, router=app.router)
+app.add_middleware(tracing.TracingMiddleware, service=APP_NAME)  # added last = outermost
+if debug.DEBUG_ENDPOINTS:
+    app.include_router(debug.router)  # /debug/profile, /debug/slow
+
+def parse_ids(ids: str) -> List[str]:
+    # ?ids=a,b,c -> unique ids in request order
+    parsed = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not parsed:
+        raise HTTPException(status_code=400, detail="ids required")
+    if len(parsed) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IDS} ids per batch")
+    return parsed
 
 async def verify_token(authorization: Optional[str] = Header(None)) -> Dict:
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
     token = authorization.split(" ", 1)[1]
-    async with httpx.AsyncClient(timeout=10) as client:
-        try:
-            r = await client.post(f"{AUTH_SERVICE_BASE}/auth/verify", json={"token": token})
-            if r.status_code != 200:
-                # Log the actual error for debugging
-                error_detail = r.json().get("detail", "Unknown error") if r.status_code < 500 else "Auth service error"
-                raise HTTPException(status_code=401, detail=f"Invalid token: {error_detail}")
-            return r.json()  # {"user_id": "...", "email": "..."}
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=503, detail=f"Auth service unavailable: {str(e)}")
-        except Exception as e:
-            raise HTTPException(status_code=401, detail=f"Token verification failed: {str(e)}")    
+    if token_verifier.AUTH_VERIFY_MODE != "remote":
+        return token_verifier.verify_local(token)
+    client = http_client.get_client()
+    try:
+        r = await client.post(f"{AUTH_SERVICE_BASE}/auth/verify", json={"token": token})
+        if r.status_code != 200:
+            # Log the actual error for debugging
+            error_detail = r.json().get("detail", "Unknown error") if r.status_code < 500 else "Auth service error"
+            raise HTTPException(status_code=401, detail=f"Invalid token: {error_detail}")
+        return r.json()  # {"user_id": "...", "email": "..."}
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Auth service unavailable: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=401, detail=f"Token verification failed: {str(e)}")
 
+# Served from the background prober's snapshot: O(1), never calls other services inline
 @app.get("/health", response_model=HealthResponse)
-async def health():
-    deps: Dict[str, DependencyHealth] = {}
-    # auth
+async def health_check():
+    return health.snapshot()
+
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready(response: Response):
+    if not health.ready():
+        response.status_code = 503
+        return {"status": "not ready"}
+    return {"status": "ready"}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(APP_NAME), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/internal/http-pool")
+def http_pool_stats():
+    return http_client.stats()
+
+@app.get("/internal/cache-stats")
+def cache_stats():
+    return cache.stats()
+
+@app.get("/internal/outbox")
+async def outbox_stats():
+    return await outbox.stats()
+
+@app.get("/internal/admission")
+def admission_stats():
+    return admission.stats()
+
+@app.get("/internal/write-batches")
+def write_batch_stats():
+    return batcher.stats()
+
+def _post_key(post_id: str) -> str:
+    return f"post:{post_id}"
+
+# sessions on the shard that holds the post named in the path
+def post_session(post_id: str):
+    with Session(shard_for(post_id).engine) as session:
+        yield session
+
+def post_read_session(post_id: str):
+    with Session(shard_for(post_id).read_engine) as session:
+        yield session
+
+def _page_key(p):
+    return (p.created_at, p.id)
+
+def _posts_by_id(cols, ids) -> list:
+    # rows (also for a single column) of the given posts, each looked up on its own shard
+    return [r for part in on_key_shards(lambda session, keys: session.execute(
+        select(*cols).where(Post.id.in_(keys))).all(), ids) for r in part]
+
+async def fetch_comment_counts(post_ids: List[str]) -> Optional[Dict[str, int]]:
+    # best effort: a list page is still useful without counts if comment-service is down
     try:
-        async with httpx.AsyncClient(timeout=5) as c:
-            r = await c.get(f"{AUTH_SERVICE_BASE}/health")
-            deps["auth-service"] = DependencyHealth(
-                status="healthy" if r.status_code == 200 else "unhealthy",
-                response_time_ms=None if r is None else None,
-                error=None if r.status_code == 200 else f"HTTP {r.status_code}",
-            )
-    except Exception as e:
-        deps["auth-service"] = DependencyHealth(status="unhealthy", error=str(e))
-    # db
+        r = await http_client.get_client().get(f"{COMMENT_SERVICE_BASE}/comments/counts",
+                                               params={"postIds": ",".join(post_ids)})
+        r.raise_for_status()
+        return r.json()["counts"]
+    except (httpx.HTTPError, KeyError, ValueError):
+        return None
+
+async def fetch_dependency(url: str, params: Dict, timeout: float) -> Optional[Dict]:
+    # one fan-out call for /feed: None on error or timeout so the page degrades instead of failing
     try:
-        for _ in get_session(): pass
-        db_ok = True
-    except Exception as e:
-        deps["database"] = DependencyHealth(status="unhealthy", error=str(e))
-        db_ok = False
-    overall: Status = "healthy" if all(d.status=="healthy" for d in deps.values()) and db_ok else "unhealthy"
-    return HealthResponse(service=APP_NAME, status=overall, dependencies=deps)
+        r = await asyncio.wait_for(http_client.get_client().get(url, params=params), timeout)
+        r.raise_for_status()
+        return r.json()
+    except (asyncio.TimeoutError, httpx.HTTPError, ValueError):
+        return None
+
+def _load_post(post_id: str) -> Optional[Dict]:
+    with Session(shard_for(post_id).read_engine) as session:
+        row = session.exec(select(*Post.__table__.c).where(Post.id == post_id)).first()
+        return dict(row._mapping) if row else None
+
+def _load_etag(post_id: str) -> Optional[str]:
+    # version columns only: a conditional GET never reads the body
+    with Session(shard_for(post_id).read_engine) as session:
+        row = session.exec(select(Post.id, Post.created_at, Post.updated_at).where(Post.id == post_id)).first()
+        return etag.of(*row) if row else None
 
 @app.post("/posts", status_code=201)
-async def create_post(body: PostCreate, user=Depends(verify_token), session: Session = Depends(get_session)):
+async def create_post(body: PostCreate, user=Depends(verify_token)):
+    post_limit.check(user["user_id"])
     p = Post(id=str(uuid.uuid4()), authorId=user["user_id"], title=body.title, body=body.body)
-    session.add(p); session.commit(); session.refresh(p)
+    await post_writes.submit(p)
+    outbox.notify()
     return p
 
-@app.get("/posts/{post_id}")
-def get_post(post_id: str, session: Session = Depends(get_session)):
-    p = session.get(Post, post_id)
+# Cheap existence checks for other services (comment-service): no body is loaded or sent
+@app.post("/posts/exists")
+def posts_exist(body: PostExistsIn):
+    ids = set(body.ids)
+    found = {r.id for r in _posts_by_id([Post.id], ids)}
+    return {"exists": {i: i in found for i in ids}}
+
+@app.get("/posts:batchGet")
+def batch_get_posts(ids: str = Query(..., description="Comma-separated post ids")):
+    wanted = parse_ids(ids)
+    found = {r.id: r for r in _posts_by_id(Post.__table__.c, wanted)}
+    return responses.json({"items": responses.rows(found[i] for i in wanted if i in found),
+                           "missing": [i for i in wanted if i not in found]})
+
+# Full-text search (FTS5, BM25-ranked, best match first). Page with the X-Next-Cursor header.
+@app.get("/posts/search")
+def search_posts(response: Response,
+                 q: str = Query(..., min_length=1, max_length=200),
+                 limit: int = Query(20, ge=1, le=100),
+                 cursor: Optional[str] = Query(None)):
+    if not IS_SQLITE:
+        raise HTTPException(status_code=501, detail="Search requires the SQLite database")
+    key = search.decode_cursor(cursor)
+    rows, next_cursor = search.merge(
+        on_shards(lambda session, shard: search.search_posts(session, shard.index, q, limit, key)), limit)
+    pagination.set_cursor_headers(response, next_cursor, None)
+    return responses.json(rows, response)
+
+# All posts as NDJSON in (created_at, id) order, streamed; gzip with Accept-Encoding: gzip.
+# Resume with ?cursor=<_cursor of the last line received>; ?since= / ?until= limit created_at.
+@app.get("/posts/export")
+def export_posts(cursor: Optional[str] = Query(None),
+                 since: Optional[str] = Query(None),
+                 until: Optional[str] = Query(None),
+                 accept_encoding: Optional[str] = Header(None)):
+    stmt = timestamps.between(select(*Post.__table__.columns), Post.created_at, since, until)
+    stmt = export.seek(stmt, (Post.created_at, Post.id), cursor)
+    return export.ndjson_response(stmt, lambda r: (r["created_at"], r["id"]), accept_encoding)
+
+@app.head("/posts/{post_id}")
+def post_exists(post_id: str, session: Session = Depends(post_read_session)):
+    found = session.exec(select(Post.id).where(Post.id == post_id)).first()
+    return Response(status_code=200 if found else 404)
+
+# Strong ETag per post; If-None-Match is answered from L1 or the version columns, so a 304
+# skips both the body load and serialisation.
+@app.get("/posts/{post_id}", response_model=PostOut)
+async def get_post(post_id: str, response: Response, if_none_match: Optional[str] = Header(None)):
+    if if_none_match:
+        cached = cache.peek(_post_key(post_id))
+        tag = etag.of(cached["id"], cached["created_at"], cached["updated_at"]) if cached \
+            else await run_in_threadpool(_load_etag, post_id)
+        if tag and etag.none_match(if_none_match, tag):
+            response.headers["ETag"] = tag
+            return etag.not_modified(response)
+    p = await cache.get_or_load(_post_key(post_id), lambda: run_in_threadpool(_load_post, post_id))
     if not p: raise HTTPException(status_code=404, detail="Post not found")
-    return p
+    response.headers["ETag"] = etag.of(p["id"], p["created_at"], p["updated_at"])
+    return responses.json(p, response)
+
+# Ordered by (created_at, id). Pass the X-Next-Cursor / X-Prev-Cursor response header back as
+# ?cursor= to page forward/backward; offset still works but is the slow path (O(offset) scan).
+# ?include=comment_counts adds each post's comment_count (null if comment-service is unavailable).
+# Pages carry a collection ETag. With If-None-Match the page is first read as version columns
+# only, and bodies are loaded just when it has changed.
+# ?fields=id,title,... returns (and reads) only those columns, e.g. a list view without bodies.
+# ?since= / ?until= (ISO-8601) keep posts created in [since, until): a range of the
+# (created_at, id) index.
+@app.get("/posts", response_model=List[PostOut])
+def list_posts(response: Response,
+               limit: int = Query(50, ge=1, le=100),
+               offset: int = Query(0, ge=0),
+               cursor: Optional[str] = Query(None),
+               since: Optional[str] = Query(None),
+               until: Optional[str] = Query(None),
+               include: Optional[str] = Query(None),
+               fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+               if_none_match: Optional[str] = Header(None)):
+    # every shard is read in parallel and the pages merged in (created_at, id) order
+    order = (Post.created_at, Post.id)
+    if cursor is not None and offset:
+        raise HTTPException(status_code=400, detail="Use either cursor or offset, not both")
+    names = responses.parse_fields(fields, Post)
+    full = responses.columns(Post, names, "id", "created_at", "updated_at")
+    # counts live in comment-service, so pages with them are not conditional
+    light = bool(if_none_match) and include is None
+    cols = (Post.id, Post.created_at, Post.updated_at) if light else full
+    base = timestamps.between(select(*cols), Post.created_at, since, until)
+    next_cursor = prev_cursor = None
+    if offset:
+        rows = read_merged(base.order_by(*order), _page_key, limit, skip=offset)
+    else:
+        stmt, direction, key = pagination.keyset(base, order, cursor, limit)
+        rows, next_cursor, prev_cursor = pagination.page(
+            read_merged(stmt, _page_key, limit + 1, reverse=direction == "prev"), limit, direction, key, _page_key)
+        pagination.set_cursor_headers(response, next_cursor, prev_cursor)
+    if include == "comment_counts" and rows:
+        found = from_thread.run(fetch_comment_counts, [p.id for p in rows]) or {}
+        return responses.json([{**d, "comment_count": found.get(p.id)}
+                               for p, d in zip(rows, responses.rows(rows, names))], response)
+    response.headers["ETag"] = etag.of_rows(rows, next_cursor, prev_cursor, names and ",".join(names))
+    if light:
+        if etag.none_match(if_none_match, response.headers["ETag"]):
+            return etag.not_modified(response)
+        found = {p.id: p for p in _posts_by_id(full, [r.id for r in rows])}
+        rows = [found[r.id] for r in rows if r.id in found]
+    return responses.json(responses.rows(rows, names), response)
+
+def _load_page(limit: int, cursor: Optional[str]):
+    stmt, direction, key = pagination.keyset(select(*Post.__table__.c), (Post.created_at, Post.id), cursor, limit)
+    rows, next_cursor, prev_cursor = pagination.page(
+        read_merged(stmt, _page_key, limit + 1, reverse=direction == "prev"), limit, direction, key, _page_key)
+    return responses.rows(rows), next_cursor, prev_cursor
 
-@app.get("/posts")
-def list_posts(limit: int = Query(50, ge=1, le=100), offset: int = Query(0, ge=0), session: Session = Depends(get_session)):
-    rows = session.exec(select(Post).offset(offset).limit(limit)).all()
-    return rows
+# A /posts page with each post's author profile, comment count and newest comments inline.
+# Built from one users:batchGet (distinct authors) and one comments:previews call, issued
+# concurrently, each with its own time budget. A dependency that fails or is too slow leaves
+# its fields null and is named in X-Feed-Degraded instead of failing the page.
+@app.get("/feed")
+async def feed(response: Response,
+               limit: int = Query(20, ge=1, le=100),
+               cursor: Optional[str] = Query(None),
+               comments: int = Query(FEED_COMMENTS_PER_POST, ge=0, le=20)):
+    rows, next_cursor, prev_cursor = await run_in_threadpool(_load_page, limit, cursor)
+    pagination.set_cursor_headers(response, next_cursor, prev_cursor)
+    if not rows:
+        return []
+    author_ids = list(dict.fromkeys(p["authorId"] for p in rows))
+    users, previews = await asyncio.gather(
+        fetch_dependency(f"{USER_SERVICE_BASE}/users:batchGet", {"ids": ",".join(author_ids)}, FEED_USER_TIMEOUT_S),
+        fetch_dependency(f"{COMMENT_SERVICE_BASE}/comments:previews",
+                         {"postIds": ",".join(p["id"] for p in rows), "per_post": comments}, FEED_COMMENT_TIMEOUT_S))
+    degraded = [name for name, got in (("user-service", users), ("comment-service", previews)) if got is None]
+    if degraded:
+        response.headers["X-Feed-Degraded"] = ",".join(degraded)
+    profiles = {u["userId"]: u for u in users["items"]} if users else {}
+    previews = previews["previews"] if previews else {}
+    out = []
+    for p in rows:
+        preview = previews.get(p["id"])
+        out.append({**p,
+                    "author": profiles.get(p["authorId"]),
+                    "comment_count": preview["count"] if preview else None,
+                    "comments": preview["latest"] if preview else None})
+    return responses.json(out, response)
 
+# If-Match (optimistic concurrency): 412 unless the post still has that ETag. The check is
+# repeated in the UPDATE's WHERE clause, so a concurrent writer can't slip in between.
 @app.put("/posts/{post_id}")
-def update_post(post_id: str, body: PostUpdate, user=Depends(verify_token), session: Session = Depends(get_session)):
+def update_post(post_id: str, body: PostUpdate, response: Response, user=Depends(verify_token),
+                if_match: Optional[str] = Header(None), session: Session = Depends(post_session)):
     p = session.get(Post, post_id)
     if not p: raise HTTPException(status_code=404, detail="Post not found")
     if p.authorId != user["user_id"]: raise HTTPException(status_code=403, detail="Forbidden")
-    if body.title is not None: p.title = body.title
-    if body.body is not None:  p.body  = body.body
-    p.updated_at = datetime.now(timezone.utc).isoformat()
-    session.add(p); session.commit(); session.refresh(p)
+    etag.check_match(if_match, etag.of(p.id, p.created_at, p.updated_at))
+    values = {"updated_at": timestamps.now()}
+    if body.title is not None: values["title"] = body.title
+    if body.body is not None:  values["body"]  = body.body
+    stmt = update(Post).where(Post.id == post_id).values(**values)
+    if if_match:
+        stmt = stmt.where(Post.updated_at.is_not_distinct_from(p.updated_at))
+    if session.exec(stmt).rowcount == 0:  # changed (If-Match) or deleted since the read above
+        session.rollback()
+        if if_match: raise HTTPException(status_code=412, detail="Precondition failed: the resource has changed")
+        raise HTTPException(status_code=404, detail="Post not found")
+    outbox.add(session, "post.updated", post_id, authorId=p.authorId, updated_at=values["updated_at"])
+    session.commit(); session.refresh(p)
+    outbox.notify()
+    from_thread.run(cache.invalidate, _post_key(post_id))
+    response.headers["ETag"] = etag.of(p.id, p.created_at, p.updated_at)
     return p
 
 @app.delete("/posts/{post_id}", status_code=204)
-def delete_post(post_id: str, user=Depends(verify_token), session: Session = Depends(get_session)):
+def delete_post(post_id: str, user=Depends(verify_token), session: Session = Depends(post_session)):
     p = session.get(Post, post_id)
     if not p: raise HTTPException(status_code=404, detail="Post not found")
     if p.authorId != user["user_id"]: raise HTTPException(status_code=403, detail="Forbidden")
-    session.delete(p); session.commit()
+    session.delete(p)
+    outbox.add(session, "post.deleted", post_id, authorId=p.authorId)
+    session.commit()
+    outbox.notify()
+    from_thread.run(cache.invalidate, _post_key(post_id))
     return None
@@ -1,11 +1,27 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from typing import Optional
 from datetime import datetime, timezone
 
+from . import timestamps
+from .timestamps import Timestamp
+
 class Post(SQLModel, table=True):
+    # keyset pagination order for GET /posts
+    __table_args__ = (Index("ix_post_created_at_id", "created_at", "id"),)
+
     id: str = Field(primary_key=True, index=True)
     authorId: str = Field(index=True)
     title: str
     body: str
+    created_at: str = Field(default_factory=timestamps.now, sa_type=Timestamp)
+    updated_at: Optional[str] = Field(default=None, sa_type=Timestamp)
+
+class OutboxEvent(SQLModel, table=True):
+    # domain events written in the same transaction as the post change; outbox.py relays
+    # them to a Redis stream in seq order and deletes them once published
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    type: str                 # post.created / post.updated / post.deleted
+    aggregate_id: str         # post id
+    payload: str              # JSON
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
-    updated_at: Optional[str] = None
@@ -0,0 +1,130 @@
+import os, json, uuid, asyncio, logging
+from typing import Dict, Optional
+
+import redis.asyncio as aredis
+from sqlalchemy import delete, func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .db import Shard, shards
+from .models import OutboxEvent
+
+# Transactional outbox: handlers add an event row in the same transaction as the post
+# change (add()), so an event exists if and only if the change committed. A background
+# relay publishes rows to a Redis stream in seq order and deletes them once XADD succeeded
+# (at-least-once: consumers must be idempotent). With several replicas, only the holder of a
+# short Redis lease relays, so the stream keeps commit order. Each database shard has its own
+# outbox (the events share a transaction with the post); a post's events are all in its
+# shard, so they stay in order, while events of different shards may interleave.
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+POST_EVENTS_STREAM = os.getenv("POST_EVENTS_STREAM", "post-events")
+POST_EVENTS_MAXLEN = int(os.getenv("POST_EVENTS_MAXLEN", "100000"))  # approximate trim
+OUTBOX_POLL_S = float(os.getenv("OUTBOX_POLL_S", "1"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "200"))
+OUTBOX_LEASE_MS = int(os.getenv("OUTBOX_LEASE_MS", "5000"))
+_LEASE_KEY = f"{POST_EVENTS_STREAM}:relay"
+INSTANCE_ID = uuid.uuid4().hex
+
+log = logging.getLogger(__name__)
+
+_task: Optional[asyncio.Task] = None
+_wake: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_stats: Dict[str, int] = dict.fromkeys(("published", "batches", "errors"), 0)
+_leader = False
+
+def add(session, type: str, post_id: str, **payload) -> None:
+    """Queues an event in the caller's (sync or async) session; committed with it."""
+    session.add(OutboxEvent(type=type, aggregate_id=post_id, payload=json.dumps({"id": post_id, **payload})))
+
+def notify() -> None:
+    # after a commit that added events: relay now instead of at the next poll.
+    # Safe from the event loop and from threadpool (sync handler) threads.
+    if _loop is not None and _wake is not None:
+        _loop.call_soon_threadsafe(_wake.set)
+
+async def _lead(r) -> bool:
+    global _leader
+    if await r.set(_LEASE_KEY, INSTANCE_ID, nx=True, px=OUTBOX_LEASE_MS):
+        _leader = True
+    elif await r.get(_LEASE_KEY) == INSTANCE_ID:
+        await r.pexpire(_LEASE_KEY, OUTBOX_LEASE_MS)
+        _leader = True
+    else:
+        _leader = False
+    return _leader
+
+async def _relay_shard(r, shard: Shard) -> int:
+    async with AsyncSession(shard.async_engine) as session:
+        rows = (await session.exec(select(OutboxEvent).order_by(OutboxEvent.seq).limit(OUTBOX_BATCH))).all()
+        if not rows:
+            return 0
+        async with r.pipeline(transaction=False) as pipe:
+            for e in rows:
+                pipe.xadd(POST_EVENTS_STREAM,
+                          {"type": e.type, "post_id": e.aggregate_id, "payload": e.payload,
+                           "seq": e.seq, "at": e.created_at},
+                          maxlen=POST_EVENTS_MAXLEN, approximate=True)
+            await pipe.execute()
+        await session.exec(delete(OutboxEvent).where(OutboxEvent.seq.in_([e.seq for e in rows])))
+        await session.commit()
+    _stats["published"] += len(rows)
+    _stats["batches"] += 1
+    return len(rows)
+
+async def relay_once(r) -> int:
+    """Publishes up to OUTBOX_BATCH events per shard; returns how many in total."""
+    return sum([await _relay_shard(r, shard) for shard in shards])
+
+async def _run() -> None:
+    r = aredis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+    backoff = OUTBOX_POLL_S
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(_wake.wait(), timeout=backoff)
+            except asyncio.TimeoutError:
+                pass
+            _wake.clear()
+            try:
+                if await _lead(r):
+                    while await relay_once(r) >= OUTBOX_BATCH:  # some shard may have more
+                        pass
+                backoff = OUTBOX_POLL_S
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # events stay in the outbox and are retried; Redis being down delays, never loses them
+                _stats["errors"] += 1
+                log.warning("outbox relay failed: %s", e)
+                backoff = min(backoff * 2, 30.0)
+    finally:
+        await r.aclose()
+
+def start() -> None:
+    global _task, _wake, _loop
+    if _task is None:
+        _loop = asyncio.get_running_loop()
+        _wake = asyncio.Event()
+        _wake.set()  # publish whatever a previous run left behind
+        _task = _loop.create_task(_run())
+
+async def stop() -> None:
+    global _task, _loop
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+        _loop = None
+
+async def stats() -> Dict:
+    backlog = 0
+    for shard in shards:
+        async with AsyncSession(shard.async_engine) as session:
+            backlog += (await session.exec(select(func.count()).select_from(OutboxEvent))).one()
+    return {**_stats, "leader": _leader, "backlog": backlog, "stream": POST_EVENTS_STREAM}
@@ -0,0 +1,75 @@
+import base64, json
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+from .timestamps import Timestamp
+
+# Opaque keyset cursors: base64url(json([direction, *key])). "next" continues after the key,
+# "prev" returns the page just before it.
+
+def encode_cursor(direction: str, key: Sequence[Any]) -> str:
+    raw = json.dumps([direction, *key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, width: int) -> Tuple[str, List[Any]]:
+    try:
+        direction, *key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if direction not in ("next", "prev") or len(key) != width:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return direction, key
+
+def typed(columns: Sequence, key: Sequence):
+    # a cursor's values bound with their columns' types (e.g. ISO created_at -> epoch µs);
+    # a plain tuple_(*key) would compare them as untyped literals
+    try:
+        for c, value in zip(columns, key):
+            if isinstance(c.type, Timestamp):
+                c.type.process_bind_param(value, None)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple_(*key, types=[c.type for c in columns])
+
+def keyset(stmt, columns: Sequence, cursor: Optional[str], limit: int):
+    """Orders stmt by columns and seeks past cursor. Fetches limit+1 rows so the caller
+    can tell whether another page exists; pass the result to page()."""
+    if cursor is None:
+        return stmt.order_by(*columns).limit(limit + 1), "next", None
+    direction, key = decode_cursor(cursor, len(columns))
+    bound = typed(columns, key)
+    if direction == "next":
+        stmt = stmt.where(tuple_(*columns) > bound).order_by(*columns)
+    else:
+        stmt = stmt.where(tuple_(*columns) < bound).order_by(*[c.desc() for c in columns])
+    return stmt.limit(limit + 1), direction, key
+
+def page(rows: List, limit: int, direction: str, cursor_key: Optional[List], key_of: Callable[[Any], Sequence]):
+    """Returns (rows in ascending order, next_cursor, prev_cursor)."""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == "prev":
+        rows.reverse()
+    if not rows:
+        # keep the caller able to turn around from an empty page
+        if cursor_key is None:
+            return rows, None, None
+        if direction == "next":
+            return rows, None, encode_cursor("prev", cursor_key)
+        return rows, encode_cursor("next", cursor_key), None
+    first, last = key_of(rows[0]), key_of(rows[-1])
+    if direction == "next":
+        next_cursor = encode_cursor("next", last) if more else None
+        prev_cursor = encode_cursor("prev", first) if cursor_key is not None else None
+    else:
+        next_cursor = encode_cursor("next", last)
+        prev_cursor = encode_cursor("prev", first) if more else None
+    return rows, next_cursor, prev_cursor
+
+def set_cursor_headers(response, next_cursor: Optional[str], prev_cursor: Optional[str]) -> None:
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if prev_cursor:
+        response.headers["X-Prev-Cursor"] = prev_cursor
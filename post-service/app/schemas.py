@@ -1,4 +1,4 @@
-from typing import Optional, Dict, Literal
+from typing import Optional, Dict, List, Literal
 from pydantic import BaseModel, Field
 
 Status = Literal["healthy","unhealthy"]
@@ -18,3 +18,16 @@ class PostCreate(BaseModel):
 class PostUpdate(BaseModel):
     title: Optional[str] = Field(None, min_length=1, max_length=200)
     body: Optional[str]  = Field(None, min_length=1, max_length=100000)
+
+# Response shape for the API docs only: read handlers return pre-rendered JSON, so FastAPI
+# never validates rows against it
+class PostOut(BaseModel):
+    id: str
+    authorId: str
+    title: str
+    body: str
+    created_at: str
+    updated_at: Optional[str] = None
+
+class PostExistsIn(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=500)
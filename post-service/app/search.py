@@ -0,0 +1,126 @@
+import sys, heapq, itertools
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlmodel import Session
+
+from . import pagination
+from .timestamps import Timestamp
+
+# Full-text search over post(title, body) with an FTS5 external-content index: the text is
+# stored once (in post), triggers keep the index in step with every insert/update/delete,
+# and hits are joined back to post by rowid. post has no INTEGER PRIMARY KEY, so VACUUM may
+# renumber its rowids - run `python -m app.search rebuild` after one. With several database
+# shards every shard has its own index; hits are merged by rank (BM25 statistics are per
+# shard, which hash sharding keeps close to the global ones).
+
+SNIPPET_TOKENS = 16
+
+SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(
+           title, body, content='post', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')""",
+    # BM25 with title matches weighted above body matches; ORDER BY rank then uses it
+    "INSERT INTO post_fts(post_fts, rank) VALUES ('rank', 'bm25(4.0, 1.0)')",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_ai AFTER INSERT ON post BEGIN
+           INSERT INTO post_fts(rowid, title, body) VALUES (new.rowid, new.title, new.body);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_ad AFTER DELETE ON post BEGIN
+           INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS post_fts_au AFTER UPDATE OF title, body ON post BEGIN
+           INSERT INTO post_fts(post_fts, rowid, title, body) VALUES ('delete', old.rowid, old.title, old.body);
+           INSERT INTO post_fts(rowid, title, body) VALUES (new.rowid, new.title, new.body);
+       END""",
+]
+
+def ensure_schema(engine) -> None:
+    """Creates the index and triggers if missing; a new index is backfilled from post."""
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'post_fts'")).first()
+        for stmt in SCHEMA:
+            conn.execute(text(stmt))
+        if not exists:
+            conn.execute(text("INSERT INTO post_fts(post_fts) VALUES ('rebuild')"))
+
+def match_query(q: str) -> str:
+    # every whitespace separated word must match (implicit AND); "word*" is a prefix search.
+    # Words are quoted so FTS5 operators and punctuation in user input can't break the query
+    terms = []
+    for word in q.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*").replace('"', '""')
+        if word:
+            terms.append(f'"{word}"' + ("*" if prefix else ""))
+    if not terms:
+        raise HTTPException(status_code=400, detail="q must contain at least one search term")
+    return " ".join(terms)
+
+def decode_cursor(cursor: Optional[str]) -> Optional[List]:
+    # (rank, shard, rowid) of the last hit returned
+    if cursor is None:
+        return None
+    direction, key = pagination.decode_cursor(cursor, 3)
+    if direction != "next":
+        raise HTTPException(status_code=400, detail="Search results can only be paged forward")
+    return key
+
+def _seek(shard: int, key: Optional[List]) -> str:
+    # hits after `key` in (rank, shard, rowid) order, as seen from this shard
+    if key is None:
+        return ""
+    if shard < key[1]:
+        return "AND post_fts.rank > :rank"
+    if shard > key[1]:
+        return "AND post_fts.rank >= :rank"
+    return "AND (post_fts.rank > :rank OR (post_fts.rank = :rank AND post_fts.rowid > :rowid))"
+
+def search_posts(session: Session, shard: int, q: str, limit: int, key: Optional[List],
+                 mark: Tuple[str, str] = ("<mark>", "</mark>")) -> List[Dict]:
+    """One shard's best limit+1 matches after `key` (see decode_cursor), best first."""
+    params = {"q": match_query(q), "open": mark[0], "close": mark[1], "n": limit + 1, "tokens": SNIPPET_TOKENS}
+    if key is not None:
+        params.update(rank=key[0], rowid=key[2])
+    rows = session.execute(text(f"""
+        SELECT p.id, p."authorId", p.title, p.body, p.created_at, p.updated_at,
+               post_fts.rank AS rank, post_fts.rowid AS rowid,
+               snippet(post_fts, -1, :open, :close, '…', :tokens) AS snippet
+        FROM post_fts JOIN post AS p ON p.rowid = post_fts.rowid
+        WHERE post_fts MATCH :q {_seek(shard, key)}
+        ORDER BY post_fts.rank, post_fts.rowid
+        LIMIT :n""").columns(created_at=Timestamp, updated_at=Timestamp), params).mappings().all()
+    return [{**r, "shard": shard} for r in rows]
+
+def merge(parts: Sequence[List[Dict]], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """Merges the shards' hits into one page. Returns (rows, next_cursor)."""
+    rows = list(itertools.islice(heapq.merge(*parts, key=lambda r: (r["rank"], r["shard"], r["rowid"])), limit + 1))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    last = rows[-1] if rows else None
+    next_cursor = pagination.encode_cursor("next", [last["rank"], last["shard"], last["rowid"]]) if more else None
+    out = []
+    for r in rows:
+        item = {k: r[k] for k in ("id", "authorId", "title", "body", "created_at", "updated_at", "snippet")}
+        item["score"] = -r["rank"]  # bm25: higher is better
+        out.append(item)
+    return out, next_cursor
+
+def rebuild(engine) -> int:
+    """Re-indexes every post from scratch, then merges the index segments."""
+    ensure_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO post_fts(post_fts) VALUES ('rebuild')"))
+        conn.execute(text("INSERT INTO post_fts(post_fts) VALUES ('optimize')"))
+        return conn.execute(text("SELECT count(*) FROM post")).scalar_one()
+
+if __name__ == "__main__":
+    # docker compose exec post-service python -m app.search rebuild
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m app.search rebuild")
+    from . import models  # noqa: F401 - registers the tables init_db creates
+    from .db import shards, init_db, IS_SQLITE
+    if not IS_SQLITE:
+        sys.exit("full-text search needs SQLite (FTS5)")
+    init_db()
+    for shard in shards:
+        print(f"shard {shard.index}: rebuilt search index for {rebuild(shard.engine)} posts")
@@ -0,0 +1,336 @@
+import os, time, json, uuid, random, asyncio, logging, importlib
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+# Request ids and lightweight spans. nginx stamps X-Request-ID; every service keeps it in a
+# contextvar, returns it on the response and forwards it (plus the sampling decision and the
+# calling span) on outbound httpx calls. Spans of sampled requests go to an exporter - by
+# default a local JSONL file; tools/trace_waterfall.py turns those files into waterfalls.
+# With SLOW_REQUEST_MS set, every request records its spans (unsampled ones are not exported)
+# and requests slower than that keep a summary - SQL, upstream calls, total time - in a ring
+# buffer served at /debug/slow (debug.py).
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+# per route overrides, "METHOD /path-prefix=rate" comma separated; longest prefix wins,
+# e.g. "POST /comments=1,GET /posts=0.05"
+TRACE_SAMPLE_RULES = os.getenv("TRACE_SAMPLE_RULES", "")
+# "jsonl" (TRACE_FILE), "none", or "package.module:attr" naming an object with export(spans)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl")
+TRACE_FILE = os.getenv("TRACE_FILE", "/app/data/traces.jsonl")
+TRACE_FLUSH_S = float(os.getenv("TRACE_FLUSH_S", "1"))
+TRACE_SQL_CHARS = int(os.getenv("TRACE_SQL_CHARS", "120"))  # statement prefix kept per db span
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 = off
+SLOW_REQUEST_BUFFER = int(os.getenv("SLOW_REQUEST_BUFFER", "100"))
+SLOW_REQUEST_MAX_CALLS = int(os.getenv("SLOW_REQUEST_MAX_CALLS", "100"))  # SQL / upstream entries per request
+
+log = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+SAMPLED_HEADER = "X-Trace-Sampled"
+PARENT_HEADER = "X-Parent-Span"
+
+
+def _parse_rules(raw: str) -> List[Tuple[str, str, float]]:
+    rules = []
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        route, _, rate = part.rpartition("=")
+        method, _, prefix = route.strip().partition(" ")
+        rules.append((method.upper(), prefix.strip(), float(rate)))
+    return sorted(rules, key=lambda r: len(r[1]), reverse=True)
+
+_rules = _parse_rules(TRACE_SAMPLE_RULES)
+
+def sample_rate(method: str, path: str) -> float:
+    for m, prefix, rate in _rules:
+        if (m == "*" or m == method) and path.startswith(prefix):
+            return rate
+    return TRACE_SAMPLE_RATE
+
+
+class _Trace:
+    __slots__ = ("request_id", "sampled", "recording", "spans")
+
+    def __init__(self, request_id: str, sampled: bool):
+        self.request_id = request_id
+        self.sampled = sampled                               # spans are exported
+        self.recording = sampled or SLOW_REQUEST_MS > 0      # spans are collected
+        self.spans: List[Dict] = []
+
+_trace: ContextVar[Optional[_Trace]] = ContextVar("trace", default=None)
+_parent: ContextVar[Optional[str]] = ContextVar("trace_parent", default=None)
+_service = ""
+
+
+class Span:
+    __slots__ = ("trace", "name", "attrs", "id", "parent", "start_us", "t0", "_token")
+
+    def __init__(self, trace: _Trace, name: str, attrs: Dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.id = os.urandom(8).hex()
+        self.parent = _parent.get()
+        self._token = None
+
+    def start(self) -> "Span":
+        self.start_us = time.time_ns() // 1000
+        self.t0 = time.perf_counter()
+        return self
+
+    def finish(self, error: Optional[str] = None) -> None:
+        rec = {"trace": self.trace.request_id, "span": self.id, "parent": self.parent,
+               "service": _service, "name": self.name, "start_us": self.start_us,
+               "dur_ms": round((time.perf_counter() - self.t0) * 1000, 3)}
+        if self.attrs:
+            rec["attrs"] = self.attrs
+        if error:
+            rec["error"] = error
+        self.trace.spans.append(rec)
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    # as a context manager the span is also the parent of spans opened inside it
+    def __enter__(self) -> "Span":
+        self._token = _parent.set(self.id)
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _parent.reset(self._token)
+        self.finish(exc_type.__name__ if exc_type else None)
+
+
+class _NullSpan:
+    __slots__ = ()
+    id = None
+
+    def __enter__(self): return self
+    def __exit__(self, *exc): return None
+    def set(self, **attrs): return None
+
+_NULL = _NullSpan()
+
+
+def span(name: str, **attrs):
+    """with tracing.span("bcrypt", op="hash"): ...  -- a no-op unless the request is recorded."""
+    t = _trace.get()
+    if t is None or not t.recording:
+        return _NULL
+    return Span(t, name, attrs)
+
+@contextmanager
+def fan_in(targets: List[Span]):
+    """Work done once on behalf of several requests (a group commit on a writer task): the
+    block records into a scratch trace, and each target span gets its own copy of those spans
+    as children, so every caller's trace and /debug/slow entry shows the shared SQL."""
+    if not targets:
+        yield
+        return
+    scratch = _Trace("", True)
+    trace_token = _trace.set(scratch)
+    parent_token = _parent.set(None)
+    try:
+        yield
+    finally:
+        _parent.reset(parent_token)
+        _trace.reset(trace_token)
+        for target in targets:
+            ids = {None: target.id}
+            for rec in scratch.spans:
+                ids.setdefault(rec["span"], os.urandom(8).hex())
+            target.trace.spans.extend({**rec, "trace": target.trace.request_id, "span": ids[rec["span"]],
+                                       "parent": ids.get(rec["parent"], target.id)} for rec in scratch.spans)
+
+def request_id() -> Optional[str]:
+    t = _trace.get()
+    return t.request_id if t else None
+
+def inject(headers, current=None) -> None:
+    # outbound call: carry the request id, the sampling decision and the calling span downstream
+    t = _trace.get()
+    if t is None:
+        return
+    headers[REQUEST_ID_HEADER] = t.request_id
+    headers[SAMPLED_HEADER] = "1" if t.sampled else "0"
+    parent = current.id if current is not None and current.id else _parent.get()
+    if t.sampled and parent:
+        headers[PARENT_HEADER] = parent
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware; outermost, so the handler span covers the whole request."""
+
+    def __init__(self, app, service: str):
+        global _service
+        self.app = app
+        _service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rid = sampled = parent = None
+        for k, v in scope["headers"]:
+            if k == b"x-request-id":
+                rid = v.decode("latin-1")[:128]
+            elif k == b"x-trace-sampled":
+                sampled = v == b"1"
+            elif k == b"x-parent-span":
+                parent = v.decode("latin-1")[:32]
+        rid = rid or uuid.uuid4().hex
+        if sampled is None:
+            rate = sample_rate(scope["method"], scope["path"])
+            sampled = rate > 0 and random.random() < rate
+        t = _Trace(rid, sampled)
+        rid_header = (b"x-request-id", rid.encode("latin-1"))
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", ()), rid_header]
+            await send(message)
+
+        trace_token = _trace.set(t)
+        parent_token = _parent.set(parent)
+        sp = None
+        try:
+            if not t.recording:
+                return await self.app(scope, receive, send_with_id)
+            sp = Span(t, "handler", {"method": scope["method"], "path": scope["path"]})
+            with sp:
+                try:
+                    await self.app(scope, receive, send_with_id)
+                finally:
+                    sp.set(route=getattr(scope.get("route"), "path", None), status=status)
+        finally:
+            _parent.reset(parent_token)
+            _trace.reset(trace_token)
+            if sampled:
+                _export(t.spans)
+            if sp is not None and SLOW_REQUEST_MS > 0:
+                _record_slow(t, sp)
+
+
+def instrument_engine(engine, pool: str) -> None:
+    # DB spans are leaves and don't touch the parent contextvar: statements run on other
+    # threads / greenlets, where the reset would happen in a different context
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        t = _trace.get()
+        if t is not None and t.recording and context is not None:
+            context._trace_span = Span(t, "db", {"pool": pool, "sql": statement[:TRACE_SQL_CHARS]}).start()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        sp = getattr(context, "_trace_span", None)
+        if sp is not None:
+            sp.finish()
+            context._trace_span = None
+
+
+slow_requests: deque = deque(maxlen=SLOW_REQUEST_BUFFER)
+slow_total = 0
+
+def _record_slow(t: _Trace, handler: Span) -> None:
+    rec = next((r for r in reversed(t.spans) if r["span"] == handler.id), None)
+    if rec is None or rec["dur_ms"] < SLOW_REQUEST_MS or handler.attrs["path"].startswith("/debug/"):
+        return
+    global slow_total
+    slow_total += 1
+    start = rec["start_us"]
+    sql, upstream = [], []
+    for s in t.spans:
+        call = {"at_ms": round((s["start_us"] - start) / 1000, 3), "dur_ms": s["dur_ms"]}
+        if "error" in s:
+            call["error"] = s["error"]
+        if s["name"] == "db":
+            sql.append({"sql": s["attrs"]["sql"], "pool": s["attrs"]["pool"], **call})
+        elif s["name"] == "upstream":
+            upstream.append({**s["attrs"], **call})
+    sql.sort(key=lambda c: c["at_ms"])
+    upstream.sort(key=lambda c: c["at_ms"])
+    slow_requests.append({
+        "at": datetime.fromtimestamp(start / 1e6, timezone.utc).isoformat(),
+        "request_id": t.request_id, "method": handler.attrs["method"], "path": handler.attrs["path"],
+        "route": handler.attrs.get("route"), "status": handler.attrs.get("status"),
+        "dur_ms": rec["dur_ms"], "error": rec.get("error"),
+        "sql_count": len(sql), "sql_ms": round(sum(c["dur_ms"] for c in sql), 3), "sql": sql[:SLOW_REQUEST_MAX_CALLS],
+        "upstream_count": len(upstream), "upstream": upstream[:SLOW_REQUEST_MAX_CALLS],
+    })
+
+
+class JsonlExporter:
+    def __init__(self, path: str):
+        self.path = path
+        self._buf: List[Dict] = []
+
+    def export(self, spans: List[Dict]) -> None:
+        self._buf.extend(spans)
+
+    def _write(self, lines: str) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+    async def flush(self) -> None:
+        if not self._buf:
+            return
+        spans, self._buf = self._buf, []
+        await asyncio.to_thread(self._write, "".join(json.dumps(s, separators=(",", ":")) + "\n" for s in spans))
+
+
+def _load_exporter(name: str):
+    if name == "none":
+        return None
+    if name == "jsonl":
+        return JsonlExporter(TRACE_FILE)
+    module, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module), attr)
+
+_exporter = _load_exporter(TRACE_EXPORTER)
+_task: Optional[asyncio.Task] = None
+
+def set_exporter(exporter) -> None:
+    global _exporter
+    _exporter = exporter
+
+def _export(spans: List[Dict]) -> None:
+    if _exporter is not None and spans:
+        try:
+            _exporter.export(spans)
+        except Exception as e:
+            log.warning("trace export failed: %s", e)
+
+async def _flush() -> None:
+    flush = getattr(_exporter, "flush", None)
+    if flush is not None:
+        try:
+            await flush()
+        except Exception as e:
+            log.warning("trace flush failed: %s", e)
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(TRACE_FLUSH_S)
+        await _flush()
+
+def start() -> None:
+    global _task
+    _task = asyncio.get_running_loop().create_task(_flush_loop())
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+    await _flush()
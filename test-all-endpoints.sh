@@ -277,6 +277,34 @@ else
       echo "⚠️  Comment may still exist"
     fi
     echo ""
+
+    echo "5.7. Batch Comments Count Against the Rate Limit"
+    # RATE_LIMIT_COMMENTS defaults to 60/min with a burst of 20, and 5.1 took one token: a batch
+    # of 19 fits, a second one right after must not
+    BATCH=$(python3 -c "import json; print(json.dumps({'items': [{'postId': '$POST_ID', 'body': 'batch %d' % i} for i in range(19)]}))")
+    FIRST_BATCH=$(curl -sS -o /dev/null -w "%{http_code}" -X POST "$BASE/comments:batch" \
+      -H "Authorization: Bearer $TOKEN" -H "Content-Type: application/json" -d "$BATCH" 2>/dev/null || echo "")
+    SECOND_BATCH=$(curl -sS -i -X POST "$BASE/comments:batch" \
+      -H "Authorization: Bearer $TOKEN" -H "Content-Type: application/json" -d "$BATCH" 2>/dev/null || echo "")
+    echo "first batch: $FIRST_BATCH, second batch: $(echo "$SECOND_BATCH" | head -1)"
+    if [ "$FIRST_BATCH" = "200" ] && echo "$SECOND_BATCH" | head -1 | grep -q "429" \
+       && echo "$SECOND_BATCH" | grep -qi "^retry-after:"; then
+      success "Batch limited like single comments (429 with Retry-After)"
+    else
+      error "Batch comments bypassed the rate limit"
+    fi
+    echo ""
+
+    echo "5.8. Brotli-Compressed Responses"
+    # the batch above makes this page larger than COMPRESS_MIN_BYTES
+    BR_HEADERS=$(curl -sS -D - -o /dev/null -H "Accept-Encoding: br" \
+      "$BASE/comments?postId=$POST_ID&limit=50" 2>/dev/null || echo "")
+    if echo "$BR_HEADERS" | grep -qi "^content-encoding: br"; then
+      success "Comment list served with Content-Encoding: br"
+    else
+      error "Expected a brotli-compressed comment list: $(echo "$BR_HEADERS" | head -1)"
+    fi
+    echo ""
   fi
 fi
 
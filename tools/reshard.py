@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Change the number of database shards (DB_SHARDS) of post-service or comment-service, offline.
+
+    python tools/reshard.py --data-dir data --kind posts --from 1 --to 4
+
+Reads every file of the current layout (post.db, or post-<i>-of-<N>.db) and writes each row
+to its shard in the new layout (post-<i>-of-<M>.db, or post.db for one shard), using the
+services' own shard function. The new files are written next to the old ones, which are left
+untouched, so an interrupted run is simply repeated after deleting the partial output.
+Secondary indexes and the full-text index are built once at the end, as in tools/seed.py.
+
+The service must be stopped meanwhile (rows written during the copy would be missed). With
+docker compose: stop it, copy /app/data out of its volume (docker compose cp), reshard, copy
+the new files back, and start it with DB_SHARDS=<M>; delete the old files once it looks right.
+Comments are sharded by the post they belong to, so posts and comments can be resharded
+independently.
+
+Requires the service's Python dependencies (e.g. pip install -r post-service/requirements.txt).
+"""
+import argparse, importlib, importlib.machinery, importlib.util, os, sqlite3, sys, time
+from typing import Dict, List
+
+from sqlalchemy import create_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# kind: (service directory, database file of an unsharded service)
+KINDS = {
+    "posts": ("post-service", "post.db"),
+    "comments": ("comment-service", "comment.db"),
+}
+
+# the shard key column of every table a service keeps (see the services' sharding.py)
+SHARD_KEYS = {
+    "posts": {"post": "id", "outboxevent": "aggregate_id"},
+    "comments": {"comment": "postId", "postcommentcount": "postId"},
+}
+# surrogate keys that are renumbered in the new files: several old shards have the same values
+RENUMBERED = {"outboxevent": "seq"}
+
+
+def service_module(directory: str, name: str):
+    # every service's package is called `app`; import each under its own alias (reshard_post, ...)
+    alias = "reshard_" + directory.split("-")[0]
+    if alias not in sys.modules:
+        spec = importlib.machinery.ModuleSpec(alias, None, is_package=True)
+        spec.submodule_search_locations = [os.path.join(ROOT, directory, "app")]
+        sys.modules[alias] = importlib.util.module_from_spec(spec)
+    return importlib.import_module(f"{alias}.{name}")
+
+
+def log(msg: str) -> None:
+    print(msg, file=sys.stderr, flush=True)
+
+
+def layout(data_dir: str, filename: str, shards: int, sharding) -> List[str]:
+    return [sharding.shard_url(os.path.join(data_dir, filename), i, shards) for i in range(shards)]
+
+
+def copy_table(table, key: str, sources: List[sqlite3.Connection], targets: List[sqlite3.Connection],
+               sharding, batch: int) -> int:
+    names = [c.name for c in table.columns if c.name != RENUMBERED.get(table.name)]
+    cols = ", ".join(f'"{n}"' for n in names)
+    insert = f"INSERT INTO {table.name} ({cols}) VALUES ({', '.join('?' * len(names))})"
+    # outbox rows keep their relative order, so a post's events are still relayed in order
+    order = f' ORDER BY "{RENUMBERED[table.name]}"' if table.name in RENUMBERED else ""
+    at = names.index(key)
+    copied = 0
+    for src in sources:
+        cur = src.execute(f"SELECT {cols} FROM {table.name}{order}")
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            parts: Dict[int, list] = {}
+            for row in rows:
+                parts.setdefault(sharding.shard_of(row[at], len(targets)), []).append(row)
+            for i, part in parts.items():
+                targets[i].execute("BEGIN")
+                targets[i].executemany(insert, part)
+                targets[i].execute("COMMIT")
+            copied += len(rows)
+    return copied
+
+
+def count(conns: List[sqlite3.Connection], table: str) -> int:
+    return sum(c.execute(f"SELECT count(*) FROM {table}").fetchone()[0] for c in conns)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="tools/reshard.py", description="Change a service's number of database shards")
+    ap.add_argument("--data-dir", required=True, help="the service's data directory (its volume)")
+    ap.add_argument("--kind", required=True, choices=sorted(SHARD_KEYS), help="posts (post-service) or comments")
+    ap.add_argument("--from", dest="old", type=int, required=True, help="current DB_SHARDS")
+    ap.add_argument("--to", dest="new", type=int, required=True, help="new DB_SHARDS")
+    ap.add_argument("--batch", type=int, default=20000, help="rows per read and per transaction")
+    args = ap.parse_args(argv)
+    if args.old < 1 or args.new < 1 or args.old == args.new:
+        raise SystemExit("--from and --to must be different shard counts >= 1")
+
+    directory, filename = KINDS[args.kind]
+    sharding = service_module(directory, "sharding")
+    models = service_module(directory, "models")
+    search = service_module(directory, "search")
+    tables = [obj.__table__ for obj in vars(models).values()
+              if getattr(obj, "__table__", None) is not None and getattr(obj, "__module__", "") == models.__name__]
+    unknown = [t.name for t in tables if t.name not in SHARD_KEYS[args.kind]]
+    if unknown:
+        raise SystemExit(f"no shard key for table(s) {', '.join(unknown)}: update SHARD_KEYS")
+
+    old_paths = layout(args.data_dir, filename, args.old, sharding)
+    new_paths = layout(args.data_dir, filename, args.new, sharding)
+    missing = [p for p in old_paths if not os.path.exists(p)]
+    if missing:
+        raise SystemExit(f"missing: {', '.join(missing)} (is --from right?)")
+    existing = [p for p in new_paths if os.path.exists(p)]
+    if existing:
+        raise SystemExit(f"already exists: {', '.join(existing)} (remove it first)")
+
+    for path in old_paths:
+        with sqlite3.connect(f"file:{path}?mode=ro", uri=True) as conn:
+            for table in tables:
+                declared = {r[1]: r[2].upper() for r in conn.execute(f'PRAGMA table_info("{table.name}")')}
+                if any("INT" not in declared.get(c.name, "INT") for c in table.columns
+                       if type(c.type).__name__ == "Timestamp"):
+                    raise SystemExit(f"{path}: {table.name} still has ISO-string timestamps; "
+                                     "start the service on it once (it converts them) before resharding")
+
+    engines = [create_engine(f"sqlite:///{p}") for p in new_paths]
+    for engine in engines:
+        for table in tables:
+            table.create(engine, checkfirst=True)
+    sources = [sqlite3.connect(f"file:{p}?mode=ro", uri=True) for p in old_paths]
+    targets = [sqlite3.connect(p, isolation_level=None) for p in new_paths]
+    for conn in targets:
+        # fsync skipped for the copy: a crash means deleting the new files and running it again
+        for pragma in ("journal_mode=WAL", "synchronous=OFF", "cache_size=-262144", "temp_store=MEMORY"):
+            conn.execute(f"PRAGMA {pragma}")
+        for table in tables:
+            for index in table.indexes:
+                conn.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+
+    for table in tables:
+        t = time.perf_counter()
+        copied = copy_table(table, SHARD_KEYS[args.kind][table.name], sources, targets, sharding, args.batch)
+        written = count(targets, table.name)
+        if written != count(sources, table.name):
+            raise SystemExit(f"{table.name}: {written} rows written but {copied} read; the sources changed meanwhile?")
+        spread = ", ".join(str(c.execute(f"SELECT count(*) FROM {table.name}").fetchone()[0]) for c in targets)
+        log(f"{table.name}: {copied} rows in {time.perf_counter() - t:.1f}s (per shard: {spread})")
+    for conn in sources + targets:
+        conn.close()
+
+    t = time.perf_counter()
+    for engine in engines:
+        for table in tables:
+            for index in table.indexes:
+                index.create(engine, checkfirst=True)
+        search.ensure_schema(engine)  # new index: backfilled from the table, triggers added
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+        engine.dispose()
+    log(f"indexes done in {time.perf_counter() - t:.1f}s")
+    log(f"wrote {', '.join(new_paths)}; start the service with DB_SHARDS={args.new}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""Bulk-load the service databases (auth.db, user.db, post.db, comment.db) for capacity tests
+and migrations, writing straight into the services' SQLModel tables.
+
+    python tools/seed.py --data-dir seed-data synthetic --users 100000 --posts 2000000 --comments 20000000
+    python tools/seed.py --data-dir seed-data ndjson --posts posts.ndjson --comments comments.ndjson
+
+Rows are generated (or parsed from NDJSON, e.g. the output of GET /posts/export) by a pool
+of worker processes, and written by this process with executemany, one transaction per
+--batch rows. Secondary indexes and the full-text index are dropped before the load and
+built once at the end, then comment counters are recomputed. Loading into existing
+databases works too (rows with an existing id are skipped), but the services should be
+stopped meanwhile. With --shards N (default: $DB_SHARDS, else 1) posts and comments are
+written to the services' shard files (post-<i>-of-<N>.db, ...), each row to the shard the
+services look it up in; start them with the same DB_SHARDS. To use the result, stop the
+stack and copy the files into the volumes:
+
+    docker compose stop && docker compose cp seed-data/post.db post-service:/app/data/post.db  (...)
+
+Requires the services' Python dependencies (e.g. pip install -r post-service/requirements.txt).
+"""
+import argparse, hashlib, importlib, importlib.machinery, importlib.util, itertools, json, os, random, re
+import sqlite3, sys, time, uuid
+from collections import deque
+from datetime import datetime, timezone
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import bcrypt
+from sqlalchemy import create_engine
+from sqlmodel import Session
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# kind: (service directory, database file, model class)
+KINDS = {
+    "users": ("auth-service", "auth.db", "User"),
+    "profiles": ("user-service", "user.db", "Profile"),
+    "posts": ("post-service", "post.db", "Post"),
+    "comments": ("comment-service", "comment.db", "Comment"),
+}
+WRITE_ORDER = ("users", "profiles", "posts", "comments")
+# shard key column of the sharded kinds (see the services' sharding.py)
+SHARD_KEYS = {"posts": "id", "comments": "postId"}
+# column order of the tuples synthetic_rows() produces; checked against the models
+SYNTHETIC_COLUMNS = {
+    "users": ("id", "email", "password_hash", "created_at"),
+    "profiles": ("id", "userId", "display_name", "bio", "created_at", "updated_at"),
+    "posts": ("id", "authorId", "title", "body", "created_at", "updated_at"),
+    "comments": ("id", "postId", "authorId", "body", "created_at", "updated_at"),
+}
+
+
+# ---- service modules ------------------------------------------------------------------------
+
+def service_module(directory: str, name: str):
+    # every service's package is called `app`; import each under its own alias (seed_post, ...)
+    alias = "seed_" + directory.split("-")[0]
+    if alias not in sys.modules:
+        spec = importlib.machinery.ModuleSpec(alias, None, is_package=True)
+        spec.submodule_search_locations = [os.path.join(ROOT, directory, "app")]
+        sys.modules[alias] = importlib.util.module_from_spec(spec)
+    return importlib.import_module(f"{alias}.{name}")
+
+
+def columns_of(table) -> List[Tuple[str, bool, bool]]:
+    # (name, nullable, stored as epoch microseconds: the services' timestamps.Timestamp type)
+    return [(c.name, c.nullable, type(c.type).__name__ == "Timestamp") for c in table.columns]
+
+
+# ---- row production (runs in the worker processes) --------------------------------------------
+
+def stable_id(kind: str, seed: int, i: int) -> str:
+    # synthetic ids are a pure function of (kind, seed, index), so workers can reference rows
+    # (a comment's post, a post's author) that another worker generates
+    h = hashlib.blake2b(f"{kind}:{seed}:{i}".encode(), digest_size=16).hexdigest()
+    # formatted like uuid.uuid4() (version 4, RFC 4122 variant) without building UUID objects
+    return f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{'89ab'[int(h[16], 16) & 3]}{h[17:20]}-{h[20:]}"
+
+
+_VOCAB: List[str] = []
+_CUM: List[float] = []
+
+
+def _words(rng: random.Random, n: int) -> str:
+    # Zipf-distributed words from a fixed synthetic vocabulary, so full-text search sees a
+    # realistic mix of very common and rare terms
+    if not _VOCAB:
+        syl = ["ka", "lo", "mi", "ne", "ru", "ta", "so", "vi", "de", "po", "zu", "ba", "fe", "gi", "ho", "ja"]
+        _VOCAB.extend("".join(p) for p in itertools.product(syl, repeat=3))
+        _CUM.extend(itertools.accumulate(1 / (r + 1) for r in range(len(_VOCAB))))
+    return " ".join(rng.choices(_VOCAB, cum_weights=_CUM, k=n))
+
+
+def _scatter(rank: int, n: int) -> int:
+    # spreads ranks 0, 1, 2, ... over [0, n) (a permutation: the multiplier is prime)
+    return rank * 2654435761 % n
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def _us(ts: float) -> int:
+    return round(ts * 1_000_000)
+
+
+def _us_of(value):
+    # NDJSON timestamps are ISO-8601 (as the exports write them); naive ones are UTC
+    if value is None or isinstance(value, int):
+        return value
+    dt = datetime.fromisoformat(value)
+    return _us((dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp())
+
+
+def synthetic_rows(task: Tuple) -> List[tuple]:
+    kind, start, count, cfg = task
+    rng = random.Random(f"{cfg['seed']}:{kind}:{start}")
+    seed, users, posts = cfg["seed"], cfg["users"], cfg["posts"]
+    t0, span = cfg["t0"], cfg["now"] - cfg["t0"]
+
+    def author() -> str:
+        # Zipf-like (log-uniform rank): a few prolific users write much of the content
+        return stable_id("user", seed, _scatter(int(users ** rng.random()) - 1, users))
+
+    def post_ts(i: int) -> float:
+        return t0 + span * i / posts
+
+    rows = []
+    for i in range(start, start + count):
+        if kind == "users":
+            rows.append((stable_id("user", seed, i), f"user{i}@seed.example", cfg["password_hash"], _iso(t0)))
+        elif kind == "profiles":
+            rows.append((stable_id("profile", seed, i), stable_id("user", seed, i), f"User {i}",
+                         _words(rng, 8), _us(t0), None))
+        elif kind == "posts":
+            title = _words(rng, rng.randint(3, 8)).capitalize()
+            body = _words(rng, max(1, int(rng.expovariate(1 / cfg["post_words"]))))
+            rows.append((stable_id("post", seed, i), author(), title, body, _us(post_ts(i)), None))
+        else:
+            if rng.random() < cfg["hot_share"]:
+                # hot posts are spread over the whole history, not just the oldest ones
+                p = _scatter(rng.randrange(cfg["hot_posts"]), posts)
+            else:
+                p = rng.randrange(posts)
+            ts = post_ts(p) + rng.random() * (cfg["now"] - post_ts(p))
+            body = _words(rng, max(1, int(rng.expovariate(1 / cfg["comment_words"]))))
+            rows.append((stable_id("comment", seed, i), stable_id("post", seed, p), author(), body, _us(ts), None))
+    return rows
+
+
+def ndjson_rows(task: Tuple) -> List[tuple]:
+    kind, first_line, lines, columns, defaults = task
+    now = time.time()
+    rows = []
+    for n, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        row = []
+        for name, nullable, epoch_us in columns:
+            if name in item:
+                row.append(_us_of(item[name]) if epoch_us else item[name])
+            elif name == "id":
+                row.append(str(uuid.uuid4()))
+            elif name in defaults:
+                row.append(defaults[name])
+            elif name == "created_at":
+                row.append(_us(now) if epoch_us else _iso(now))
+            elif nullable:
+                row.append(None)
+            else:
+                raise ValueError(f"{kind} line {n}: missing required field {name!r}")
+        rows.append(tuple(row))
+    return rows
+
+
+# ---- writing ----------------------------------------------------------------------------------
+
+class Target:
+    """One service database (or its shards): tables created up front, indexes dropped for the
+    load, rebuilt after."""
+
+    def __init__(self, data_dir: str, kind: str, shards: int = 1):
+        directory, filename, model = KINDS[kind]
+        self.kind = kind
+        self.directory = directory
+        self.models = service_module(directory, "models")
+        self.table = getattr(self.models, model).__table__
+        self.columns = columns_of(self.table)
+        if kind not in SHARD_KEYS:
+            shards = 1
+        self.sharding = service_module(directory, "sharding") if shards > 1 else None
+        self.key = [c[0] for c in self.columns].index(SHARD_KEYS[kind]) if shards > 1 else None
+        path = os.path.join(data_dir, filename)
+        self.paths = [self.sharding.shard_url(path, i, shards) for i in range(shards)] if shards > 1 else [path]
+        self.path = path if shards == 1 else f"{self.paths[0]} .. {self.paths[-1]}"
+        self.engines = [create_engine(f"sqlite:///{p}") for p in self.paths]
+        self.written = 0
+
+    def prepare(self) -> None:
+        self.conns = [self._prepare(engine, path) for engine, path in zip(self.engines, self.paths)]
+        names = ", ".join(f'"{c[0]}"' for c in self.columns)
+        self.insert = f"INSERT OR IGNORE INTO {self.table.name} ({names}) VALUES ({', '.join('?' * len(self.columns))})"
+
+    def _prepare(self, engine, path: str) -> sqlite3.Connection:
+        for obj in vars(self.models).values():
+            if getattr(obj, "__table__", None) is not None and getattr(obj, "__module__", "") == self.models.__name__:
+                obj.__table__.create(engine, checkfirst=True)
+        if any(epoch_us for _, _, epoch_us in self.columns):
+            # databases from before the integer timestamps are converted first, as the service would
+            service_module(self.directory, "timestamps").migrate(engine, [self.table])
+        conn = sqlite3.connect(path, isolation_level=None)
+        # WAL like the services; fsync skipped for the load (a crash means re-running the seed)
+        for pragma in ("journal_mode=WAL", "synchronous=OFF", "cache_size=-1048576", "temp_store=MEMORY"):
+            conn.execute(f"PRAGMA {pragma}")
+        for index in self.table.indexes:
+            conn.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+        for sql in self._fts_schema():
+            for trigger in re.findall(r"CREATE TRIGGER IF NOT EXISTS (\w+)", sql):
+                conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            for fts in re.findall(r"CREATE VIRTUAL TABLE IF NOT EXISTS (\w+)", sql):
+                conn.execute(f"DROP TABLE IF EXISTS {fts}")
+        return conn
+
+    def _fts_schema(self) -> List[str]:
+        if self.kind not in ("posts", "comments"):
+            return []
+        return service_module(self.directory, "search").SCHEMA
+
+    def write(self, rows: Sequence[tuple]) -> None:
+        if self.sharding is None:
+            parts = {0: rows}
+        else:
+            parts = {}
+            for row in rows:
+                parts.setdefault(self.sharding.shard_of(row[self.key], len(self.conns)), []).append(row)
+        for i, part in parts.items():
+            conn = self.conns[i]
+            before = conn.total_changes
+            conn.execute("BEGIN")
+            conn.executemany(self.insert, part)
+            conn.execute("COMMIT")
+            self.written += conn.total_changes - before
+
+    def finish(self) -> None:
+        for conn in self.conns:
+            conn.close()
+        steps = [("indexes", self._indexes)]
+        if self.kind in ("posts", "comments"):
+            steps.append(("full-text index", self._search))
+        if self.kind == "comments":
+            steps.append(("comment counts", self._counts))
+        steps.append(("analyze", self._analyze))
+        for name, step in steps:
+            t = time.perf_counter()
+            for engine in self.engines:
+                step(engine)
+            log(f"{self.kind}: {name} done in {time.perf_counter() - t:.1f}s")
+
+    def _indexes(self, engine) -> None:
+        for index in self.table.indexes:
+            index.create(engine, checkfirst=True)
+
+    def _search(self, engine) -> None:
+        search = service_module(self.directory, "search")
+        search.ensure_schema(engine)  # recreates the index from the table, and the triggers
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"INSERT INTO {self.table.name}_fts({self.table.name}_fts) VALUES ('optimize')")
+
+    def _counts(self, engine) -> None:
+        # comments are sharded by postId, so each shard's counters come from its own comments
+        with Session(engine) as session:
+            service_module(self.directory, "counts").rebuild(session)
+
+    def _analyze(self, engine) -> None:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+
+
+def run_pool(pool: Pool, fn, tasks: Iterator[Tuple], target: Target, window: int) -> None:
+    # at most `window` chunks generated ahead of the writer, so memory stays bounded even when
+    # the workers are faster than SQLite
+    pending: deque = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(fn, (task,)))
+        if len(pending) >= window:
+            target.write(pending.popleft().get())
+    while pending:
+        target.write(pending.popleft().get())
+
+
+def log(msg: str) -> None:
+    print(msg, file=sys.stderr, flush=True)
+
+
+def hash_once(password: str, rounds: int) -> str:
+    # one bcrypt hash shared by every seeded user: hashing millions of passwords would take days
+    return bcrypt.hashpw(password.encode()[:72], bcrypt.gensalt(rounds)).decode()
+
+
+# ---- sources ----------------------------------------------------------------------------------
+
+def synthetic_tasks(args) -> Dict[str, Tuple]:
+    now = time.time()
+    cfg = {
+        "seed": args.seed, "users": max(1, args.users), "posts": max(1, args.posts),
+        "hot_posts": max(1, int(args.posts * args.hot_posts)), "hot_share": args.hot_share,
+        "post_words": args.post_words, "comment_words": args.comment_words,
+        "t0": now - args.days * 86400, "now": now,
+        "password_hash": hash_once(args.password, args.bcrypt_rounds) if args.users else None,
+    }
+    counts = {"users": args.users, "profiles": args.users, "posts": args.posts, "comments": args.comments}
+
+    def tasks(kind):
+        return ((kind, s, min(args.batch, counts[kind] - s), cfg) for s in range(0, counts[kind], args.batch))
+    return {kind: (synthetic_rows, tasks(kind), counts[kind]) for kind in WRITE_ORDER if counts[kind]}
+
+
+def ndjson_tasks(args, targets: Dict[str, Target]) -> Dict[str, Tuple]:
+    defaults = {"password_hash": hash_once(args.password, args.bcrypt_rounds)} if args.users else {}
+
+    def tasks(kind, path):
+        with open(path) as f:
+            first = 1
+            while True:
+                lines = list(itertools.islice(f, args.batch))
+                if not lines:
+                    return
+                yield kind, first, lines, targets[kind].columns, defaults
+                first += len(lines)
+    return {kind: (ndjson_rows, tasks(kind, getattr(args, kind)), None)
+            for kind in WRITE_ORDER if getattr(args, kind)}
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(prog="tools/seed.py", description="Bulk-load MicroBlogg service databases")
+    ap.add_argument("--data-dir", required=True, help="directory for auth.db, user.db, post.db, comment.db")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="row generating/parsing processes")
+    ap.add_argument("--batch", type=int, default=20000, help="rows per chunk and per transaction")
+    ap.add_argument("--password", default="password123", help="password of every seeded user, hashed once")
+    ap.add_argument("--bcrypt-rounds", type=int, default=12, help="match the services' BCRYPT_ROUNDS")
+    ap.add_argument("--shards", type=int, default=int(os.getenv("DB_SHARDS", "1")),
+                    help="DB_SHARDS of post-service and comment-service (default: $DB_SHARDS, else 1)")
+    sub = ap.add_subparsers(dest="source", required=True)
+
+    syn = sub.add_parser("synthetic", help="generate rows")
+    syn.add_argument("--users", type=int, default=1000, help="auth users, each with a profile")
+    syn.add_argument("--posts", type=int, default=10000)
+    syn.add_argument("--comments", type=int, default=100000)
+    syn.add_argument("--hot-posts", type=float, default=0.001, help="fraction of posts that are hot")
+    syn.add_argument("--hot-share", type=float, default=0.5, help="fraction of comments that go to hot posts")
+    syn.add_argument("--post-words", type=int, default=120, help="mean post body length (exponential)")
+    syn.add_argument("--comment-words", type=int, default=25, help="mean comment length (exponential)")
+    syn.add_argument("--days", type=float, default=365, help="history covered by created_at")
+    syn.add_argument("--seed", type=int, default=1, help="same seed, same data")
+
+    nd = sub.add_parser("ndjson", help="load NDJSON files (one model object per line; unknown fields ignored)")
+    for kind in WRITE_ORDER:
+        nd.add_argument(f"--{kind}", metavar="FILE",
+                        help=f"{KINDS[kind][2]} rows" + (" (missing password_hash: --password)" if kind == "users" else ""))
+    return ap.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    os.makedirs(args.data_dir, exist_ok=True)
+    if args.source == "synthetic":
+        kinds = [k for k in WRITE_ORDER if (args.users if k in ("users", "profiles") else getattr(args, k))]
+    else:
+        kinds = [k for k in WRITE_ORDER if getattr(args, k)]
+    if not kinds:
+        raise SystemExit("nothing to load")
+    if args.shards < 1:
+        raise SystemExit("--shards must be >= 1")
+    targets = {kind: Target(args.data_dir, kind, args.shards) for kind in kinds}
+    if args.source == "synthetic":
+        for kind, target in targets.items():
+            if tuple(c[0] for c in target.columns) != SYNTHETIC_COLUMNS[kind]:
+                raise SystemExit(f"{kind}: model columns changed, update SYNTHETIC_COLUMNS/synthetic_rows")
+    sources = synthetic_tasks(args) if args.source == "synthetic" else ndjson_tasks(args, targets)
+
+    with Pool(args.workers) as pool:
+        for kind in kinds:
+            fn, tasks, total = sources[kind]
+            target = targets[kind]
+            target.prepare()
+            t = time.perf_counter()
+            try:
+                run_pool(pool, fn, tasks, target, window=args.workers * 2)
+            except ValueError as e:  # bad NDJSON; what was committed so far stays, indexed
+                raise SystemExit(f"error: {e}")
+            finally:
+                secs = time.perf_counter() - t
+                log(f"{kind}: {target.written} rows into {target.path} in {secs:.1f}s "
+                    f"({target.written / max(secs, 1e-9):,.0f} rows/s)")
+                target.finish()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
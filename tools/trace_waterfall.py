@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Rebuild per-request waterfalls from the services' span files (TRACE_FILE, JSONL).
+
+    docker compose cp comment-service:/app/data/traces.jsonl traces/comment.jsonl
+    ...
+    python tools/trace_waterfall.py traces/*.jsonl                  # slowest 5 requests
+    python tools/trace_waterfall.py traces/*.jsonl --trace <request-id>
+    python tools/trace_waterfall.py traces/*.jsonl --summary        # critical path by span, all requests
+
+The critical path starts at the root span and walks back from its end through the children
+it was waiting on (the last to finish, then the last to finish before that one started, ...),
+recursively. Time a span spends outside those children is its self time on the path.
+"""
+import argparse, json, sys
+from collections import defaultdict
+from typing import Dict, List
+
+BAR_WIDTH = 50
+# spans from different processes use wall clocks; tolerate small skew between them
+CLOCK_SLACK_US = 500
+
+
+def load(paths: List[str]) -> Dict[str, List[dict]]:
+    traces: Dict[str, List[dict]] = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    s = json.loads(line)
+                    traces[s["trace"]].append(s)
+    return traces
+
+
+def _end(s: dict) -> float:
+    return s["start_us"] + s["dur_ms"] * 1000
+
+
+def build(spans: List[dict]):
+    by_id = {s["span"]: s for s in spans}
+    children: Dict[str, List[dict]] = defaultdict(list)
+    roots = []
+    for s in spans:
+        if s.get("parent") in by_id:
+            children[s["parent"]].append(s)
+        else:
+            roots.append(s)
+    for kids in children.values():
+        kids.sort(key=lambda s: s["start_us"])
+    roots.sort(key=lambda s: s["start_us"])
+    return roots, children
+
+
+def label(s: dict) -> str:
+    a = s.get("attrs", {})
+    if s["name"] == "handler":
+        detail = f'{a.get("method", "")} {a.get("route") or a.get("path", "")} -> {a.get("status", "?")}'
+    elif s["name"] == "upstream":
+        detail = f'{a.get("method", "")} {a.get("upstream", "")}{a.get("path", "")}'
+    elif s["name"] == "db":
+        detail = f'[{a.get("pool", "")}] {" ".join(a.get("sql", "").split())[:60]}'
+    else:
+        detail = " ".join(f"{k}={v}" for k, v in a.items())
+    err = f' !{s["error"]}' if s.get("error") else ""
+    return f'{s["service"]}:{s["name"]} {detail}{err}'
+
+
+def critical_path(root: dict, children) -> List[tuple]:
+    """[(span, self_ms)] in the order they appear on the path."""
+    path: List[tuple] = []
+
+    def walk(node):
+        # walk back from the end of the span: the child that finished last, then the child
+        # that finished before that one started, ... - those are the ones the span waited on
+        chain, cursor = [], _end(node) + CLOCK_SLACK_US
+        for kid in sorted(children.get(node["span"], []), key=_end, reverse=True):
+            if _end(kid) <= cursor:
+                chain.append(kid)
+                cursor = kid["start_us"] + CLOCK_SLACK_US
+        path.append((node, max(0.0, node["dur_ms"] - sum(k["dur_ms"] for k in chain))))
+        for kid in reversed(chain):
+            walk(kid)
+
+    walk(root)
+    return path
+
+
+def print_waterfall(trace_id: str, spans: List[dict]) -> None:
+    roots, children = build(spans)
+    t0 = min(s["start_us"] for s in spans)
+    total_ms = max((_end(s) - t0) / 1000 for s in spans) or 1
+    print(f"trace {trace_id}  {total_ms:.1f} ms  {len(spans)} spans")
+
+    def walk(s, depth):
+        off = (s["start_us"] - t0) / 1000
+        lo = int(off / total_ms * BAR_WIDTH)
+        width = max(1, int(s["dur_ms"] / total_ms * BAR_WIDTH))
+        bar = " " * lo + "#" * min(width, BAR_WIDTH - lo)
+        print(f'  {off:8.1f} {s["dur_ms"]:8.1f} |{bar:<{BAR_WIDTH}}| {"  " * depth}{label(s)}')
+        for c in children.get(s["span"], []):
+            walk(c, depth + 1)
+
+    print(f'  {"start":>8} {"ms":>8}')
+    for r in roots:
+        walk(r, 0)
+    if roots:
+        print("  critical path:")
+        for s, self_ms in critical_path(roots[0], children):
+            print(f'    {self_ms:8.1f} ms self  {label(s)}')
+    print()
+
+
+def summary(traces: Dict[str, List[dict]]) -> None:
+    # where requests spend their critical-path time, per service:span name
+    totals: Dict[str, float] = defaultdict(float)
+    grand = 0.0
+    for spans in traces.values():
+        roots, children = build(spans)
+        if not roots:
+            continue
+        for s, self_ms in critical_path(roots[0], children):
+            totals[f'{s["service"]}:{s["name"]}'] += self_ms
+            grand += self_ms
+    print(f"{len(traces)} traces, {grand:.1f} ms on critical paths")
+    for name, ms in sorted(totals.items(), key=lambda kv: -kv[1]):
+        print(f"  {ms:10.1f} ms  {ms / grand * 100 if grand else 0:5.1f}%  {name}")
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("files", nargs="+", help="span files (JSONL) from one or more services")
+    ap.add_argument("--trace", help="show only this request id")
+    ap.add_argument("--slowest", type=int, default=5, help="show the N slowest requests (default 5)")
+    ap.add_argument("--summary", action="store_true", help="aggregate critical-path time over all requests")
+    args = ap.parse_args(argv)
+
+    traces = load(args.files)
+    if not traces:
+        print("no spans found", file=sys.stderr)
+        return 1
+    if args.summary:
+        summary(traces)
+        return 0
+    if args.trace:
+        if args.trace not in traces:
+            print(f"trace {args.trace} not found", file=sys.stderr)
+            return 1
+        print_waterfall(args.trace, traces[args.trace])
+        return 0
+
+    def wall_ms(spans):
+        return (max(_end(s) for s in spans) - min(s["start_us"] for s in spans)) / 1000
+
+    for tid in sorted(traces, key=lambda t: -wall_ms(traces[t]))[:args.slowest]:
+        print_waterfall(tid, traces[tid])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,85 @@
 import os
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import metrics, tracing, timestamps
 
 DB_DIR = "/app/data"
 DB_PATH = f"{DB_DIR}/user.db"
 os.makedirs(DB_DIR, exist_ok=True)
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False)
+
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "10"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+def _async_url(url: str) -> str:
+    # sqlite:///x.db -> sqlite+aiosqlite:///x.db; URLs that already name a driver are kept
+    scheme, rest = url.split("://", 1)
+    if scheme == "sqlite":
+        scheme = "sqlite+aiosqlite"
+    return f"{scheme}://{rest}"
+
+def _sqlite_pragmas(query_only: bool = False):
+    def on_connect(dbapi_conn, _record):
+        # WAL lets readers run alongside the single writer; busy_timeout makes writers from
+        # other replicas sharing the volume wait for the lock instead of "database is locked"
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        if query_only:
+            cur.execute("PRAGMA query_only=ON")
+        cur.close()
+    return on_connect
+
+def _pool_args(size: int):
+    if IS_SQLITE and (":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") == "sqlite:"):
+        return {}  # in-memory databases use a single shared connection, not a queue pool
+    return {"pool_size": size, "max_overflow": size * 2, "pool_pre_ping": not IS_SQLITE}
+
+engine = create_engine(DATABASE_URL, echo=False, **_pool_args(DB_POOL_SIZE))
+# separate pool for read-only queries so long list scans never hold a writer's connection
+read_engine = create_engine(DATABASE_URL, echo=False, **_pool_args(DB_READ_POOL_SIZE))
+async_engine = create_async_engine(_async_url(DATABASE_URL), echo=False, **_pool_args(DB_POOL_SIZE))
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _sqlite_pragmas())
+    event.listen(read_engine, "connect", _sqlite_pragmas(query_only=True))
+    event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas())
+
+metrics.instrument_engine(engine, "write")
+metrics.instrument_engine(read_engine, "read")
+metrics.instrument_engine(async_engine.sync_engine, "async")
+tracing.instrument_engine(engine, "write")
+tracing.instrument_engine(read_engine, "read")
+tracing.instrument_engine(async_engine.sync_engine, "async")
 
 def init_db() -> None:
     SQLModel.metadata.create_all(engine)
+    if IS_SQLITE:
+        timestamps.migrate(engine, SQLModel.metadata.sorted_tables)
+    # create_all skips tables that already exist, so indexes added later need an explicit pass
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+def get_read_session():
+    with Session(read_engine) as session:
+        yield session
+
+async def get_async_session():
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
@@ -0,0 +1,44 @@
+import hashlib
+from typing import Iterable, List, Optional
+
+from fastapi import HTTPException, Response
+
+# Strong ETags derived from (id, updated_at or created_at). Every update sets updated_at, so
+# the pair changes exactly when the row does, and it can be read without the body column.
+
+def _tag(parts: Iterable[str]) -> str:
+    h = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        h.update(part.encode())
+        h.update(b"\0")
+    return '"' + h.hexdigest() + '"'
+
+def of(row_id: str, created_at: str, updated_at: Optional[str]) -> str:
+    return _tag((row_id, updated_at or created_at))
+
+def of_rows(rows, *extra: Optional[str]) -> str:
+    # collection ETag: changes when a row on the page is added, removed or updated, or when
+    # `extra` (e.g. the page's cursors) changes
+    return _tag([f"{r.id}:{r.updated_at or r.created_at}" for r in rows] + [e or "" for e in extra])
+
+def _parse(header: str) -> List[str]:
+    return [t.strip() for t in header.split(",") if t.strip()]
+
+def none_match(if_none_match: Optional[str], tag: str) -> bool:
+    """True when If-None-Match matches tag, i.e. the client's copy is current (weak comparison)."""
+    if not if_none_match:
+        return False
+    tags = _parse(if_none_match)
+    return "*" in tags or any(t.removeprefix("W/") == tag for t in tags)
+
+def check_match(if_match: Optional[str], tag: Optional[str]) -> None:
+    """412 unless If-Match is absent or matches tag (strong comparison). tag None = no entity."""
+    if not if_match:
+        return
+    tags = _parse(if_match)
+    if tag is None or not ("*" in tags or tag in tags):
+        raise HTTPException(status_code=412, detail="Precondition failed: the resource has changed")
+
+def not_modified(response: Response) -> Response:
+    # 304 carries the headers the 200 would have (ETag, cursors) but no body
+    return Response(status_code=304, headers=dict(response.headers))
@@ -0,0 +1,88 @@
+import os, time, asyncio, logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from sqlalchemy import text
+
+from .db import async_engine
+from .schemas import HealthResponse, DependencyHealth
+
+# Dependencies are probed in the background and /health serves the latest snapshot, so a
+# health request never fans out to other services (and never waits on a slow one).
+HEALTH_PROBE_INTERVAL_S = float(os.getenv("HEALTH_PROBE_INTERVAL_S", "5"))
+HEALTH_PROBE_TIMEOUT_S = float(os.getenv("HEALTH_PROBE_TIMEOUT_S", "2"))
+
+log = logging.getLogger(__name__)
+
+Check = Callable[[], Awaitable[None]]  # raises on failure
+
+_service = ""
+_checks: Dict[str, Check] = {}
+_snapshot: Optional[HealthResponse] = None
+_task: Optional[asyncio.Task] = None
+
+async def check_database() -> None:
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+def http_check(get_client: Callable, url: str) -> Check:
+    # point this at the dependency's /health/ready so the probe stays one hop deep
+    async def check() -> None:
+        r = await get_client().get(url, timeout=HEALTH_PROBE_TIMEOUT_S)
+        if r.status_code != 200:
+            raise RuntimeError(f"HTTP {r.status_code}")
+    return check
+
+async def _probe(check: Check) -> DependencyHealth:
+    t0 = time.perf_counter()
+    try:
+        await asyncio.wait_for(check(), HEALTH_PROBE_TIMEOUT_S)
+        error = None
+    except asyncio.TimeoutError:
+        error = f"timed out after {HEALTH_PROBE_TIMEOUT_S}s"
+    except Exception as e:
+        error = str(e) or type(e).__name__
+    ms = round((time.perf_counter() - t0) * 1000, 2)
+    return DependencyHealth(status="unhealthy" if error else "healthy", response_time_ms=ms, error=error)
+
+async def probe_once() -> HealthResponse:
+    global _snapshot
+    names = list(_checks)
+    results = await asyncio.gather(*(_probe(_checks[n]) for n in names))
+    deps = dict(zip(names, results))
+    overall = "healthy" if all(d.status == "healthy" for d in deps.values()) else "unhealthy"
+    _snapshot = HealthResponse(service=_service, status=overall, dependencies=deps)
+    return _snapshot
+
+async def _loop() -> None:
+    while True:
+        try:
+            await probe_once()
+        except Exception as e:  # keep probing; the previous snapshot stays in place
+            log.warning("health probe failed: %s", e)
+        await asyncio.sleep(HEALTH_PROBE_INTERVAL_S)
+
+def start(service: str, checks: Dict[str, Check]) -> None:
+    global _service, _checks, _task
+    _service, _checks = service, dict(checks)
+    _task = asyncio.get_running_loop().create_task(_loop())
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+def snapshot() -> HealthResponse:
+    if _snapshot is None:
+        return HealthResponse(service=_service, status="unhealthy", dependencies={
+            n: DependencyHealth(status="unhealthy", error="not probed yet") for n in _checks})
+    return _snapshot
+
+def ready() -> bool:
+    # ready = our own database answered the last probe; other services don't count
+    db = snapshot().dependencies.get("database")
+    return db is not None and db.status == "healthy"
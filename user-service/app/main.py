@@ -1,73 +1,141 @@
 import os, uuid, httpx
-from typing import Dict, Optional
-from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from typing import Dict, Optional, List
 
-from fastapi import FastAPI, Depends, Header, HTTPException
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import update
 from sqlmodel import Session, select
 
-from .db import init_db, get_session
+from . import token_verifier, http_client, health, metrics, tracing, debug, etag, admission, responses, timestamps
+from .db import init_db, get_session, get_read_session
 from .models import Profile
-from .schemas import HealthResponse, DependencyHealth, Status, ProfileCreate, ProfileUpdate
+from .schemas import HealthResponse, ProfileCreate, ProfileUpdate, ProfileOut
 
 APP_NAME = "user-service"
 AUTH_SERVICE_BASE = os.getenv("AUTH_SERVICE_BASE", "http://auth-service:8000")
+BATCH_MAX_IDS = 100
 
-app = FastAPI(title=APP_NAME)
-
-@app.on_event("startup")
-def startup():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     init_db()
+    http_client.start()
+    token_verifier.start()
+    health.start(APP_NAME, {
+        "auth-service": health.http_check(http_client.get_client, f"{AUTH_SERVICE_BASE}/health/ready"),
+        "database": health.check_database,
+    })
+    tracing.start()
+    yield
+    await tracing.stop()
+    await health.stop()
+    await token_verifier.stop()
+    await http_client.close()
+
+app = FastAPI(title=APP_NAME, lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(admission.AdmissionMiddleware, router=app.router)
+app.add_middleware(responses.CompressionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware, router=app.router)
+app.add_middleware(tracing.TracingMiddleware, service=APP_NAME)  # added last = outermost
+if debug.DEBUG_ENDPOINTS:
+    app.include_router(debug.router)  # /debug/profile, /debug/slow
+
+def parse_ids(ids: str) -> List[str]:
+    # ?ids=a,b,c -> unique ids in request order
+    parsed = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    if not parsed:
+        raise HTTPException(status_code=400, detail="ids required")
+    if len(parsed) > BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IDS} ids per batch")
+    return parsed
 
 async def verify_token(authorization: Optional[str] = Header(None)) -> Dict:
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
     token = authorization.split(" ", 1)[1]
-    async with httpx.AsyncClient(timeout=10) as client:
-        r = await client.post(f"{AUTH_SERVICE_BASE}/auth/verify", json={"token": token})
-        if r.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return r.json()
+    if token_verifier.AUTH_VERIFY_MODE != "remote":
+        return token_verifier.verify_local(token)
+    try:
+        r = await http_client.get_client().post(f"{AUTH_SERVICE_BASE}/auth/verify", json={"token": token})
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Auth service unavailable: {str(e)}")
+    if r.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return r.json()
 
+# Served from the background prober's snapshot: O(1), never calls other services inline
 @app.get("/health", response_model=HealthResponse)
-async def health():
-    deps: Dict[str, DependencyHealth] = {}
-    # auth-service
-    try:
-        async with httpx.AsyncClient(timeout=5) as c:
-            r = await c.get(f"{AUTH_SERVICE_BASE}/health")
-            deps["auth-service"] = DependencyHealth(
-                status="healthy" if r.status_code == 200 else "unhealthy",
-                error=None if r.status_code == 200 else f"HTTP {r.status_code}",
-            )
-    except Exception as e:
-        deps["auth-service"] = DependencyHealth(status="unhealthy", error=str(e))
-    # db
-    try:
-        for _ in get_session(): pass
-        db_ok = True
-    except Exception as e:
-        deps["database"] = DependencyHealth(status="unhealthy", error=str(e))
-        db_ok = False
-    overall: Status = "healthy" if all(d.status=="healthy" for d in deps.values()) and db_ok else "unhealthy"
-    return HealthResponse(service=APP_NAME, status=overall, dependencies=deps)
+async def health_check():
+    return health.snapshot()
+
+@app.get("/health/live")
+async def health_live():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready(response: Response):
+    if not health.ready():
+        response.status_code = 503
+        return {"status": "not ready"}
+    return {"status": "ready"}
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.render(APP_NAME), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/internal/http-pool")
+def http_pool_stats():
+    return http_client.stats()
+
+@app.get("/internal/admission")
+def admission_stats():
+    return admission.stats()
 
 # Minimal profile API used by others to validate existence
+# If-Match (optimistic concurrency): 412 unless the profile still has that ETag
 @app.post("/users/me/profile", status_code=201)
-def upsert_my_profile(body: ProfileCreate, user=Depends(verify_token), session: Session = Depends(get_session)):
+def upsert_my_profile(body: ProfileCreate, response: Response, user=Depends(verify_token),
+                      if_match: Optional[str] = Header(None), session: Session = Depends(get_session)):
     prof = session.exec(select(Profile).where(Profile.userId == user["user_id"])).first()
-    if prof:
+    etag.check_match(if_match, etag.of(prof.id, prof.created_at, prof.updated_at) if prof else None)
+    if prof and if_match:
+        # compare-and-set, so a concurrent update since the read above also fails the precondition
+        stmt = (update(Profile).where(Profile.id == prof.id, Profile.updated_at.is_not_distinct_from(prof.updated_at))
+                .values(display_name=body.display_name, bio=body.bio, updated_at=timestamps.now()))
+        if session.exec(stmt).rowcount == 0:
+            session.rollback()
+            raise HTTPException(status_code=412, detail="Precondition failed: the resource has changed")
+    elif prof:
         prof.display_name = body.display_name
         prof.bio = body.bio
-        prof.updated_at = datetime.now(timezone.utc).isoformat()
+        prof.updated_at = timestamps.now()
     else:
         prof = Profile(id=str(uuid.uuid4()), userId=user["user_id"], display_name=body.display_name, bio=body.bio)
         session.add(prof)
     session.commit(); session.refresh(prof)
+    response.headers["ETag"] = etag.of(prof.id, prof.created_at, prof.updated_at)
     return prof
 
-@app.get("/users/{user_id}")
-def get_profile_by_user_id(user_id: str, session: Session = Depends(get_session)):
-    prof = session.exec(select(Profile).where(Profile.userId == user_id)).first()
+# Profiles for many auth-service user ids in one query
+@app.get("/users:batchGet")
+def batch_get_profiles(ids: str = Query(..., description="Comma-separated user ids"), session: Session = Depends(get_read_session)):
+    wanted = parse_ids(ids)
+    found = {p.userId: p for p in session.exec(select(*Profile.__table__.c).where(Profile.userId.in_(wanted))).all()}
+    return responses.json({"items": responses.rows(found[i] for i in wanted if i in found),
+                           "missing": [i for i in wanted if i not in found]})
+
+# Strong ETag per profile; If-None-Match is checked against the version columns only
+@app.get("/users/{user_id}", response_model=ProfileOut)
+def get_profile_by_user_id(user_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+                           session: Session = Depends(get_read_session)):
+    if if_none_match:
+        row = session.exec(select(Profile.id, Profile.created_at, Profile.updated_at)
+                           .where(Profile.userId == user_id)).first()
+        if row and etag.none_match(if_none_match, etag.of(*row)):
+            response.headers["ETag"] = etag.of(*row)
+            return etag.not_modified(response)
+    prof = session.exec(select(*Profile.__table__.c).where(Profile.userId == user_id)).first()
     if not prof:
         raise HTTPException(status_code=404, detail="User profile not found")
-    return prof
+    response.headers["ETag"] = etag.of(prof.id, prof.created_at, prof.updated_at)
+    return responses.json(dict(prof._mapping), response)
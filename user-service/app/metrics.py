@@ -0,0 +1,183 @@
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+from sqlalchemy import event
+
+# Prometheus text-format metrics without a client library. Every metric object is created once
+# (routes when the middleware stack is built, engines at import, upstreams on first contact);
+# the request path only bumps counters on objects it already holds.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+_DB_OPS = ("select", "insert", "update", "delete")
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name: str, labels: str, out: List[str]) -> None:
+        acc = 0
+        for le, n in zip(BUCKETS, self.counts):
+            acc += n
+            out.append(f'{name}_bucket{{{labels},le="{le}"}} {acc}')
+        out.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        out.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        out.append(f"{name}_count{{{labels}}} {self.count}")
+
+
+class RequestMetrics:
+    __slots__ = ("latency", "in_flight", "statuses")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.in_flight = 0
+        self.statuses = [0] * len(_STATUS_CLASSES)
+
+    def done(self, seconds: float, status: int) -> None:
+        self.latency.observe(seconds)
+        self.statuses[min(max(status // 100, 1), 5) - 1] += 1
+
+
+class UpstreamMetrics:
+    __slots__ = ("latency", "errors")
+
+    def __init__(self):
+        self.latency = Histogram()  # time to response headers
+        self.errors = 0             # transport errors and timeouts, not HTTP error statuses
+
+
+_total = RequestMetrics()  # everything, including 404s that match no route
+_routes: Dict[Tuple[str, str], RequestMetrics] = {}
+_upstreams: Dict[str, UpstreamMetrics] = {}
+_db: Dict[Tuple[str, str], Histogram] = {}
+
+
+class _InstrumentedRoute:
+    __slots__ = ("app", "m")
+
+    def __init__(self, app, m: RequestMetrics):
+        self.app = app
+        self.m = m
+
+    async def __call__(self, scope, receive, send):
+        m = self.m
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        m.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            m.in_flight -= 1
+            m.done(time.perf_counter() - t0, status)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: service-wide totals here, per-route metrics on each route's app.
+
+    Starlette builds the middleware stack on the first request, after every route has been
+    registered, so the per-route objects are allocated exactly once, here."""
+
+    def __init__(self, app, router):
+        self.app = app
+        for route in router.routes:
+            methods = getattr(route, "methods", None)
+            if not methods or isinstance(route.app, _InstrumentedRoute):
+                continue
+            m = _routes.setdefault((",".join(sorted(methods)), route.path), RequestMetrics())
+            route.app = _InstrumentedRoute(route.app, m)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        _total.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            _total.in_flight -= 1
+            _total.done(time.perf_counter() - t0, status)
+
+
+def upstream(key: str) -> UpstreamMetrics:
+    # called once per upstream host:port by the http client transport, which keeps the object
+    m = _upstreams.get(key)
+    if m is None:
+        m = _upstreams[key] = UpstreamMetrics()
+    return m
+
+
+def instrument_engine(engine, pool: str) -> None:
+    hists = {op: _db.setdefault((pool, op), Histogram()) for op in _DB_OPS}
+    select_h, insert_h, update_h, delete_h = (hists[op] for op in _DB_OPS)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_t0 = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        t0 = getattr(context, "_metrics_t0", None)
+        if t0 is None:
+            return
+        h = insert_h if context.isinsert else update_h if context.isupdate else delete_h if context.isdelete else select_h
+        h.observe(time.perf_counter() - t0)
+
+
+def _render_requests(prefix: str, series: List[Tuple[str, RequestMetrics]], out: List[str]) -> None:
+    out.append(f"# TYPE {prefix}_duration_seconds histogram")
+    for labels, m in series:
+        m.latency.render(f"{prefix}_duration_seconds", labels, out)
+    out.append(f"# TYPE {prefix}_in_flight gauge")
+    out.extend(f"{prefix}_in_flight{{{labels}}} {m.in_flight}" for labels, m in series)
+    out.append(f"# TYPE {prefix}_responses_total counter")
+    for labels, m in series:
+        out.extend(f'{prefix}_responses_total{{{labels},status="{cls}"}} {n}'
+                   for cls, n in zip(_STATUS_CLASSES, m.statuses) if n)
+
+
+def render(service: str) -> str:
+    svc = f'service="{service}"'
+    out: List[str] = []
+    _render_requests("http_server_requests", [(svc, _total)], out)
+    _render_requests("http_route_requests",
+                     [(f'{svc},method="{method}",route="{path}"', m) for (method, path), m in _routes.items()], out)
+    upstreams = [(f'{svc},upstream="{key}"', m) for key, m in _upstreams.items()]
+    out.append("# TYPE http_client_requests_duration_seconds histogram")
+    for labels, m in upstreams:
+        m.latency.render("http_client_requests_duration_seconds", labels, out)
+    out.append("# TYPE http_client_errors_total counter")
+    out.extend(f"http_client_errors_total{{{labels}}} {m.errors}" for labels, m in upstreams)
+    out.append("# TYPE db_query_duration_seconds histogram")
+    for (pool, op), h in _db.items():
+        if h.count:
+            h.render("db_query_duration_seconds", f'{svc},pool="{pool}",op="{op}"', out)
+    out.append("")
+    return "\n".join(out)
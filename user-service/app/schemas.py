@@ -18,3 +18,13 @@ class ProfileCreate(BaseModel):
 class ProfileUpdate(BaseModel):
     display_name: Optional[str] = Field(None, min_length=1, max_length=80)
     bio: Optional[str] = Field(None, max_length=1000)
+
+# Response shape for the API docs only: read handlers return pre-rendered JSON, so FastAPI
+# never validates rows against it
+class ProfileOut(BaseModel):
+    id: str
+    userId: str
+    display_name: str
+    bio: Optional[str] = None
+    created_at: str
+    updated_at: Optional[str] = None
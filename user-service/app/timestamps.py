@@ -0,0 +1,94 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Union
+
+from fastapi import HTTPException
+from sqlalchemy import BigInteger
+from sqlalchemy.types import TypeDecorator
+
+# created_at / updated_at are stored as integer microseconds since the epoch (UTC): 8 bytes
+# instead of a 32-character string, compared as numbers, and range scans over the
+# (created_at) indexes are plain integer seeks. Everything above the database still sees
+# ISO-8601 strings: the Timestamp column type converts bound parameters (so `col >= "2025-..."`
+# filters, keyset cursors and ETags keep working unchanged) and rendered results.
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+log = logging.getLogger(__name__)
+
+def to_us(value: Union[str, int, datetime, None]) -> Optional[int]:
+    """ISO-8601 string (naive = UTC), datetime or epoch-µs int -> epoch µs."""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def to_iso(us: int) -> str:
+    # always with microseconds, so the strings sort like the numbers
+    return (EPOCH + timedelta(microseconds=us)).isoformat(timespec="microseconds")
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+def param(value: Optional[str], name: str) -> Optional[int]:
+    """A ?since= / ?until= query parameter; 400 unless it is ISO-8601."""
+    if value is None:
+        return None
+    try:
+        return to_us(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO-8601 timestamp")
+
+def between(stmt, column, since: Optional[str], until: Optional[str]):
+    """stmt limited to since <= column < until (query parameters, either may be None)."""
+    since, until = param(since, "since"), param(until, "until")
+    if since is not None:
+        stmt = stmt.where(column >= since)
+    if until is not None:
+        stmt = stmt.where(column < until)
+    return stmt
+
+class Timestamp(TypeDecorator):
+    impl = BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return to_us(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else to_iso(value)
+
+def migrate(engine, tables) -> None:
+    """Rewrites tables whose Timestamp columns are still the old ISO-string (VARCHAR) columns.
+    SQLite can't change a column's type, so the table is renamed, recreated from the model and
+    copied back with rowids kept (the full-text indexes point at them); dropping the old table
+    drops its indexes and triggers, which init_db / search.ensure_schema create again."""
+    for table in tables:
+        stamps = [c.name for c in table.columns if isinstance(c.type, Timestamp)]
+        if not stamps:
+            continue
+        with engine.connect() as conn:
+            dbapi = conn.connection.driver_connection
+            dbapi.create_function("iso_to_us", 1, to_us, deterministic=True)
+            conn.exec_driver_sql("BEGIN IMMEDIATE")  # rechecked under the write lock: replicas race here
+            declared = {r[1]: r[2].upper() for r in conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")')}
+            if all("INT" in declared.get(name, "INT") for name in stamps):
+                conn.rollback()
+                continue
+            old = f"{table.name}_iso"
+            for index in table.indexes:
+                conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{index.name}"')
+            conn.exec_driver_sql(f'ALTER TABLE "{table.name}" RENAME TO "{old}"')
+            table.create(conn)
+            names = [c.name for c in table.columns if c.name in declared]
+            cols = ", ".join(f'"{n}"' for n in names)
+            values = ", ".join(f'iso_to_us("{n}")' if n in stamps else f'"{n}"' for n in names)
+            copied = conn.exec_driver_sql(
+                f'INSERT INTO "{table.name}" (rowid, {cols}) SELECT rowid, {values} FROM "{old}"').rowcount
+            conn.exec_driver_sql(f'DROP TABLE "{old}"')
+            conn.commit()
+        log.info("%s: %d rows migrated to integer timestamps", table.name, copied)
@@ -0,0 +1,110 @@
+import os, json, time, asyncio, logging
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+import jwt
+from fastapi import HTTPException
+
+from . import http_client
+
+# In-process replacement for the POST /auth/verify round trip. Reproduces
+# auth-service/app/security.py::verify_token (same secret/algorithm env vars) and keeps
+# already-decoded tokens in a small LRU until they expire.
+
+AUTH_SERVICE_BASE = os.getenv("AUTH_SERVICE_BASE", "http://auth-service:8000")
+# "local" (default) verifies signatures in-process, "remote" falls back to calling auth-service
+AUTH_VERIFY_MODE = os.getenv("AUTH_VERIFY_MODE", "local").lower()
+JWT_SECRET = os.getenv("AUTH_SECRET_KEY") or os.getenv("JWT_SECRET", "dev-secret")
+JWT_ALG = os.getenv("AUTH_ALGORITHM", "HS256")
+# Asymmetric setups: a PEM public key or a JWKS file (key picked by the token's "kid")
+JWT_PUBLIC_KEY_FILE = os.getenv("AUTH_PUBLIC_KEY_FILE")
+JWT_JWKS_FILE = os.getenv("AUTH_JWKS_FILE")
+TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+REVOCATION_REFRESH_S = float(os.getenv("AUTH_REVOCATION_REFRESH_S", "30"))
+
+log = logging.getLogger(__name__)
+
+def _load_keys() -> Dict[Optional[str], Tuple[object, str]]:
+    """kid -> (key, algorithm). A None kid is the default key."""
+    if JWT_JWKS_FILE:
+        with open(JWT_JWKS_FILE) as f:
+            jwks = json.load(f)
+        keys = {}
+        for data in jwks.get("keys", []):
+            jwk = jwt.PyJWK(data, algorithm=data.get("alg", JWT_ALG))
+            keys[data.get("kid")] = (jwk.key, jwk.algorithm_name)
+        if len(keys) == 1:
+            keys[None] = next(iter(keys.values()))
+        return keys
+    if JWT_PUBLIC_KEY_FILE:
+        with open(JWT_PUBLIC_KEY_FILE) as f:
+            return {None: (f.read(), JWT_ALG)}
+    return {None: (JWT_SECRET, JWT_ALG)}
+
+_keys = _load_keys() if AUTH_VERIFY_MODE == "local" else {}
+# token -> (user dict, exp, jti); ordered oldest -> most recently used
+_cache: "OrderedDict[str, Tuple[Dict, int, Optional[str]]]" = OrderedDict()
+_revoked: Set[str] = set()
+_refresh_task: Optional[asyncio.Task] = None
+
+def _decode(token: str) -> Dict:
+    kid = jwt.get_unverified_header(token).get("kid") if len(_keys) > 1 else None
+    if kid not in _keys:
+        raise jwt.InvalidKeyError(f"Unknown key id: {kid}")
+    key, alg = _keys[kid]
+    return jwt.decode(token, key, algorithms=[alg], options={"require": ["exp", "sub"]})
+
+def verify_local(token: str) -> Dict:
+    """Returns {"user_id", "email"} like /auth/verify, raising 401 on bad tokens."""
+    now = int(time.time())
+    hit = _cache.get(token)
+    if hit is not None:
+        user, exp, jti = hit
+        if exp > now:
+            if jti in _revoked:
+                raise HTTPException(status_code=401, detail="Invalid token: token revoked")
+            _cache.move_to_end(token)
+            return user
+        del _cache[token]
+    try:
+        claims = _decode(token)
+        user = {"user_id": claims["sub"], "email": claims["email"]}
+    except (jwt.InvalidTokenError, KeyError, ValueError) as e:
+        raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
+    jti = claims.get("jti")
+    if jti in _revoked:
+        raise HTTPException(status_code=401, detail="Invalid token: token revoked")
+    _cache[token] = (user, int(claims["exp"]), jti)
+    if len(_cache) > TOKEN_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return user
+
+async def refresh_revocations() -> None:
+    global _revoked
+    r = await http_client.get_client().get(f"{AUTH_SERVICE_BASE}/auth/revocations")
+    r.raise_for_status()
+    _revoked = set(r.json().get("revoked", []))
+
+async def _refresh_loop() -> None:
+    while True:
+        try:
+            await refresh_revocations()
+        except Exception as e:
+            # keep serving with the last known list; auth-service may just be restarting
+            log.warning("revocation list refresh failed: %s", e)
+        await asyncio.sleep(REVOCATION_REFRESH_S)
+
+def start() -> None:
+    global _refresh_task
+    if AUTH_VERIFY_MODE == "local" and _refresh_task is None:
+        _refresh_task = asyncio.get_running_loop().create_task(_refresh_loop())
+
+async def stop() -> None:
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None